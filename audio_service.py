@@ -0,0 +1,386 @@
+import io
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from ffmpeg_pool import ffmpeg_pool, stream_pool
+from metrics_service import AUDIO_SECONDS, FFMPEG_TIMEOUTS
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Formato del audio extraído: "flac" (sin pérdida) u "opus" (más compacto)
+AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "flac")
+# Límite de subida de Whisper en Groq: un audio mayor se transcribe por tramos
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", 25 * 1024 * 1024))
+# Duración máxima de un video (la comprueba preflight_service y acota los buffers de audio)
+MAX_VIDEO_SECONDS = float(os.getenv("MAX_VIDEO_SECONDS", 30 * 60))
+# Bytes iniciales que se inspeccionan para decidir si el contenedor se puede leer desde un pipe
+SNIFF_BYTES = 64 * 1024
+# Tiempo máximo de un proceso FFmpeg y tiempo máximo sin leer ni escribir nada antes de matarlo
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", 600))
+FFMPEG_IDLE_TIMEOUT = float(os.getenv("FFMPEG_IDLE_TIMEOUT", 60))
+
+# PCM interno: 16 kHz, mono, 16 bits con signo
+SAMPLE_RATE = 16000
+PCM_BYTES_PER_SECOND = SAMPLE_RATE * 2
+_PCM_INPUT_ARGS = ["-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1"]
+
+# Buffers en memoria para MAX_VIDEO_SECONDS de audio, con margen: PCM sin comprimir y audio
+# extraído, que en el peor caso (FLAC de ruido) ocupa algo más que el PCM
+MAX_PCM_BYTES = int(MAX_VIDEO_SECONDS * PCM_BYTES_PER_SECOND * 1.05)
+MAX_EXTRACTED_AUDIO_BYTES = int(MAX_PCM_BYTES * 1.1)
+
+_OUTPUT_ARGS = {
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    "opus": ["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"]
+}
+AUDIO_MIME_TYPES = {"flac": "audio/flac", "opus": "audio/ogg"}
+AUDIO_FILENAMES = {"flac": "audio.flac", "opus": "audio.ogg"}
+
+class AudioExtractionError(Exception):
+    """Error al extraer el audio de un video con FFmpeg"""
+
+class AudioExtractionLimitError(AudioExtractionError):
+    """FFmpeg se detuvo por un límite del servicio, no por el contenido del video
+
+    `reason` es "timeout" (FFMPEG_TIMEOUT), "idle" (FFMPEG_IDLE_TIMEOUT sin actividad)
+    u "output_limit" (la salida supera el buffer máximo).
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+class FileTooLargeError(Exception):
+    """El archivo copiado supera el máximo de bytes permitido"""
+
+    def __init__(self, limit):
+        super().__init__(f"El archivo supera el máximo de {limit} bytes")
+        self.limit = limit
+
+def save_upload(source, suffix=".mp4", max_bytes=None):
+    """Copia el archivo subido a un temporal calculando su SHA-256 al vuelo (bloqueante, usar en un hilo)
+
+    Devuelve (ruta, hash_hex, tamaño_en_bytes). Con `max_bytes` deja de copiar en cuanto
+    se supera, borra el temporal y lanza FileTooLargeError.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                temp_file.close()
+                remove_files(temp_file.name)
+                raise FileTooLargeError(max_bytes)
+            digest.update(chunk)
+            temp_file.write(chunk)
+        return temp_file.name, digest.hexdigest(), size
+
+def hash_fileobj(source):
+    """SHA-256 y tamaño de un archivo abierto, dejándolo rebobinado (bloqueante, usar en un hilo)"""
+    digest = hashlib.sha256()
+    size = 0
+    source.seek(0)
+    for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    source.seek(0)
+    return digest.hexdigest(), size
+
+def peek(source, size=SNIFF_BYTES):
+    """Lee los primeros bytes de un archivo abierto sin consumirlos (bloqueante, usar en un hilo)"""
+    source.seek(0)
+    head = source.read(size)
+    source.seek(0)
+    return head
+
+def remove_files(*paths):
+    """Elimina archivos temporales ignorando los que ya no existen"""
+    for path in paths:
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+def open_file_path(source):
+    """Ruta /dev/fd/N con la que un proceso hijo abre un archivo ya abierto; devuelve (ruta, fd) o None
+
+    Permite que FFmpeg lea con acceso aleatorio el temporal sin nombre en que Starlette
+    vuelca las subidas, sin copiarlo a otro archivo (el fd se pasa al hijo con pass_fds).
+    None si el objeto no tiene descriptor (p. ej. BytesIO) o el sistema no expone /dev/fd.
+    """
+    if not os.path.isdir("/dev/fd"):
+        return None
+    try:
+        # En un SpooledTemporaryFile, fileno() lo vuelca a disco si aún estaba en memoria
+        fd = source.fileno()
+        source.flush()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return f"/dev/fd/{fd}", fd
+
+# Cajas que pueden abrir un MP4/MOV; los QuickTime antiguos empiezan sin ftyp
+_MP4_LEADING_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+def needs_seekable_input(head):
+    """Indica si el contenedor necesita acceso aleatorio (MP4/MOV con el átomo moov al final)
+
+    FFmpeg no puede leer desde un pipe un MP4 cuyo índice (moov) está después de los datos
+    (mdat); en ese caso hay que pasar por un archivo en disco.
+    """
+    if len(head) < 8 or head[4:8] not in _MP4_LEADING_BOXES:
+        return False
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], "big")
+        box_type = head[offset + 4:offset + 8]
+        if box_type == b"moov":
+            return False
+        if box_type == b"mdat":
+            return True
+        if size == 1:
+            # Tamaño extendido de 64 bits
+            if offset + 16 > len(head):
+                return True
+            size = int.from_bytes(head[offset + 8:offset + 16], "big")
+        if size < 8:
+            return True
+        offset += size
+    # No se encontró moov en la cabecera: usar archivo temporal por seguridad
+    return True
+
+_ffmpeg_version = None
+
+async def ffmpeg_version():
+    """Primera línea de `ffmpeg -version`, o None si FFmpeg no se puede ejecutar (el acierto se cachea)"""
+    global _ffmpeg_version
+    if _ffmpeg_version is None:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_BIN, "-version", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError:
+            return None
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return None
+        if process.returncode == 0 and stdout:
+            _ffmpeg_version = stdout.decode(errors="replace").splitlines()[0]
+    return _ffmpeg_version
+
+def _extraction_args(input_spec):
+    return [
+        FFMPEG_BIN, "-hide_banner", "-nostdin", "-i", input_spec, "-vn", "-map_metadata", "-1",
+        "-fflags", "+bitexact", "-flags:a", "+bitexact", "-ar", "16000", "-ac", "1",
+        *_OUTPUT_ARGS[AUDIO_FORMAT], "pipe:1"
+    ]
+
+async def _iter_bytes(data):
+    for offset in range(0, len(data), COPY_CHUNK_SIZE):
+        yield data[offset:offset + COPY_CHUNK_SIZE]
+
+async def _run_ffmpeg(args, chunks=None, max_output=MAX_EXTRACTED_AUDIO_BYTES, stderr_limit=4000, pool=ffmpeg_pool,
+                      pass_fds=()):
+    """Ejecuta FFmpeg alimentando stdin con `chunks`; devuelve (stdout, cola de stderr)
+
+    stdout se acumula en un buffer acotado por max_output. Con un `pool` el proceso
+    espera plaza en él (compartido entre workers) y se limita a sus hilos; con None
+    se ejecuta directamente. `pass_fds` son descriptores que hereda el proceso.
+    """
+    if pool is None:
+        return await _run_process(args, chunks, max_output, stderr_limit, pass_fds)
+    async with pool.slot():
+        return await _run_process(
+            [args[0], "-threads", str(pool.threads), *args[1:]], chunks, max_output, stderr_limit, pass_fds
+        )
+
+async def _run_process(args, chunks, max_output, stderr_limit, pass_fds=()):
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if chunks is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=pass_fds
+    )
+    started = last_activity = time.monotonic()
+
+    async def feed():
+        nonlocal last_activity
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+                last_activity = time.monotonic()
+        except (BrokenPipeError, ConnectionResetError):
+            # FFmpeg terminó antes de tiempo; el error se reporta con su código de salida
+            pass
+        finally:
+            process.stdin.close()
+
+    async def read_stdout():
+        nonlocal last_activity
+        buffer = bytearray()
+        while True:
+            data = await process.stdout.read(COPY_CHUNK_SIZE)
+            if not data:
+                return bytes(buffer)
+            last_activity = time.monotonic()
+            buffer += data
+            if len(buffer) > max_output:
+                raise AudioExtractionLimitError(
+                    f"La salida de FFmpeg supera el límite de {max_output} bytes", "output_limit"
+                )
+
+    async def read_stderr():
+        nonlocal last_activity
+        tail = b""
+        progress = None
+        while True:
+            data = await process.stderr.read(COPY_CHUNK_SIZE)
+            if not data:
+                return tail
+            # La línea de estadísticas se repite aunque FFmpeg esté bloqueado: solo cuenta si avanza
+            times = re.findall(rb"time=(\S+)", data)
+            if not times or times[-1] != progress:
+                last_activity = time.monotonic()
+                progress = times[-1] if times else progress
+            tail = (tail + data)[-stderr_limit:]
+
+    async def watchdog():
+        """Falla si el proceso supera FFMPEG_TIMEOUT o pasa FFMPEG_IDLE_TIMEOUT sin actividad"""
+        while True:
+            now = time.monotonic()
+            if now - started > FFMPEG_TIMEOUT:
+                FFMPEG_TIMEOUTS.labels("total").inc()
+                raise AudioExtractionLimitError(f"FFmpeg superó el tiempo límite de {FFMPEG_TIMEOUT:.0f} s", "timeout")
+            if now - last_activity > FFMPEG_IDLE_TIMEOUT:
+                FFMPEG_TIMEOUTS.labels("idle").inc()
+                raise AudioExtractionLimitError(f"FFmpeg lleva {FFMPEG_IDLE_TIMEOUT:.0f} s sin actividad", "idle")
+            await asyncio.sleep(min(1.0, FFMPEG_IDLE_TIMEOUT / 4))
+
+    async def communicate():
+        output, stderr, *_ = await asyncio.gather(*tasks)
+        await process.wait()
+        return output, stderr
+
+    tasks = [asyncio.create_task(read_stdout()), asyncio.create_task(read_stderr())]
+    if chunks is not None:
+        tasks.append(asyncio.create_task(feed()))
+    work = asyncio.create_task(communicate())
+    watch = asyncio.create_task(watchdog())
+    try:
+        await asyncio.wait({work, watch}, return_when=asyncio.FIRST_COMPLETED)
+        if not work.done():
+            # El watchdog solo termina con una excepción: se propaga y se mata el proceso
+            watch.result()
+        output, stderr = work.result()
+    except BaseException:
+        for task in [*tasks, work]:
+            task.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    finally:
+        watch.cancel()
+
+    stderr = stderr.decode(errors="replace")
+    if process.returncode != 0:
+        raise AudioExtractionError(f"FFmpeg terminó con código {process.returncode}: {stderr[-1000:]}")
+    return output, stderr
+
+async def _run_to_memory(args, chunks=None):
+    output, _ = await _run_ffmpeg(args, chunks)
+    return output
+
+async def probe_media(input_spec="pipe:0", chunks=None):
+    """Lee el contenedor y las pistas con ffprobe sin decodificar; devuelve {"format", "streams"}
+
+    Con input_spec="pipe:0" se alimenta stdin con `chunks` hasta que ffprobe tiene lo que
+    necesita. Lanza AudioExtractionError si ffprobe no reconoce la entrada y OSError si
+    ffprobe no está instalado.
+    """
+    args = [
+        FFPROBE_BIN, "-hide_banner", "-v", "error", "-print_format", "json",
+        "-show_entries", "format=format_name,duration:stream=index,codec_type,codec_name,channels,sample_rate,duration",
+        "-i", input_spec
+    ]
+    # Una lectura de cabeceras no compite por las plazas de FFmpeg
+    output, _ = await _run_ffmpeg(args, chunks, max_output=1024 * 1024, pool=None)
+    return json.loads(output or b"{}")
+
+def _output_seconds(stderr):
+    """Duración del audio escrito según la última línea de progreso de FFmpeg (time=HH:MM:SS.xx)"""
+    matches = re.findall(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if not matches:
+        return 0.0
+    hours, minutes, seconds = matches[-1]
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+async def _extract_to_memory(args, chunks=None, pool=ffmpeg_pool, pass_fds=()):
+    output, stderr = await _run_ffmpeg(args, chunks, pool=pool, pass_fds=pass_fds)
+    seconds = _output_seconds(stderr)
+    AUDIO_SECONDS.inc(seconds)
+    # Sin línea de progreso la duración se desconoce (None), no es cero
+    return output, seconds or None
+
+async def extract_audio_file(video_path, pass_fds=()):
+    """Extrae el audio (16 kHz mono, FLAC/Opus) de un video en disco; devuelve (audio, segundos)
+
+    La salida es bit-exacta y sin metadatos del contenedor de origen, de modo que el
+    mismo audio produce los mismos bytes aunque venga en otro contenedor. La duración
+    sale del progreso de FFmpeg, sin tener que decodificar el audio otra vez. Con una
+    ruta de open_file_path, `pass_fds` lleva su descriptor.
+    """
+    return await _extract_to_memory(_extraction_args(video_path), pass_fds=pass_fds)
+
+async def extract_audio_stream(chunks, client_paced=False):
+    """Extrae el audio enviando el video a FFmpeg por stdin a medida que llegan los bloques
+
+    Devuelve (audio, segundos) como extract_audio_file. Con client_paced=True los bloques llegan al ritmo de la red del cliente y el proceso
+    ocupa una plaza de stream_pool en lugar de una de ffmpeg_pool.
+    """
+    pool = stream_pool if client_paced else ffmpeg_pool
+    return await _extract_to_memory(_extraction_args("pipe:0"), chunks, pool)
+
+async def decode_pcm(audio_bytes):
+    """Decodifica el audio extraído a PCM s16le 16 kHz mono crudo"""
+    args = [
+        FFMPEG_BIN, "-hide_banner", "-nostdin", "-i", "pipe:0", *_PCM_INPUT_ARGS, "pipe:1"
+    ]
+    # Un PCM sin comprimir ocupa varias veces lo que el FLAC/Opus de entrada
+    output, _ = await _run_ffmpeg(args, _iter_bytes(audio_bytes), max_output=MAX_PCM_BYTES)
+    return output
+
+async def encode_pcm(pcm):
+    """Codifica PCM s16le 16 kHz mono al formato de audio configurado (FLAC/Opus)"""
+    args = [
+        FFMPEG_BIN, "-hide_banner", "-nostdin", *_PCM_INPUT_ARGS, "-i", "pipe:0",
+        "-map_metadata", "-1", "-fflags", "+bitexact", "-flags:a", "+bitexact",
+        *_OUTPUT_ARGS[AUDIO_FORMAT], "pipe:1"
+    ]
+    return await _run_to_memory(args, _iter_bytes(pcm))
+
+async def detect_silences(pcm, noise_db=-35, min_duration=0.4):
+    """Localiza silencios en el PCM con el filtro silencedetect; devuelve [(inicio, fin)] en segundos"""
+    args = [
+        FFMPEG_BIN, "-hide_banner", "-nostdin", "-nostats", *_PCM_INPUT_ARGS, "-i", "pipe:0",
+        "-af", f"silencedetect=noise={noise_db}dB:d={min_duration}", "-f", "null", "-"
+    ]
+    _, stderr = await _run_ffmpeg(args, _iter_bytes(pcm), stderr_limit=4 * 1024 * 1024)
+    starts = [float(value) for value in re.findall(r"silence_start: (-?[\d.]+)", stderr)]
+    ends = [float(value) for value in re.findall(r"silence_end: ([\d.]+)", stderr)]
+    duration = len(pcm) / PCM_BYTES_PER_SECOND
+    # Un silencio que llega hasta el final no tiene silence_end
+    ends += [duration] * (len(starts) - len(ends))
+    return [(max(start, 0.0), end) for start, end in zip(starts, ends)]
@@ -0,0 +1,130 @@
+import os
+import asyncio
+import logging
+import zipfile
+from audio_service import FileTooLargeError, save_upload, remove_files
+from preflight_service import MAX_UPLOAD_BYTES, MAX_BATCH_BYTES, MediaRejectedError, UploadTooLargeError
+
+logger = logging.getLogger(__name__)
+
+# Videos de un mismo lote procesándose a la vez (las etapas tienen además sus límites globales)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 50))
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".mkv", ".webm", ".avi", ".mpeg", ".mpg", ".3gp")
+
+class BatchError(Exception):
+    """El lote no se puede procesar (demasiados archivos, zip inválido o vacío)"""
+
+def _is_zip(filename, content_type):
+    return (filename or "").lower().endswith(".zip") or content_type in (
+        "application/zip", "application/x-zip-compressed"
+    )
+
+def _suffix(filename):
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if extension in VIDEO_EXTENSIONS else ".mp4"
+
+def _expand_zip(source, max_total=MAX_BATCH_BYTES):
+    """Copia a temporales los videos de un zip; devuelve [(nombre, ruta, hash, tamaño)] (bloqueante)
+
+    Cada video descomprimido se limita a MAX_UPLOAD_BYTES y el conjunto a `max_total`,
+    comprobando el tamaño declarado en el zip y también los bytes realmente copiados.
+    """
+    items = []
+    total = 0
+    try:
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.infolist():
+                name = member.filename
+                if member.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                    continue
+                if not name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                if len(items) >= BATCH_MAX_FILES:
+                    raise BatchError(f"El lote supera el máximo de {BATCH_MAX_FILES} videos")
+                if member.file_size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLargeError(MAX_UPLOAD_BYTES)
+                if total + member.file_size > max_total:
+                    raise UploadTooLargeError(max_total)
+                limit = min(MAX_UPLOAD_BYTES, max_total - total)
+                try:
+                    with archive.open(member) as member_file:
+                        path, video_hash, size = save_upload(member_file, _suffix(name), max_bytes=limit)
+                except FileTooLargeError:
+                    raise UploadTooLargeError(MAX_UPLOAD_BYTES if limit == MAX_UPLOAD_BYTES else max_total) from None
+                total += size
+                items.append((name, path, video_hash, size))
+    except zipfile.BadZipFile as e:
+        remove_files(*(item[1] for item in items))
+        raise BatchError(f"Archivo zip inválido: {str(e)}") from e
+    except BaseException:
+        remove_files(*(item[1] for item in items))
+        raise
+    return items
+
+def save_batch(uploads):
+    """Guarda en temporales los videos de un lote (varios archivos y/o zips) (bloqueante, usar en un hilo)
+
+    `uploads` es una lista de (nombre, content_type, archivo_abierto). Devuelve una lista
+    de diccionarios con filename, path, video_hash y video_size. Cada video se limita a
+    MAX_UPLOAD_BYTES y el lote completo, sueltos y descomprimidos, a MAX_BATCH_BYTES.
+    """
+    items = []
+    try:
+        for filename, content_type, source in uploads:
+            used = sum(item["video_size"] for item in items)
+            if _is_zip(filename, content_type):
+                expanded = _expand_zip(source, MAX_BATCH_BYTES - used)
+            else:
+                limit = min(MAX_UPLOAD_BYTES, MAX_BATCH_BYTES - used)
+                try:
+                    expanded = [(filename, *save_upload(source, _suffix(filename), max_bytes=limit))]
+                except FileTooLargeError:
+                    raise UploadTooLargeError(MAX_UPLOAD_BYTES if limit == MAX_UPLOAD_BYTES else MAX_BATCH_BYTES) from None
+            items += [
+                {"filename": name, "path": path, "video_hash": video_hash, "video_size": size}
+                for name, path, video_hash, size in expanded
+            ]
+            if len(items) > BATCH_MAX_FILES:
+                raise BatchError(f"El lote supera el máximo de {BATCH_MAX_FILES} videos")
+    except BaseException:
+        remove_files(*(item["path"] for item in items))
+        raise
+    if not items:
+        raise BatchError("El lote no contiene videos")
+    return items
+
+async def process_batch(items, handler, concurrency=BATCH_CONCURRENCY, **options):
+    """Procesa los videos del lote con `handler` y genera un resultado por video a medida que terminan
+
+    Un video que falla no detiene el resto: su resultado lleva status "failed" y el error.
+    Los temporales se eliminan al terminar cada video, o todos si el consumidor abandona.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, item):
+        async with semaphore:
+            try:
+                result = await handler(
+                    item["path"], video_hash=item["video_hash"], video_size=item["video_size"], **options
+                )
+                return {"index": index, "filename": item["filename"], "status": "done", "result": result}
+            except MediaRejectedError as e:
+                logger.info("Video %s del lote rechazado: %s", item["filename"], e)
+                return {"index": index, "filename": item["filename"], "status": "failed", **e.to_dict()}
+            except Exception as e:
+                logger.error("Error procesando %s del lote: %s", item["filename"], e)
+                return {"index": index, "filename": item["filename"], "status": "failed", "error": str(e)}
+            finally:
+                await asyncio.to_thread(remove_files, item["path"])
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(remove_files, *(item["path"] for item in items))
@@ -0,0 +1,65 @@
+"""Compara dos resultados de run_benchmark.py y marca las regresiones
+
+Sale con código 1 si alguna métrica empeora más que la tolerancia, para poder usarlo
+en CI o antes de fusionar un cambio de rendimiento.
+
+Uso:
+    python benchmarks/compare.py base.json nuevo.json --tolerance 0.10
+"""
+import sys
+import json
+import argparse
+
+def _metrics(report):
+    """Aplana las métricas comparables: nombre → (valor, True si mayor es mejor)"""
+    results = report["results"]
+    metrics = {
+        "requests_per_second": (results.get("requests_per_second"), True),
+        "failed": (results.get("failed"), False),
+        "llm_prompt_tokens_per_request": (results.get("llm_prompt_tokens_per_request"), False),
+        "peak_rss_bytes": (results.get("peak_rss_bytes"), False),
+        "peak_temp_disk_bytes": (results.get("peak_temp_disk_bytes"), False)
+    }
+    for quantile in ("p50", "p95", "p99"):
+        metrics[f"latency.{quantile}"] = ((results.get("latency_seconds") or {}).get(quantile), False)
+        for section in ("stages", "providers", "llm_tasks"):
+            for name, values in (results.get(section) or {}).items():
+                metrics[f"{section}.{name}.{quantile}"] = (values.get(quantile), False)
+    return metrics
+
+def compare(base, new, tolerance):
+    """Devuelve [(métrica, base, nuevo, cambio relativo, es_regresión)]"""
+    base_metrics, new_metrics = _metrics(base), _metrics(new)
+    rows = []
+    for name in sorted(base_metrics.keys() & new_metrics.keys()):
+        (before, higher_is_better), (after, _) = base_metrics[name], new_metrics[name]
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else (0.0 if after == before else float("inf"))
+        worse = -change if higher_is_better else change
+        rows.append((name, before, after, change, worse > tolerance))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dos resultados de benchmark")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento relativo permitido (0.10 = 10 %%)")
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+
+    rows = compare(base, new, args.tolerance)
+    width = max((len(row[0]) for row in rows), default=10)
+    for name, before, after, change, regression in rows:
+        flag = "  REGRESIÓN" if regression else ""
+        print(f"{name:<{width}}  {before:>14.4f}  {after:>14.4f}  {change:>+8.1%}{flag}")
+
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print(f"\n{len(regressions)} métrica(s) empeoran más de {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Servidor HTTP local que imita las APIs de Groq (OpenAI compatible) y Gemini (REST)
+
+Permite medir el servicio sin gastar créditos: responde transcripciones, perfiles JSON
+válidos y texto de CV (con y sin streaming), con latencia y errores configurables.
+
+Uso:
+    python benchmarks/fake_providers.py --port 8765 --latency-ms 200 --error-rate 0.05
+
+y en el servicio:
+    GROQ_BASE_URL=http://127.0.0.1:8765 GEMINI_BASE_URL=http://127.0.0.1:8765
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+# Configuración de la simulación; se sobrescribe desde la línea de comandos
+CONFIG = {
+    "latency_ms": 200.0,
+    "jitter_ms": 50.0,
+    "transcribe_ms_per_mb": 300.0,
+    "error_rate": 0.0,
+    "error_status": 500,
+    "stream_chunk_ms": 20.0,
+    # Latencia adicional del chat por cada 1000 tokens de entrada
+    "chat_ms_per_1k_tokens": 0.0,
+    # Palabras de transcripción por MB de audio para simular grabaciones largas (0: texto fijo)
+    "transcript_words_per_mb": 0,
+    "seed": None
+}
+
+TRANSCRIPTION = (
+    "Hola, me llamo Ana Pérez, soy ingeniera de software con ocho años de experiencia en desarrollo "
+    "backend con Python y Go. Estudié Ingeniería de Sistemas, hablo español, inglés y francés, y lideré "
+    "la migración a microservicios de una plataforma de pagos."
+)
+
+PROFILE = {
+    "nombre": "Ana Pérez",
+    "profesion": "Ingeniera de software",
+    "experiencia": "Ocho años en desarrollo backend y microservicios",
+    "educacion": "Ingeniería de Sistemas",
+    "tecnologias": "Python, Go",
+    "idiomas": "Español, inglés, francés",
+    "logros": "Migración a microservicios de una plataforma de pagos",
+    "habilidades_blandas": "Liderazgo, comunicación"
+}
+
+CV_TEXT = (
+    "Ingeniera de software con ocho años de experiencia en desarrollo backend y arquitecturas de "
+    "microservicios. Formación en Ingeniería de Sistemas, con dominio de Python y Go. Comunicación "
+    "efectiva en español, inglés y francés. Reconocida por liderar la migración de una plataforma de pagos."
+)
+
+FILLER_SENTENCES = [
+    "Eh, en mi trabajo actual coordino un equipo de cinco personas y, bueno, hacemos revisiones de código cada semana.",
+    "Mmm, también participé en proyectos de datos con Kubernetes y servicios en la nube.",
+    "Me gusta aprender cosas nuevas y compartir lo que sé con el equipo.",
+    "En la universidad hice una especialización en arquitectura de software."
+]
+
+def _transcription(audio_bytes):
+    """Transcripción fija o, con transcript_words_per_mb, proporcional al tamaño del audio"""
+    words = int(CONFIG["transcript_words_per_mb"] * audio_bytes / (1024 * 1024))
+    if words <= 0:
+        return TRANSCRIPTION
+    sentences = [TRANSCRIPTION]
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentences.append(FILLER_SENTENCES[len(sentences) % len(FILLER_SENTENCES)])
+    return " ".join(sentences)
+
+app = FastAPI()
+stats = {"requests": 0, "errors": 0}
+
+async def _simulate(extra_ms=0.0):
+    """Espera la latencia configurada; devuelve una respuesta de error si toca inyectarlo"""
+    stats["requests"] += 1
+    delay = CONFIG["latency_ms"] + extra_ms + random.uniform(-CONFIG["jitter_ms"], CONFIG["jitter_ms"])
+    await asyncio.sleep(max(delay, 0) / 1000)
+    if random.random() < CONFIG["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse(
+            content={"error": {"message": "Error inyectado por el servidor falso", "type": "server_error"}},
+            status_code=CONFIG["error_status"]
+        )
+    return None
+
+def _chat_content(text):
+    """Elige la respuesta según el prompt: perfil JSON, perfil + CV fusionado o texto de CV"""
+    if "perfil_cv" in text:
+        return json.dumps({**PROFILE, "perfil_cv": CV_TEXT}, ensure_ascii=False)
+    if "JSON" in text:
+        return json.dumps(PROFILE, ensure_ascii=False)
+    return CV_TEXT
+
+def _prompt_tokens(text):
+    # Aproximación de ~4 caracteres por token, para que el uso reportado siga al tamaño del prompt
+    return max(len(text) // 4, 1)
+
+def _words(text):
+    words = text.split(" ")
+    return [word + (" " if index < len(words) - 1 else "") for index, word in enumerate(words)]
+
+@app.post("/openai/v1/audio/transcriptions")
+async def groq_transcription(request: Request):
+    body = await request.body()
+    error = await _simulate(CONFIG["transcribe_ms_per_mb"] * len(body) / (1024 * 1024))
+    if error is not None:
+        return error
+    return PlainTextResponse(_transcription(len(body)))
+
+@app.post("/openai/v1/chat/completions")
+async def groq_chat(request: Request):
+    body = await request.json()
+    prompt = " ".join(message["content"] for message in body["messages"])
+    prompt_tokens = _prompt_tokens(prompt)
+    error = await _simulate(CONFIG["chat_ms_per_1k_tokens"] * prompt_tokens / 1000)
+    if error is not None:
+        return error
+    content = _chat_content(prompt)
+    usage = {
+        "prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+        "total_tokens": prompt_tokens + len(content) // 4
+    }
+
+    if not body.get("stream"):
+        return {
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    async def chunks():
+        for word in _words(content):
+            await asyncio.sleep(CONFIG["stream_chunk_ms"] / 1000)
+            chunk = {
+                "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        final = {
+            "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+def _gemini_response(text, prompt_tokens=600):
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": prompt_tokens + len(text) // 4
+        }
+    }
+
+@app.post("/v1beta/models/{target}")
+async def gemini_generate(target: str, request: Request):
+    """generateContent y streamGenerateContent (el modelo y el método van en el mismo segmento)"""
+    body = await request.body()
+    payload = json.loads(body)
+    parts = [part for content in payload.get("contents", []) for part in content.get("parts", [])]
+    has_audio = any("inlineData" in part or "inline_data" in part for part in parts)
+    prompt = " ".join(part.get("text", "") for part in parts)
+    error = await _simulate(
+        CONFIG["transcribe_ms_per_mb"] * len(body) / (1024 * 1024) if has_audio
+        else CONFIG["chat_ms_per_1k_tokens"] * _prompt_tokens(prompt) / 1000
+    )
+    if error is not None:
+        return error
+
+    if has_audio:
+        # El audio llega en base64: ~4/3 del tamaño original
+        content = _transcription(len(body) * 3 // 4)
+    else:
+        content = _chat_content(prompt)
+        if payload.get("generationConfig", {}).get("responseMimeType") == "application/json" and not content.startswith("{"):
+            content = json.dumps(PROFILE, ensure_ascii=False)
+
+    if not target.endswith(":streamGenerateContent"):
+        return _gemini_response(content, _prompt_tokens(prompt))
+
+    async def chunks():
+        # El transporte REST del SDK lee un array JSON que llega por partes
+        yield "["
+        for index, word in enumerate(_words(content)):
+            await asyncio.sleep(CONFIG["stream_chunk_ms"] / 1000)
+            yield ("," if index else "") + json.dumps(_gemini_response(word, _prompt_tokens(prompt)), ensure_ascii=False)
+        yield "]"
+
+    return StreamingResponse(chunks(), media_type="application/json")
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Proveedores falsos de Groq y Gemini para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=CONFIG["jitter_ms"])
+    parser.add_argument("--transcribe-ms-per-mb", type=float, default=CONFIG["transcribe_ms_per_mb"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    parser.add_argument("--error-status", type=int, default=CONFIG["error_status"])
+    parser.add_argument("--stream-chunk-ms", type=float, default=CONFIG["stream_chunk_ms"])
+    parser.add_argument("--chat-ms-per-1k-tokens", type=float, default=CONFIG["chat_ms_per_1k_tokens"])
+    parser.add_argument("--transcript-words-per-mb", type=int, default=CONFIG["transcript_words_per_mb"])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    CONFIG.update({key: value for key, value in vars(args).items() if key in CONFIG})
+    if args.seed is not None:
+        random.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Genera videos sintéticos con FFmpeg para los benchmarks
+
+El audio alterna tono y silencio (3 s / 1 s) para que la segmentación por silencios
+tenga dónde cortar; el video es testsrc2. Cada variante combina duración, contenedor
+/códec y bitrate.
+
+Uso:
+    python benchmarks/generate_videos.py --output-dir /tmp/bench-videos --durations 10 60 --codecs mp4 webm
+"""
+import os
+import argparse
+import subprocess
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+
+# contenedor/códec → (extensión, argumentos de codificación)
+CODECS = {
+    # MP4 con el índice (moov) al final: obliga al servicio a pasar por un temporal
+    "mp4": (".mp4", ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac"]),
+    "mp4-faststart": (".mp4", ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-movflags", "+faststart"]),
+    "webm": (".webm", ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-c:a", "libopus"]),
+    "mkv": (".mkv", ["-c:v", "mpeg4", "-c:a", "aac"]),
+    "mov": (".mov", ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac"])
+}
+
+DEFAULT_DURATIONS = [10, 60]
+DEFAULT_CODECS = ["mp4", "mp4-faststart", "webm"]
+DEFAULT_BITRATES = ["500k"]
+
+def video_name(duration, codec, bitrate):
+    return f"synthetic_{duration}s_{codec}_{bitrate}{CODECS[codec][0]}"
+
+def generate_video(path, duration, codec, bitrate, size="640x360"):
+    """Codifica un video sintético de `duration` segundos en `path` (omite los que ya existen)"""
+    if os.path.exists(path):
+        return path
+    extension, codec_args = CODECS[codec]
+    # Se escribe a un parcial para no dejar videos truncados si se interrumpe
+    temp_path = f"{path}.part{extension}"
+    subprocess.run([
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"aevalsrc='0.5*sin(2*PI*440*t)*lt(mod(t,4),3)':s=44100:d={duration}",
+        *codec_args, "-b:v", bitrate, "-b:a", "64k", "-shortest", temp_path
+    ], check=True)
+    os.replace(temp_path, path)
+    return path
+
+def generate_matrix(output_dir, durations=DEFAULT_DURATIONS, codecs=DEFAULT_CODECS, bitrates=DEFAULT_BITRATES):
+    """Genera todas las combinaciones; devuelve [{path, duration, codec, bitrate, bytes}]"""
+    os.makedirs(output_dir, exist_ok=True)
+    videos = []
+    for duration in durations:
+        for codec in codecs:
+            for bitrate in bitrates:
+                path = generate_video(
+                    os.path.join(output_dir, video_name(duration, codec, bitrate)), duration, codec, bitrate
+                )
+                videos.append({
+                    "path": path,
+                    "name": os.path.basename(path),
+                    "duration": duration,
+                    "codec": codec,
+                    "bitrate": bitrate,
+                    "bytes": os.path.getsize(path)
+                })
+    return videos
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera videos sintéticos para los benchmarks")
+    parser.add_argument("--output-dir", default="benchmarks/videos")
+    parser.add_argument("--durations", type=int, nargs="+", default=DEFAULT_DURATIONS)
+    parser.add_argument("--codecs", nargs="+", choices=sorted(CODECS), default=DEFAULT_CODECS)
+    parser.add_argument("--bitrates", nargs="+", default=DEFAULT_BITRATES)
+    args = parser.parse_args()
+    for video in generate_matrix(args.output_dir, args.durations, args.codecs, args.bitrates):
+        print(f"{video['path']} ({video['bytes']} bytes)")
+
+if __name__ == "__main__":
+    main()
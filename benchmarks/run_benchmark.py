@@ -0,0 +1,444 @@
+"""Benchmark de carga del servicio contra proveedores falsos locales
+
+Levanta benchmarks/fake_providers.py y el servicio (uvicorn main:app) en puertos libres,
+genera los videos sintéticos, lanza las peticiones con la concurrencia indicada y
+escribe un JSON con peticiones por segundo, p50/p95/p99 de extremo a extremo y por
+etapa (estimados desde los histogramas de /metrics), tokens de entrada y salida por
+petición, RSS máximo del servicio junto con sus procesos FFmpeg y uso máximo de disco temporal.
+
+Uso:
+    python benchmarks/run_benchmark.py --requests 40 --concurrency 4 --output resultados.json
+    python benchmarks/compare.py base.json resultados.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from generate_videos import CODECS, DEFAULT_BITRATES, DEFAULT_CODECS, DEFAULT_DURATIONS, generate_matrix
+
+ENDPOINTS = ("/upload-video", "/upload-video/raw", "/upload-video/stream")
+ERROR_PREFIXES = ("Error", "ADVERTENCIA")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El proceso terminó antes de estar listo ({url})")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Tiempo de espera agotado esperando {url}")
+
+def _stop(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def _children(pid):
+    """PIDs descendientes de `pid` leyendo /proc (Linux)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # El nombre del proceso va entre paréntesis y puede contener espacios
+                fields = stat.read().rsplit(")", 1)[1].split()
+            parents.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            continue
+    result, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        for child in parents.get(current, []):
+            result.append(child)
+            pending.append(child)
+    return result
+
+def _rss(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError):
+        return 0
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+class ResourceSampler(threading.Thread):
+    """Muestrea periódicamente el RSS del servicio (y sus FFmpeg) y el disco temporal usado"""
+
+    def __init__(self, pid, temp_dir, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_temp = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = sum(_rss(pid) for pid in [self.pid, *_children(self.pid)])
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_temp = max(self.peak_temp, _dir_size(self.temp_dir))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def percentiles(values):
+    """p50/p95/p99 exactos (interpolación lineal), media y máximo"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def quantile(fraction):
+        position = fraction * (len(ordered) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    return {
+        "count": len(ordered),
+        "p50": round(quantile(0.50), 4),
+        "p95": round(quantile(0.95), 4),
+        "p99": round(quantile(0.99), 4),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "max": round(ordered[-1], 4)
+    }
+
+def scrape_histograms(metrics_url, name, labels):
+    """Lee un histograma de /metrics; devuelve {(valores de labels): {le: cuenta acumulada}}"""
+    text = httpx.get(metrics_url, timeout=10).text
+    series = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if not sample.name.endswith("_bucket"):
+                continue
+            key = tuple(sample.labels.get(label, "") for label in labels)
+            series.setdefault(key, {})[float(sample.labels["le"])] = sample.value
+    return series
+
+def histogram_quantiles(after, before=None):
+    """Estima p50/p95/p99 de cada serie como histogram_quantile de Prometheus, restando `before`"""
+    result = {}
+    for key, buckets in after.items():
+        previous = (before or {}).get(key, {})
+        counts = sorted((le, value - previous.get(le, 0)) for le, value in buckets.items())
+        total = counts[-1][1] if counts else 0
+        if total <= 0:
+            continue
+
+        def quantile(fraction):
+            rank = fraction * total
+            lower_bound, lower_count = 0.0, 0.0
+            for le, count in counts:
+                if count >= rank:
+                    if le == float("inf"):
+                        # Por encima del último bucket finito solo se conoce la cota inferior
+                        return lower_bound
+                    return lower_bound + (le - lower_bound) * (rank - lower_count) / max(count - lower_count, 1e-9)
+                lower_bound, lower_count = le, count
+            return lower_bound
+
+        result["/".join(key)] = {
+            "count": int(total),
+            "p50": round(quantile(0.50), 4),
+            "p95": round(quantile(0.95), 4),
+            "p99": round(quantile(0.99), 4)
+        }
+    return result
+
+STAGE_HISTOGRAMS = {
+    "stages": ("pipeline_stage_duration_seconds", ["stage", "outcome"]),
+    "providers": ("provider_request_duration_seconds", ["provider", "operation", "outcome"]),
+    "llm_tasks": ("llm_task_duration_seconds", ["task", "source"])
+}
+
+def scrape_counter(metrics_url, name, labels):
+    """Lee un contador de /metrics; devuelve {(valores de labels): valor}"""
+    text = httpx.get(metrics_url, timeout=10).text
+    series = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total"):
+                series[tuple(sample.labels.get(label, "") for label in labels)] = sample.value
+    return series
+
+def scrape_all(metrics_url):
+    return {
+        "llm_tokens": scrape_counter(metrics_url, "llm_tokens", ["provider", "kind"]),
+        **{
+            section: scrape_histograms(metrics_url, name, labels)
+            for section, (name, labels) in STAGE_HISTOGRAMS.items()
+        }
+    }
+
+def _is_failed(status, body):
+    if status != 200:
+        return True
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError:
+        # SSE: el último evento debe ser "done"
+        return "event: done" not in body
+    return str(data.get("transcripcion", "")).startswith(ERROR_PREFIXES)
+
+async def _one_request(client, url, endpoint, video, params):
+    started = time.perf_counter()
+    first_byte = None
+    if endpoint == "/upload-video/raw":
+        with open(video["path"], "rb") as file:
+            content = file.read()
+        request = client.build_request("POST", url, params=params, content=content)
+    else:
+        with open(video["path"], "rb") as file:
+            files = {"file": (video["name"], file.read(), "application/octet-stream")}
+        request = client.build_request("POST", url, params=params, files=files)
+
+    chunks = []
+    response = await client.send(request, stream=True)
+    try:
+        async for chunk in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            chunks.append(chunk)
+    finally:
+        await response.aclose()
+    latency = time.perf_counter() - started
+    body = b"".join(chunks).decode("utf-8", errors="replace")
+    return {
+        "video": video["name"],
+        "status": response.status_code,
+        "latency": latency,
+        "ttfb": first_byte if first_byte is not None else latency,
+        "failed": _is_failed(response.status_code, body)
+    }
+
+async def run_load(base_url, endpoint, videos, requests, concurrency, params):
+    """Lanza `requests` peticiones repartidas entre los videos con como máximo `concurrency` a la vez"""
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(600), limits=limits) as client:
+        async def bounded(index):
+            async with semaphore:
+                try:
+                    return await _one_request(client, base_url + endpoint, endpoint, videos[index % len(videos)], params)
+                except httpx.HTTPError as e:
+                    return {
+                        "video": videos[index % len(videos)]["name"], "status": 0, "latency": None,
+                        "ttfb": None, "failed": True, "error": str(e)
+                    }
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(bounded(index) for index in range(requests)))
+        return results, time.perf_counter() - started
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _service_env(args, provider_url, work_dir):
+    env = dict(os.environ)
+    env.update({
+        "GROQ_API_KEY": "fake-benchmark-key",
+        "GROQ_BASE_URL": provider_url,
+        # Vacía (no ausente) para que load_dotenv no cargue una clave real desde .env
+        "GEMINI_API_KEY": "fake-benchmark-key" if args.with_gemini else "",
+        "GEMINI_BASE_URL": provider_url,
+        "TMPDIR": os.path.join(work_dir, "tmp"),
+        "CACHE_DB_PATH": os.path.join(work_dir, "cache.db"),
+        "PROFILE_DB_PATH": os.path.join(work_dir, "profiles.db"),
+        "RESULT_CACHE_ENABLED": "true" if args.with_cache else "false",
+        "LLM_CACHE_ENABLED": "true" if args.with_cache else "false",
+        "LOG_LEVEL": "WARNING"
+    })
+    for assignment in args.env:
+        key, _, value = assignment.partition("=")
+        env[key] = value
+    return env
+
+def run(args):
+    videos = generate_matrix(args.videos_dir, args.durations, args.codecs, args.bitrates)
+    work_dir = tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(os.path.join(work_dir, "tmp"))
+
+    provider_port, service_port = _free_port(), _free_port()
+    provider_url = f"http://127.0.0.1:{provider_port}"
+    service_url = f"http://127.0.0.1:{service_port}"
+    provider_args = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, "fake_providers.py"), "--port", str(provider_port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--transcribe-ms-per-mb", str(args.transcribe_ms_per_mb), "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status), "--stream-chunk-ms", str(args.stream_chunk_ms),
+        "--chat-ms-per-1k-tokens", str(args.chat_ms_per_1k_tokens),
+        "--transcript-words-per-mb", str(args.transcript_words_per_mb)
+    ]
+    if args.seed is not None:
+        provider_args += ["--seed", str(args.seed)]
+
+    with open(os.path.join(work_dir, "providers.log"), "w") as provider_log, \
+            open(os.path.join(work_dir, "service.log"), "w") as service_log:
+        provider = subprocess.Popen(provider_args, stdout=provider_log, stderr=subprocess.STDOUT)
+        service = None
+        try:
+            _wait_ready(provider_url + "/stats", provider)
+            started = time.perf_counter()
+            service = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(service_port), "--log-level", "warning"],
+                cwd=REPO_DIR, env=_service_env(args, provider_url, work_dir),
+                stdout=service_log, stderr=subprocess.STDOUT
+            )
+            _wait_ready(service_url + "/readyz", service)
+            startup_seconds = time.perf_counter() - started
+
+            params = {"llm_mode": args.llm_mode} if args.llm_mode else {}
+            if args.warmup:
+                asyncio.run(run_load(service_url, args.endpoint, videos, args.warmup, 1, params))
+            before = scrape_all(service_url + "/metrics")
+
+            sampler = ResourceSampler(service.pid, os.path.join(work_dir, "tmp"))
+            sampler.start()
+            try:
+                results, elapsed = asyncio.run(
+                    run_load(service_url, args.endpoint, videos, args.requests, args.concurrency, params)
+                )
+            finally:
+                sampler.stop()
+
+            after = scrape_all(service_url + "/metrics")
+            provider_stats = httpx.get(provider_url + "/stats", timeout=5).json()
+        finally:
+            if service is not None:
+                _stop(service)
+            _stop(provider)
+
+    latencies = [result["latency"] for result in results if result["latency"] is not None]
+    tokens = {
+        kind: sum(
+            value - before["llm_tokens"].get(key, 0)
+            for key, value in after["llm_tokens"].items() if key[1] == kind
+        )
+        for kind in ("prompt", "completion")
+    }
+    by_video = {}
+    for result in results:
+        if result["latency"] is not None:
+            by_video.setdefault(result["video"], []).append(result["latency"])
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "videos": [{key: video[key] for key in ("name", "duration", "codec", "bitrate", "bytes")} for video in videos],
+        "results": {
+            "requests": len(results),
+            "failed": sum(1 for result in results if result["failed"]),
+            "status_codes": {
+                str(status): sum(1 for result in results if result["status"] == status)
+                for status in sorted({result["status"] for result in results})
+            },
+            "duration_seconds": round(elapsed, 3),
+            "requests_per_second": round(len(results) / elapsed, 3) if elapsed else None,
+            "startup_seconds": round(startup_seconds, 3),
+            "latency_seconds": percentiles(latencies),
+            "ttfb_seconds": percentiles([result["ttfb"] for result in results if result["ttfb"] is not None]),
+            "latency_by_video": {name: percentiles(values) for name, values in sorted(by_video.items())},
+            **{
+                section: histogram_quantiles(after[section], before[section])
+                for section in STAGE_HISTOGRAMS
+            },
+            "llm_prompt_tokens_per_request": round(tokens["prompt"] / len(results), 1) if results else None,
+            "llm_completion_tokens_per_request": round(tokens["completion"] / len(results), 1) if results else None,
+            "peak_rss_bytes": sampler.peak_rss,
+            "peak_temp_disk_bytes": sampler.peak_temp,
+            "fake_provider": provider_stats
+        },
+        "work_dir": work_dir
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga con proveedores falsos locales")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="Peticiones previas que no se miden")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="/upload-video")
+    parser.add_argument("--llm-mode", choices=("sequential", "concurrent", "fused"), default=None)
+    parser.add_argument("--durations", type=int, nargs="+", default=DEFAULT_DURATIONS)
+    parser.add_argument("--codecs", nargs="+", choices=sorted(CODECS), default=DEFAULT_CODECS)
+    parser.add_argument("--bitrates", nargs="+", default=DEFAULT_BITRATES)
+    parser.add_argument("--videos-dir", default=os.path.join(BENCHMARKS_DIR, "videos"))
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--transcribe-ms-per-mb", type=float, default=300)
+    parser.add_argument("--stream-chunk-ms", type=float, default=20)
+    parser.add_argument("--chat-ms-per-1k-tokens", type=float, default=0,
+                        help="Latencia del chat falso por cada 1000 tokens de entrada")
+    parser.add_argument("--transcript-words-per-mb", type=int, default=0,
+                        help="Longitud de la transcripción falsa por MB de audio (grabaciones largas)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--with-gemini", action="store_true", help="Configurar también Gemini (falso) como respaldo")
+    parser.add_argument("--with-cache", action="store_true", help="Dejar activas las cachés de resultados y LLM")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Variable de entorno adicional para el servicio (repetible)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto, stdout)")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
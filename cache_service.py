@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import hashlib
+import unicodedata
+import sqlite3
+import threading
+from collections import OrderedDict
+from metrics_service import CACHE_LOOKUPS
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+
+class TieredCache:
+    """LRU en memoria delante de un almacén SQLite con TTL y desalojo por tamaño total
+
+    Los aciertos en memoria también renuevan `accessed_at` en SQLite, como mucho una vez
+    cada `touch_interval` segundos (por defecto ttl/100), para que el desalojo por tamaño
+    no tome por frías las entradas más usadas.
+    """
+
+    def __init__(self, namespace, db_path=CACHE_DB_PATH, memory_items=256,
+                 max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600, touch_interval=None):
+        self.namespace = namespace
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.touch_interval = ttl / 100 if touch_interval is None else touch_interval
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "memory_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (namespace, accessed_at)"
+            )
+
+    def get(self, key):
+        """Devuelve el valor guardado o None si no existe o expiró"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value, touched_at = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    if now - touched_at >= self.touch_interval:
+                        self._touch(key, now)
+                        self._memory[key] = (created_at, value, now)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute(
+                            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                            (self.namespace, key)
+                        )
+                self._stats["misses"] += 1
+                return None
+
+            self._touch(key, now)
+            value = json.loads(row[0])
+            self._remember(key, row[1], value, now)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        """Guarda un valor serializable a JSON en ambos niveles"""
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, now, value, now)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, data, len(data.encode("utf-8")), now, now)
+                )
+            self._stats["sets"] += 1
+            self._evict(now)
+
+    def _touch(self, key, now):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key)
+            )
+
+    def _remember(self, key, created_at, value, touched_at):
+        self._memory[key] = (created_at, value, touched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        """Elimina entradas expiradas y, si se supera max_bytes, las menos usadas recientemente"""
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND created_at < ?",
+                (self.namespace, now - self.ttl)
+            )
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute(
+                "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at",
+                (self.namespace,)
+            ).fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                )
+                self._memory.pop(key, None)
+                total -= size
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = row[0]
+        stats["stored_bytes"] = row[1]
+        stats["memory_entries"] = len(self._memory)
+        return stats
+
+class ResultCache:
+    """Caché de resultados direccionada por contenido: hash del video y hash del audio extraído
+
+    El audio extraído es FLAC/Opus bit-exacto, así que el mismo audio en otro contenedor
+    comparte clave. `version` recoge la configuración que cambia el resultado para el
+    mismo audio (VAD y segmentación, ver transcription_service.TRANSCRIPTION_CACHE_VERSION).
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._counters = {"video_hits": 0, "audio_hits": 0, "misses": 0, "bytes_saved": 0}
+
+    @staticmethod
+    def key(kind, content_hash, version=""):
+        return f"{kind}:{version}:{content_hash}"
+
+    def get_by_video(self, video_hash, video_size=0, version=""):
+        result = self.cache.get(self.key("video", video_hash, version))
+        if result is not None:
+            self._count("video_hits", video_size)
+        return result
+
+    def get_by_audio(self, audio_hash, audio_size=0, version=""):
+        result = self.cache.get(self.key("audio", audio_hash, version))
+        if result is not None:
+            self._count("audio_hits", audio_size)
+        else:
+            self._count("misses", 0)
+        return result
+
+    def set(self, result, video_hash=None, version=""):
+        self.cache.set(self.key("audio", result["audio_hash"], version), result)
+        if video_hash:
+            self.cache.set(self.key("video", video_hash, version), result)
+
+    def _count(self, counter, bytes_saved):
+        CACHE_LOOKUPS.labels("result", counter).inc()
+        with self._lock:
+            self._counters[counter] += 1
+            self._counters["bytes_saved"] += bytes_saved
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        hits = counters["video_hits"] + counters["audio_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        counters["store"] = self.cache.stats()
+        return counters
+
+def normalize_text(text):
+    """Normaliza Unicode y espacios para que transcripciones equivalentes compartan clave"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+class LLMCache:
+    """Caché de respuestas de chat: clave = (tarea, hash de la entrada normalizada, versión de prompts, modelo, temperatura)"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "bypassed": 0}
+
+    @staticmethod
+    def key(task, text, prompt_version, model, temperature, extra=None):
+        text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        parts = [task, text_hash, str(prompt_version), model, f"{temperature:g}"]
+        if extra is not None:
+            # Entradas adicionales del prompt (p. ej. el perfil que recibe el CV)
+            parts.append(hashlib.sha256(
+                json.dumps(extra, ensure_ascii=False, sort_keys=True).encode("utf-8")
+            ).hexdigest())
+        return ":".join(parts)
+
+    def get(self, *keys):
+        """Devuelve el primer valor encontrado entre las claves (una por modelo candidato)"""
+        for key in keys:
+            value = self.cache.get(key)
+            if value is not None:
+                self._count("hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def count_bypass(self):
+        self._count("bypassed")
+
+    def _count(self, counter):
+        CACHE_LOOKUPS.labels("llm", counter).inc()
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        counters["store"] = self.cache.stats()
+        return counters
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+
+result_cache = ResultCache(TieredCache(
+    "results",
+    memory_items=int(os.getenv("RESULT_CACHE_MEMORY_ITEMS", 256)),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", 7 * 24 * 3600))
+)) if RESULT_CACHE_ENABLED else None
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+llm_cache = LLMCache(TieredCache(
+    "llm",
+    memory_items=int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 512)),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))
+)) if LLM_CACHE_ENABLED else None
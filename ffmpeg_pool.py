@@ -0,0 +1,144 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from metrics_service import FFMPEG_QUEUE_WAIT_SECONDS, FFMPEG_RUNNING, FFMPEG_WAITING
+
+try:
+    import fcntl
+except ImportError:
+    # Sin flock (Windows) el límite solo se aplica dentro de cada proceso
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+def available_cpus():
+    """Núcleos utilizables: afinidad del proceso limitada por la cuota de CPU del cgroup (contenedores)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+# Procesos FFmpeg simultáneos en todo el contenedor, sumando todos los workers de uvicorn/gunicorn
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", available_cpus()))
+# Hilos por proceso FFmpeg; por defecto se reparten los núcleos entre las plazas
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", max(1, available_cpus() // max(FFMPEG_CONCURRENCY, 1))))
+# Plazas aparte para las extracciones al ritmo del cliente (cuerpo crudo o subida por bloques):
+# pasan casi todo el tiempo esperando a la red y no deben ocupar las plazas de CPU
+FFMPEG_STREAM_CONCURRENCY = int(os.getenv("FFMPEG_STREAM_CONCURRENCY", 4))
+# Directorio de los archivos de bloqueo compartidos por los workers del mismo host
+FFMPEG_LOCK_DIR = os.getenv("FFMPEG_LOCK_DIR", os.path.join(tempfile.gettempdir(), "ffmpeg-slots"))
+
+class FFmpegPool:
+    """Semáforo entre procesos para FFmpeg: cada plaza es un archivo bloqueado con flock
+
+    El sistema libera los bloqueos si un worker muere, así que nunca quedan plazas
+    ocupadas por procesos caídos. Dentro de cada proceso un asyncio.Semaphore evita que
+    más tareas de las necesarias sondeen los archivos.
+    """
+
+    def __init__(self, slots=FFMPEG_CONCURRENCY, lock_dir=FFMPEG_LOCK_DIR, threads=FFMPEG_THREADS,
+                 poll_interval=0.01, max_poll_interval=0.2, name="cpu"):
+        self.name = name
+        self.slots = max(slots, 1)
+        self.threads = threads
+        self.lock_dir = lock_dir
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._local = asyncio.Semaphore(self.slots)
+        self._fds = None
+        self._busy = set()
+
+    def _open_locks(self):
+        """Abre (una vez por proceso) los archivos de bloqueo; None si no se pueden compartir"""
+        if self._fds is None:
+            self._fds = []
+            if fcntl is not None:
+                try:
+                    os.makedirs(self.lock_dir, exist_ok=True)
+                    self._fds = [
+                        os.open(os.path.join(self.lock_dir, f"slot-{index}.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+                        for index in range(self.slots)
+                    ]
+                except OSError as e:
+                    logger.warning("No se pudieron crear los bloqueos de FFmpeg en %s: %s", self.lock_dir, e)
+                    self._fds = []
+        return self._fds
+
+    @property
+    def shared(self):
+        return bool(self._open_locks())
+
+    async def _acquire_lock(self):
+        """Bloquea una plaza libre entre procesos, sondeando con espera creciente; devuelve su índice"""
+        fds = self._open_locks()
+        delay = self.poll_interval
+        while True:
+            for index in range(self.slots):
+                if index in self._busy:
+                    continue
+                if fds:
+                    try:
+                        fcntl.flock(fds[index], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                self._busy.add(index)
+                return index
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _release_lock(self, index):
+        self._busy.discard(index)
+        if self._fds:
+            fcntl.flock(self._fds[index], fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Ocupa una plaza mientras dura el bloque, midiendo la espera en cola con la etiqueta del pool"""
+        started = time.perf_counter()
+        waiting = FFMPEG_WAITING.labels(self.name)
+        waiting.inc()
+        try:
+            await self._local.acquire()
+            try:
+                index = await self._acquire_lock()
+            except BaseException:
+                self._local.release()
+                raise
+        finally:
+            waiting.dec()
+        FFMPEG_QUEUE_WAIT_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+        running = FFMPEG_RUNNING.labels(self.name)
+        running.inc()
+        try:
+            yield index
+        finally:
+            running.dec()
+            self._release_lock(index)
+            self._local.release()
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "slots": self.slots,
+            "threads": self.threads,
+            "shared": self.shared,
+            "lock_dir": self.lock_dir if self.shared else None,
+            "in_use": len(self._busy)
+        }
+
+ffmpeg_pool = FFmpegPool()
+# Un hilo por proceso basta para decodificar al ritmo en que llegan los datos
+stream_pool = FFmpegPool(FFMPEG_STREAM_CONCURRENCY, os.path.join(FFMPEG_LOCK_DIR, "stream"), threads=1, name="stream")
@@ -1,376 +1,471 @@
 import os
 import json
+import time
+import asyncio
+import logging
+import threading
+import httpx
 from dotenv import load_dotenv
+from cache_service import llm_cache
+from metrics_service import LLM_TASK_SECONDS, PROVIDER_BYTES_SENT, STARTUP_SECONDS, record_tokens
+from prompts import (
+    PROMPT_CACHE_VERSION, PROFILE_SYSTEM_PROMPT, CV_SYSTEM_PROMPT, TRANSCRIPTION_PROMPT,
+    profile_prompt, cv_prompt, fused_prompt
+)
+from provider_router import ProviderRouter, AllProvidersFailedError
 
 load_dotenv()
 
-# Configurar Groq
+logger = logging.getLogger(__name__)
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Endpoint alternativo de Gemini (p. ej. el servidor falso de benchmarks/), por REST
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+# Pool HTTP compartido (keep-alive) para los clientes asíncronos
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", 20))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", 120))
+
+# Inicializar los proveedores en segundo plano al arrancar en lugar de en la primera petición
+PROVIDERS_WARMUP = os.getenv("PROVIDERS_WARMUP", "true").lower() == "true"
+
+# Los SDK se importan y configuran en el primer uso (ver init_providers): importar
+# groq y google.generativeai tarda cerca de un segundo y no debe retrasar el arranque
+http_client = None
+async_client = None
+model = None
+GROQ_AVAILABLE = False
+GEMINI_AVAILABLE = False
+
+def _init_groq():
+    global http_client, async_client, GROQ_AVAILABLE
+    if not GROQ_API_KEY:
+        logger.warning("GROQ_API_KEY no encontrada en el archivo .env")
+        return
+
+    logger.info("Groq API Key loaded: %s...", GROQ_API_KEY[:10])
+    try:
+        from groq import AsyncGroq
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_CONNECTIONS,
+                keepalive_expiry=60
+            ),
+            timeout=httpx.Timeout(GROQ_TIMEOUT, connect=10)
+        )
+        # Los reintentos los gestiona el router, no el SDK
+        async_client = AsyncGroq(api_key=GROQ_API_KEY, http_client=http_client, max_retries=0)
+        GROQ_AVAILABLE = True
+        logger.info("Groq AI configurado correctamente")
+    except ImportError as e:
+        logger.warning("ADVERTENCIA: Groq no esta instalado: %s", e)
+        logger.warning("Instala con: pip install groq")
+    except Exception as e:
+        logger.error("Error al configurar Groq: %s", e)
+
+def _init_gemini():
+    global model, GEMINI_AVAILABLE
+    if not GEMINI_API_KEY:
+        logger.info("GEMINI_API_KEY no encontrada, usando solo Groq")
+        return
 
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY no encontrada en el archivo .env")
-
-print(f"Groq API Key loaded: {GROQ_API_KEY[:10]}...")
-
-# Intentar importar y configurar Groq
-try:
-    from groq import Groq
-    client = Groq(api_key=GROQ_API_KEY)
-    GROQ_AVAILABLE = True
-    print("Groq AI configurado correctamente")
-except ImportError as e:
-    print(f"ADVERTENCIA: Groq no esta instalado: {e}")
-    print("Instala con: pip install groq")
-    GROQ_AVAILABLE = False
-    client = None
-except Exception as e:
-    print(f"Error al configurar Groq: {e}")
-    GROQ_AVAILABLE = False
-    client = None
-
-# Configurar Gemini como respaldo
-if not GEMINI_API_KEY:
-    print("GEMINI_API_KEY no encontrada, usando solo Groq")
-    GEMINI_AVAILABLE = False
-    model = None
-else:
-    print(f"Gemini API Key loaded: {GEMINI_API_KEY[:10]}...")
+    logger.info("Gemini API Key loaded: %s...", GEMINI_API_KEY[:10])
     try:
         import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
+        if GEMINI_BASE_URL:
+            genai.configure(api_key=GEMINI_API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_BASE_URL})
+        else:
+            genai.configure(api_key=GEMINI_API_KEY)
 
         try:
             model = genai.GenerativeModel('gemini-2.0-flash')
             GEMINI_AVAILABLE = True
-            print("Gemini AI configurado correctamente con gemini-2.0-flash")
+            logger.info("Gemini AI configurado correctamente con gemini-2.0-flash")
         except Exception as e:
-            print(f"Error al configurar Gemini: {e}")
+            logger.error("Error al configurar Gemini: %s", e)
             try:
                 model = genai.GenerativeModel('gemini-pro')
                 GEMINI_AVAILABLE = True
-                print("Gemini AI configurado correctamente con gemini-pro")
+                logger.info("Gemini AI configurado correctamente con gemini-pro")
             except Exception as e2:
-                print(f"Tampoco funciona gemini-pro: {e2}")
-                GEMINI_AVAILABLE = False
+                logger.error("Tampoco funciona gemini-pro: %s", e2)
                 model = None
     except ImportError as e:
-        print(f"ADVERTENCIA: Google Generative AI no esta instalado: {e}")
-        print("Instala con: pip install google-generativeai")
-        GEMINI_AVAILABLE = False
-        model = None
-        genai = None
+        logger.warning("ADVERTENCIA: Google Generative AI no esta instalado: %s", e)
+        logger.warning("Instala con: pip install google-generativeai")
     except Exception as e:
-        print(f"Error al configurar Gemini: {e}")
-        GEMINI_AVAILABLE = False
+        logger.error("Error al configurar Gemini: %s", e)
         model = None
-        genai = None
-
-def transcribe_audio(audio_path):
-    """Transcribe audio usando Groq AI (Whisper)"""
-    if not GROQ_AVAILABLE:
-        if GEMINI_AVAILABLE:
-            print("Groq no disponible, usando Gemini como respaldo")
-            return transcribe_audio_gemini(audio_path)
-        return "ADVERTENCIA: Ni Groq ni Gemini están disponibles para transcripción."
-
-    try:
-        print(f"Transcribiendo audio con Groq: {audio_path}")
-        with open(audio_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(audio_path, file.read()),
-                model="whisper-large-v3",
-                prompt="Transcribe este audio al español. Es una presentación personal o profesional.",
-                response_format="text",
-                language="es"
-            )
-        print(f"Transcripción obtenida con Groq: {transcription[:200]}...")
-        return transcription.strip() if transcription else "No se pudo transcribir el audio."
-
-    except Exception as e:
-        print(f"Error en transcribe_audio con Groq: {str(e)}")
-        if GEMINI_AVAILABLE:
-            print("Intentando con Gemini como respaldo...")
-            return transcribe_audio_gemini(audio_path)
-        return f"Error al transcribir: {str(e)}"
-
-def transcribe_audio_gemini(audio_path):
-    """Transcribe audio usando Gemini AI como respaldo"""
-    if not GEMINI_AVAILABLE:
-        return "ADVERTENCIA: Google Generative AI no esta instalado."
 
-    try:
-        # Subir el archivo de audio a Gemini
-        audio_file = genai.upload_file(audio_path)
-        print(f"Archivo de audio subido a Gemini: {audio_file.name}")
-
-        # Transcribir usando Gemini con el archivo subido
-        response = model.generate_content([
-            "Transcribe este audio al español. Proporciona únicamente la transcripción del habla, sin comentarios adicionales ni formato especial.",
-            audio_file
-        ])
-
-        transcription = response.text.strip()
-        print(f"Transcripción obtenida con Gemini: {transcription[:200]}...")
-        return transcription if transcription else "No se pudo transcribir el audio."
+PROFILE_FIELDS = [
+    "nombre", "profesion", "experiencia", "educacion",
+    "tecnologias", "idiomas", "logros", "habilidades_blandas"
+]
+
+def _default_profile(value, error=None):
+    """Construye el JSON de perfil con todos los campos en el valor indicado"""
+    profile = {"error": error} if error else {}
+    for field in PROFILE_FIELDS:
+        profile[field] = value
+    return json.dumps(profile, ensure_ascii=False)
+
+class ProfileValidationError(ValueError):
+    """La respuesta del modelo no cumple el esquema del perfil"""
+
+def _field_text(value):
+    """Convierte el valor de un campo a texto: escalares con str(), listas y objetos unidos por comas"""
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        parts = [f"{key}: {text}" for key, text in ((key, _field_text(item)) for key, item in value.items()) if text]
+        return ", ".join(parts)
+    if isinstance(value, list):
+        parts = [text for text in (_field_text(item) for item in value) if text]
+        # Los elementos compuestos ya llevan comas internas
+        separator = "; " if any(isinstance(item, (dict, list)) for item in value) else ", "
+        return separator.join(parts)
+    return str(value).strip()
+
+def validate_profile(data, extra_fields=()):
+    """Valida el esquema del perfil y normaliza cada campo a texto
+
+    Solo se rechazan respuestas que no son un objeto JSON; números, listas y objetos se
+    convierten a texto y los campos del perfil vacíos o ausentes ("", null, []) quedan como
+    'No especificado'. Los `extra_fields` (perfil_cv en el modo fusionado) sí son obligatorios.
+    """
+    if not isinstance(data, dict):
+        raise ProfileValidationError("La respuesta no es un objeto JSON")
+    profile = {}
+    for field in [*PROFILE_FIELDS, *extra_fields]:
+        value = _field_text(data.get(field))
+        if not value:
+            if field in extra_fields:
+                raise ProfileValidationError(f"Campo vacío o ausente: {field}")
+            value = "No especificado"
+        profile[field] = value
+    return profile
+
+def _parse_profile_response(response_text):
+    """Valida la respuesta JSON del perfil; lanza ValueError si no cumple el esquema"""
+    profile = validate_profile(json.loads(response_text))
+    return json.dumps(profile, ensure_ascii=False)
+
+def _parse_fused_response(response_text):
+    """Separa la respuesta fusionada en (perfil_json, perfil_cv); lanza ValueError si no es válida"""
+    data = validate_profile(json.loads(response_text), extra_fields=("perfil_cv",))
+    cv_profile = data.pop("perfil_cv")
+    return json.dumps(data, ensure_ascii=False), cv_profile
+
+class GroqProvider:
+    """Whisper y chat de Groq con el cliente AsyncGroq compartido"""
+
+    name = "groq"
+    chat_model = "llama-3.1-8b-instant"
+
+    async def transcribe(self, audio_bytes, filename="audio.flac", mime_type="audio/flac"):
+        logger.info("Transcribiendo audio con Groq: %s (%d bytes)", filename, len(audio_bytes))
+        PROVIDER_BYTES_SENT.labels(self.name).inc(len(audio_bytes))
+        transcription = await async_client.audio.transcriptions.create(
+            file=(filename, audio_bytes),
+            model="whisper-large-v3",
+            prompt=TRANSCRIPTION_PROMPT,
+            response_format="text",
+            language="es"
+        )
+        logger.debug("Transcripción obtenida con Groq: %s", transcription)
+        return transcription.strip() if transcription else ""
 
-    except Exception as e:
-        print(f"Error en transcribe_audio_gemini: {str(e)}")
-        return f"Error al transcribir con Gemini: {str(e)}"
-
-def extract_profile(text):
-    """Extrae información del perfil usando Groq AI"""
-    import json
-
-    print(f"Texto recibido para extracción de perfil: {text[:500]}...")
-
-    if not GROQ_AVAILABLE:
-        if GEMINI_AVAILABLE:
-            print("Groq no disponible, usando Gemini como respaldo")
-            return extract_profile_gemini(text)
-        return json.dumps({
-            "error": "ADVERTENCIA: Ni Groq ni Gemini están disponibles.",
-            "nombre": "No disponible",
-            "profesion": "No disponible",
-            "experiencia": "No disponible",
-            "educacion": "No disponible",
-            "tecnologias": "No disponible",
-            "idiomas": "No disponible",
-            "logros": "No disponible",
-            "habilidades_blandas": "No disponible"
-        }, ensure_ascii=False)
-
-    prompt = (
-        "Analiza el siguiente texto transcrito de un video de presentación personal y extrae la información del perfil.\n\n"
-        "Devuelve ÚNICAMENTE un objeto JSON válido con los siguientes campos:\n"
-        "- nombre: El nombre de la persona\n"
-        "- profesion: La ocupación actual, cargo o especialidad mencionada\n"
-        "- experiencia: Áreas o temas en los que tiene práctica laboral o conocimiento aplicado\n"
-        "- educacion: Títulos, grados, estudios o formación académica. Si no se menciona explícitamente, infiérelo lógicamente de la profesión (ej. si es 'Contador Público', educación podría ser 'Contaduría Pública'; si es 'Ingeniero de Software', 'Ingeniería de Software')\n"
-        "- tecnologias: Herramientas, softwares, lenguajes o técnicas específicas mencionadas\n"
-        "- idiomas: Lista de idiomas hablados o entendidos\n"
-        "- logros: Reconocimientos, hitos o aportes relevantes\n"
-        "- habilidades_blandas: Habilidades sociales o personales\n\n"
-        "Si algún campo no está presente en el texto y no puede inferirse, usa 'No especificado'.\n\n"
-        f"Texto a analizar:\n{text}\n\n"
-        "Responde SOLO con el JSON, sin texto adicional."
-    )
+    async def chat(self, system, prompt, temperature, max_tokens, json_mode=False):
+        response = await async_client.chat.completions.create(
+            model=self.chat_model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **({"response_format": {"type": "json_object"}} if json_mode else {})
+        )
+        if response.usage is not None:
+            record_tokens(self.name, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content.strip()
 
-    try:
-        print("Enviando prompt a Groq para extracción de perfil...")
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
+    async def chat_stream(self, system, prompt, temperature, max_tokens):
+        stream = await async_client.chat.completions.create(
+            model=self.chat_model,
             messages=[
-                {"role": "system", "content": "Eres un asistente que extrae información de perfiles profesionales de textos transcritos. Siempre respondes solo con JSON válido."},
+                {"role": "system", "content": system},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.1,
-            max_tokens=1000
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
         )
-        response_text = response.choices[0].message.content.strip()
-        print(f"Respuesta de Groq para perfil: {response_text[:500]}...")
-
-        # Intentar parsear el JSON de la respuesta
-        import re
-
-        # Extraer JSON de la respuesta
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            # Validar que sea JSON válido
-            parsed = json.loads(json_str)
-            print(f"Perfil extraído exitosamente: {json.dumps(parsed, ensure_ascii=False)}")
-            return json.dumps(parsed, ensure_ascii=False)
-        else:
-            print("No se encontró JSON en la respuesta de Groq")
+        async for chunk in stream:
+            # Groq reporta el uso de tokens en el último fragmento, dentro de x_groq
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if usage is not None:
+                record_tokens(self.name, usage.prompt_tokens, usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+class GeminiProvider:
+    """Gemini como respaldo; el SDK es síncrono, así que las llamadas corren en un hilo"""
+
+    name = "gemini"
+
+    @property
+    def chat_model(self):
+        return model.model_name
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_tokens(self.name, usage.prompt_token_count, usage.candidates_token_count)
+
+    async def transcribe(self, audio_bytes, filename="audio.flac", mime_type="audio/flac"):
+        # El audio va inline en la petición, sin subir un archivo con genai.upload_file
+        PROVIDER_BYTES_SENT.labels(self.name).inc(len(audio_bytes))
+        response = await asyncio.to_thread(model.generate_content, [
+            "Transcribe este audio al español. Proporciona únicamente la transcripción del habla, sin comentarios adicionales ni formato especial.",
+            {"mime_type": mime_type, "data": audio_bytes}
+        ])
+        self._record_usage(response)
+        transcription = response.text.strip()
+        logger.debug("Transcripción obtenida con Gemini: %s", transcription)
+        return transcription
+
+    async def chat(self, system, prompt, temperature, max_tokens, json_mode=False):
+        generation_config = {"temperature": temperature, "max_output_tokens": max_tokens}
+        if json_mode:
+            generation_config["response_mime_type"] = "application/json"
+        response = await asyncio.to_thread(model.generate_content, prompt, generation_config=generation_config)
+        self._record_usage(response)
+        return response.text.strip()
+
+    async def chat_stream(self, system, prompt, temperature, max_tokens):
+        generation_config = {"temperature": temperature, "max_output_tokens": max_tokens}
+        response = await asyncio.to_thread(
+            model.generate_content, prompt, generation_config=generation_config, stream=True
+        )
+        # El iterador del SDK bloquea mientras espera cada fragmento
+        iterator = iter(response)
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                # El uso de tokens del stream se acumula en la respuesta completa
+                self._record_usage(response)
+                return
+            if chunk.text:
+                yield chunk.text
+
+# Groq primero y Gemini como respaldo, con circuit breaker, reintentos y hedging opcional;
+# los proveedores se añaden al inicializarse
+router = ProviderRouter([])
+
+_init_lock = threading.Lock()
+_initialized = False
+init_seconds = None
+
+def init_providers():
+    """Configura Groq y Gemini una sola vez (bloqueante, usar en un hilo); devuelve los proveedores disponibles"""
+    global _initialized, init_seconds
+    with _init_lock:
+        if not _initialized:
+            started = time.perf_counter()
+            _init_groq()
+            _init_gemini()
+            if GROQ_AVAILABLE:
+                router.add_provider(GroqProvider())
             if GEMINI_AVAILABLE:
-                print("Intentando con Gemini como respaldo...")
-                return extract_profile_gemini(text)
-            return json.dumps({
-                "nombre": "No especificado",
-                "profesion": "No especificado",
-                "experiencia": "No especificado",
-                "educacion": "No especificado",
-                "tecnologias": "No especificado",
-                "idiomas": "No especificado",
-                "logros": "No especificado",
-                "habilidades_blandas": "No especificado"
-            }, ensure_ascii=False)
+                router.add_provider(GeminiProvider())
+            init_seconds = time.perf_counter() - started
+            STARTUP_SECONDS.labels("providers").set(init_seconds)
+            _initialized = True
+            logger.info(
+                "Proveedores inicializados en %.3f s: %s",
+                init_seconds, ", ".join(p.name for p in router.providers) or "ninguno"
+            )
+    return router.providers
+
+async def ensure_providers():
+    """Devuelve los proveedores disponibles, inicializándolos en un hilo la primera vez"""
+    if _initialized:
+        return router.providers
+    return await asyncio.to_thread(init_providers)
+
+def provider_status():
+    """Configuración y disponibilidad de los proveedores, sin forzar su inicialización"""
+    return {
+        "initialized": _initialized,
+        "init_seconds": round(init_seconds, 3) if init_seconds is not None else None,
+        "groq": {"configured": bool(GROQ_API_KEY), "available": GROQ_AVAILABLE},
+        "gemini": {"configured": bool(GEMINI_API_KEY), "available": GEMINI_AVAILABLE}
+    }
+
+async def _chat(task, text, system, prompt, temperature, max_tokens, json_mode=False,
+                validate=None, extra=None, use_cache=True):
+    """Llamada de chat por el router con caché de respuestas; lanza AllProvidersFailedError
+
+    La clave incluye el modelo, así que se prueba la de cada proveedor en orden de
+    preferencia y la respuesta se guarda con el modelo del proveedor que respondió.
+    Un acierto no hace ninguna petición de red.
+    """
+    def key(provider):
+        return llm_cache.key(task, text, PROMPT_CACHE_VERSION, provider.chat_model, temperature, extra)
+
+    started = time.perf_counter()
+    if llm_cache is not None:
+        if use_cache:
+            cached = await asyncio.to_thread(llm_cache.get, *(key(provider) for provider in router.providers))
+            if cached is not None:
+                logger.info("Respuesta de %s obtenida de caché", task)
+                LLM_TASK_SECONDS.labels(task, "cache").observe(time.perf_counter() - started)
+                return cached
+        else:
+            llm_cache.count_bypass()
 
-    except Exception as e:
-        print(f"Error en extract_profile con Groq: {str(e)}")
-        if GEMINI_AVAILABLE:
-            print("Intentando con Gemini como respaldo...")
-            return extract_profile_gemini(text)
-        return json.dumps({
-            "error": f"Error al procesar: {str(e)}",
-            "nombre": "No especificado",
-            "profesion": "No especificado",
-            "experiencia": "No especificado",
-            "educacion": "No especificado",
-            "tecnologias": "No especificado",
-            "idiomas": "No especificado",
-            "logros": "No especificado",
-            "habilidades_blandas": "No especificado"
-        }, ensure_ascii=False)
-
-def extract_profile_gemini(text):
-    """Extrae información del perfil usando Gemini AI como respaldo"""
-    import json
-
-    if not GEMINI_AVAILABLE:
-        return json.dumps({
-            "error": "ADVERTENCIA: Google Generative AI no esta instalado.",
-            "nombre": "No disponible",
-            "profesion": "No disponible",
-            "experiencia": "No disponible",
-            "educacion": "No disponible",
-            "tecnologias": "No disponible",
-            "idiomas": "No disponible",
-            "logros": "No disponible",
-            "habilidades_blandas": "No disponible"
-        }, ensure_ascii=False)
-
-    prompt = (
-        "Analiza el siguiente texto transcrito de un video de presentación personal y extrae la información del perfil.\n\n"
-        "Devuelve ÚNICAMENTE un objeto JSON válido con los siguientes campos:\n"
-        "- nombre: El nombre de la persona\n"
-        "- profesion: La ocupación actual, cargo o especialidad mencionada\n"
-        "- experiencia: Áreas o temas en los que tiene práctica laboral o conocimiento aplicado\n"
-        "- educacion: Títulos, grados, estudios o formación académica. Si no se menciona explícitamente, infiérelo lógicamente de la profesión (ej. si es 'Contador Público', educación podría ser 'Contaduría Pública'; si es 'Ingeniero de Software', 'Ingeniería de Software')\n"
-        "- tecnologias: Herramientas, softwares, lenguajes o técnicas específicas mencionadas\n"
-        "- idiomas: Lista de idiomas hablados o entendidos\n"
-        "- logros: Reconocimientos, hitos o aportes relevantes\n"
-        "- habilidades_blandas: Habilidades sociales o personales\n\n"
-        "Si algún campo no está presente en el texto y no puede inferirse, usa 'No especificado'.\n\n"
-        f"Texto a analizar:\n{text}\n\n"
-        "Responde SOLO con el JSON, sin texto adicional."
+    provider, result = await router.call(
+        "chat", system, prompt, temperature=temperature, max_tokens=max_tokens,
+        json_mode=json_mode, validate=validate, with_provider=True
     )
+    LLM_TASK_SECONDS.labels(task, provider.name).observe(time.perf_counter() - started)
+    if llm_cache is not None:
+        await asyncio.to_thread(llm_cache.set, key(provider), result)
+    return result
+
+async def transcribe_bytes(audio_bytes, filename="audio.flac", mime_type="audio/flac"):
+    """Transcribe audio en memoria a través del router; lanza AllProvidersFailedError si nadie puede"""
+    await ensure_providers()
+    return await router.call("transcribe", audio_bytes, filename, mime_type)
+
+async def transcribe_audio_bytes_async(audio_bytes, filename="audio.flac", mime_type="audio/flac"):
+    """Transcribe audio ya cargado en memoria (FLAC/Opus/WAV) sin pasar por disco"""
+    if not await ensure_providers():
+        return "ADVERTENCIA: Ni Groq ni Gemini están disponibles para transcripción."
 
     try:
-        print("Enviando prompt a Gemini para extracción de perfil...")
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        print(f"Respuesta de Gemini para perfil: {response_text[:500]}...")
-
-        # Intentar parsear el JSON de la respuesta
-        import re
-
-        # Extraer JSON de la respuesta
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            # Validar que sea JSON válido
-            parsed = json.loads(json_str)
-            print(f"Perfil extraído exitosamente con Gemini: {json.dumps(parsed, ensure_ascii=False)}")
-            return json.dumps(parsed, ensure_ascii=False)
-        else:
-            print("No se encontró JSON en la respuesta de Gemini")
-            return json.dumps({
-                "nombre": "No especificado",
-                "profesion": "No especificado",
-                "experiencia": "No especificado",
-                "educacion": "No especificado",
-                "tecnologias": "No especificado",
-                "idiomas": "No especificado",
-                "logros": "No especificado",
-                "habilidades_blandas": "No especificado"
-            }, ensure_ascii=False)
+        transcription = await transcribe_bytes(audio_bytes, filename, mime_type)
+        return transcription if transcription else "No se pudo transcribir el audio."
+    except AllProvidersFailedError as e:
+        logger.error("Error en transcribe_audio_bytes_async: %s", e)
+        return f"Error al transcribir: {str(e)}"
 
-    except Exception as e:
-        print(f"Error en extract_profile_gemini: {str(e)}")
-        return json.dumps({
-            "error": f"Error al procesar con Gemini: {str(e)}",
-            "nombre": "No especificado",
-            "profesion": "No especificado",
-            "experiencia": "No especificado",
-            "educacion": "No especificado",
-            "tecnologias": "No especificado",
-            "idiomas": "No especificado",
-            "logros": "No especificado",
-            "habilidades_blandas": "No especificado"
-        }, ensure_ascii=False)
-
-def generate_cv_profile(transcription, profile_dict):
-    """Genera un perfil profesional para hoja de vida usando Groq AI"""
-    print(f"Generando perfil CV con transcripción: {transcription[:300]}...")
-    print(f"Perfil dict: {json.dumps(profile_dict, ensure_ascii=False)}")
-
-    if not GROQ_AVAILABLE:
-        if GEMINI_AVAILABLE:
-            print("Groq no disponible, usando Gemini como respaldo")
-            return generate_cv_profile_gemini(transcription, profile_dict)
-        return "ADVERTENCIA: Ni Groq ni Gemini están disponibles para generar perfil."
+async def extract_profile_async(text, use_cache=True):
+    """Extrae información del perfil en modo JSON, validando la respuesta contra el esquema"""
+    logger.debug("Texto recibido para extracción de perfil: %s", text)
 
-    prompt = (
-        "Con base en la siguiente transcripción de un video de presentación personal y la información extraída del perfil, "
-        "redacta un perfil profesional optimizado para una hoja de vida en el estilo de resúmenes ejecutivos concisos y impactantes. El perfil debe ser en español, "
-        "profesional y formal, escrito en tercera persona impersonal (sin mencionar el nombre al inicio), estructurado en párrafos cortos y enfocados. "
-        "Sigue esta estructura aproximada: "
-        "- Primer párrafo: Profesión y experiencia clave, destacando especialidades y áreas de dominio. "
-        "- Segundo párrafo: Formación académica y conocimientos técnicos/tecnologías. "
-        "- Tercer párrafo: Capacidades, idiomas y habilidades blandas. "
-        "- Cuarto párrafo: Reconocimientos, logros y compromiso profesional. "
-        "Usa frases impactantes, lenguaje persuasivo y evita redundancias. Integra toda la información relevante de manera coherente.\n\n"
-        f"Transcripción: {transcription}\n\n"
-        f"Información extraída: {json.dumps(profile_dict, ensure_ascii=False)}\n\n"
-        "Ejemplo de estilo: 'Físico Nuclear con sólida experiencia en fisión nuclear, seguridad de plantas y análisis de riesgos operativos. Formación en Ingeniería Nuclear, con dominio de procesos de energía nuclear, control radiológico y sistemas de protección. Capacidad comprobada para trabajar en entornos multidisciplinarios y colaborar en proyectos internacionales gracias a la fluidez en francés y ruso. Reconocido por su escucha activa, comunicación efectiva y disposición al aprendizaje continuo. Comprometido con la excelencia técnica, la innovación científica y la seguridad operacional, orientado a contribuir al desarrollo y mejora de proyectos en el sector energético y nuclear.'\n\n"
-        "Si algún dato no está disponible o es 'No especificado', intégralo sutilmente o omítelo si no aporta valor. "
-        "No uses formato Markdown, placeholders ni texto adicional fuera del perfil. "
-        "El perfil debe ser conciso, persuasivo y adecuado para un CV profesional."
-    )
+    if not await ensure_providers():
+        return _default_profile("No disponible", "ADVERTENCIA: Ni Groq ni Gemini están disponibles.")
 
     try:
-        print("Enviando prompt a Groq para generar perfil CV...")
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": "Eres un asistente especializado en crear perfiles profesionales para hojas de vida. Genera textos persuasivos y profesionales en español."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=1500
+        profile_json = await _chat(
+            "profile", text, PROFILE_SYSTEM_PROMPT, profile_prompt(text),
+            temperature=0.1, max_tokens=1000, json_mode=True, validate=_parse_profile_response,
+            use_cache=use_cache
+        )
+        logger.info("Perfil extraído exitosamente")
+        logger.debug("Perfil extraído: %s", profile_json)
+        return profile_json
+    except AllProvidersFailedError as e:
+        logger.error("Error en extract_profile_async: %s", e)
+        return _default_profile("No especificado", f"Error al procesar: {str(e)}")
+
+async def generate_cv_profile_async(transcription, profile_dict, use_cache=True):
+    """Genera un perfil profesional para hoja de vida"""
+    logger.debug("Generando perfil CV con transcripción: %s", transcription)
+    logger.debug("Perfil dict: %s", profile_dict)
+
+    if not await ensure_providers():
+        return "ADVERTENCIA: Ni Groq ni Gemini están disponibles para generar perfil."
+
+    try:
+        cv_profile = await _chat(
+            "cv", transcription, CV_SYSTEM_PROMPT, cv_prompt(transcription, profile_dict),
+            temperature=0.3, max_tokens=1500, extra=profile_dict, use_cache=use_cache
         )
-        cv_profile = response.choices[0].message.content.strip()
-        print(f"Perfil CV generado con Groq: {cv_profile[:300]}...")
+        logger.info("Perfil CV generado (%d caracteres)", len(cv_profile))
+        logger.debug("Perfil CV generado: %s", cv_profile)
         return cv_profile
-    except Exception as e:
-        print(f"Error en generate_cv_profile con Groq: {str(e)}")
-        if GEMINI_AVAILABLE:
-            print("Intentando con Gemini como respaldo...")
-            return generate_cv_profile_gemini(transcription, profile_dict)
+    except AllProvidersFailedError as e:
+        logger.error("Error en generate_cv_profile_async: %s", e)
         return f"Error al generar perfil profesional: {str(e)}"
 
-def generate_cv_profile_gemini(transcription, profile_dict):
-    """Genera un perfil profesional para hoja de vida usando Gemini AI como respaldo"""
-    if not GEMINI_AVAILABLE:
-        return "ADVERTENCIA: Google Generative AI no esta instalado."
-
-    prompt = (
-        "Con base en la siguiente transcripción de un video de presentación personal y la información extraída del perfil, "
-        "redacta un perfil profesional optimizado para una hoja de vida en el estilo de resúmenes ejecutivos concisos y impactantes. El perfil debe ser en español, "
-        "profesional y formal, escrito en tercera persona impersonal (sin mencionar el nombre al inicio), estructurado en párrafos cortos y enfocados. "
-        "Sigue esta estructura aproximada: "
-        "- Primer párrafo: Profesión y experiencia clave, destacando especialidades y áreas de dominio. "
-        "- Segundo párrafo: Formación académica y conocimientos técnicos/tecnologías. "
-        "- Tercer párrafo: Capacidades, idiomas y habilidades blandas. "
-        "- Cuarto párrafo: Reconocimientos, logros y compromiso profesional. "
-        "Usa frases impactantes, lenguaje persuasivo y evita redundancias. Integra toda la información relevante de manera coherente.\n\n"
-        f"Transcripción: {transcription}\n\n"
-        f"Información extraída: {json.dumps(profile_dict, ensure_ascii=False)}\n\n"
-        "Ejemplo de estilo: 'Físico Nuclear con sólida experiencia en fisión nuclear, seguridad de plantas y análisis de riesgos operativos. Formación en Ingeniería Nuclear, con dominio de procesos de energía nuclear, control radiológico y sistemas de protección. Capacidad comprobada para trabajar en entornos multidisciplinarios y colaborar en proyectos internacionales gracias a la fluidez en francés y ruso. Reconocido por su escucha activa, comunicación efectiva y disposición al aprendizaje continuo. Comprometido con la excelencia técnica, la innovación científica y la seguridad operacional, orientado a contribuir al desarrollo y mejora de proyectos en el sector energético y nuclear.'\n\n"
-        "Si algún dato no está disponible o es 'No especificado', intégralo sutilmente o omítelo si no aporta valor. "
-        "No uses formato Markdown, placeholders ni texto adicional fuera del perfil. "
-        "El perfil debe ser conciso, persuasivo y adecuado para un CV profesional."
-    )
+async def generate_cv_profile_stream(transcription, profile_dict, use_cache=True):
+    """Genera el perfil profesional fragmento a fragmento con las APIs de streaming de los proveedores
+
+    Un acierto de caché se entrega como un único fragmento. Si ningún proveedor puede
+    empezar, se entrega el mensaje de error como texto; si el stream se corta a medias
+    se lanza AllProvidersFailedError.
+    """
+    if not await ensure_providers():
+        yield "ADVERTENCIA: Ni Groq ni Gemini están disponibles para generar perfil."
+        return
+
+    temperature = 0.3
+
+    def key(provider):
+        return llm_cache.key("cv", transcription, PROMPT_CACHE_VERSION, provider.chat_model, temperature, profile_dict)
+
+    started = time.perf_counter()
+    if llm_cache is not None:
+        if use_cache:
+            cached = await asyncio.to_thread(llm_cache.get, *(key(provider) for provider in router.providers))
+            if cached is not None:
+                logger.info("Respuesta de cv obtenida de caché")
+                LLM_TASK_SECONDS.labels("cv_stream", "cache").observe(time.perf_counter() - started)
+                yield cached
+                return
+        else:
+            llm_cache.count_bypass()
 
+    parts = []
+    provider = None
     try:
-        print("Enviando prompt a Gemini para generar perfil CV...")
-        response = model.generate_content(prompt)
-        cv_profile = response.text.strip()
-        print(f"Perfil CV generado con Gemini: {cv_profile[:300]}...")
-        return cv_profile
-    except Exception as e:
-        print(f"Error en generate_cv_profile_gemini: {str(e)}")
-        return f"Error al generar perfil profesional: {str(e)}"
+        async for provider, chunk in router.stream(
+            "chat_stream", CV_SYSTEM_PROMPT, cv_prompt(transcription, profile_dict),
+            temperature=temperature, max_tokens=1500
+        ):
+            parts.append(chunk)
+            yield chunk
+    except AllProvidersFailedError as e:
+        logger.error("Error en generate_cv_profile_stream: %s", e)
+        if parts:
+            raise
+        yield f"Error al generar perfil profesional: {str(e)}"
+        return
+
+    cv_profile = "".join(parts).strip()
+    if provider is not None:
+        LLM_TASK_SECONDS.labels("cv_stream", provider.name).observe(time.perf_counter() - started)
+    logger.info("Perfil CV generado por streaming (%d caracteres)", len(cv_profile))
+    logger.debug("Perfil CV generado por streaming: %s", cv_profile)
+    if llm_cache is not None and provider is not None and cv_profile:
+        await asyncio.to_thread(llm_cache.set, key(provider), cv_profile)
+
+async def extract_profile_and_cv_async(transcription, use_cache=True):
+    """Obtiene perfil y texto de CV en una sola llamada en modo JSON
+
+    Devuelve (perfil_json, perfil_cv) o None si ningún proveedor produjo una respuesta válida.
+    """
+    if not await ensure_providers():
+        return None
 
+    try:
+        logger.info("Enviando prompt fusionado (perfil + CV)")
+        profile_json, cv_profile = await _chat(
+            "fused", transcription, PROFILE_SYSTEM_PROMPT, fused_prompt(transcription),
+            temperature=0.2, max_tokens=2500, json_mode=True, validate=_parse_fused_response,
+            use_cache=use_cache
+        )
+        return profile_json, cv_profile
+    except AllProvidersFailedError as e:
+        logger.error("Error en extract_profile_and_cv_async: %s", e)
+        return None
+
+async def close_async_clients():
+    """Cierra el pool HTTP compartido de los clientes asíncronos"""
+    if http_client is not None:
+        await http_client.aclose()
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from audio_service import remove_files
+from logging_service import request_id_var
+from metrics_service import JOBS_QUEUED, track_stage
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 16))
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", 1000))
+
+class QueueFullError(Exception):
+    """La cola de trabajos está llena; el cliente debe reintentar más tarde"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Cola de trabajos llena, reintentar en {retry_after} s")
+        self.retry_after = retry_after
+
+class MemoryJobStore:
+    """Almacén de trabajos en memoria; descarta los más antiguos al superar max_jobs"""
+
+    def __init__(self, max_jobs=JOB_MAX_STORED):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job_id, owner=None):
+        now = time.time()
+        job = {
+            "id": job_id, "status": "queued", "stage": None, "result": None,
+            "error": None, "created_at": now, "updated_at": now
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated_at=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def fail_incomplete(self, error, is_stale):
+        # En memoria no sobreviven trabajos a un reinicio
+        pass
+
+class SQLiteJobStore:
+    """Almacén de trabajos persistente en SQLite, compartible entre workers
+
+    Cada trabajo guarda el worker que lo encoló (owner, "host:pid"), el único que lo ejecuta.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, result TEXT, "
+                "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, owner TEXT)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def create(self, job_id, owner=None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created_at, updated_at, owner) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, now, now, owner)
+            )
+        return self.get(job_id)
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, stage, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(["id", "status", "stage", "result", "error", "created_at", "updated_at"], row))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def fail_incomplete(self, error, is_stale):
+        """Marca como fallidos los trabajos a medias cuyo worker ya no existe (is_stale(owner))
+
+        Los trabajos de otros workers vivos, que comparten la base de datos, no se tocan;
+        los anteriores a registrar el owner (NULL) se consideran huérfanos.
+        """
+        with self._lock, self._conn:
+            owners = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN ('queued', 'running')"
+            )]
+            for owner in owners:
+                if owner is None or is_stale(owner):
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                        "WHERE status IN ('queued', 'running') AND owner IS ?",
+                        (error, time.time(), owner)
+                    )
+
+def create_job_store(kind=JOB_STORE):
+    if kind == "sqlite":
+        return SQLiteJobStore()
+    if kind == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"JOB_STORE desconocido: {kind}")
+
+def _is_stale_owner(owner):
+    """Indica si el worker "host:pid" ya no existe; solo se puede saber para los de este host"""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # Mismo pid tras un reinicio (p. ej. pid 1 en un contenedor): aún no hay trabajos propios
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+class JobManager:
+    """Cola acotada de trabajos atendida por un pool fijo de workers asyncio
+
+    Las llamadas al almacén (SQLite) se hacen en hilos para no bloquear el event loop.
+    """
+
+    def __init__(self, handler, store=None, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE):
+        self.handler = handler
+        self.store = store if store is not None else create_job_store()
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._avg_duration = 30.0
+        self.owner = None
+        JOBS_QUEUED.set_function(self.queue.qsize)
+
+    async def start(self):
+        # Se calcula al arrancar y no al importar: los workers pueden ser forks de un proceso padre
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        await asyncio.to_thread(
+            self.store.fail_incomplete, "Trabajo interrumpido por un reinicio del servicio", _is_stale_owner
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Limpiar los videos de los trabajos que no llegaron a ejecutarse
+        while not self.queue.empty():
+            job_id, video_path, _, _ = self.queue.get_nowait()
+            await self._update(job_id, status="failed", error="Servicio detenido antes de procesar el trabajo")
+            await asyncio.to_thread(remove_files, video_path)
+
+    def retry_after(self):
+        """Segundos estimados hasta que se libere un hueco en la cola"""
+        pending = self.queue.qsize() + 1
+        return max(1, int(self._avg_duration * pending / max(self.workers, 1)))
+
+    def is_full(self):
+        return self.queue.full()
+
+    async def submit(self, video_path, **options):
+        """Encola un video ya guardado en disco; lanza QueueFullError si no hay capacidad
+
+        Las opciones adicionales se pasan tal cual al handler. El id de la petición que
+        crea el trabajo acompaña a sus registros de log.
+        """
+        if self.queue.full():
+            raise QueueFullError(self.retry_after())
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.create, job_id, self.owner)
+        try:
+            self.queue.put_nowait((job_id, video_path, options, request_id_var.get()))
+        except asyncio.QueueFull:
+            # Otra petición ocupó el último hueco mientras se guardaba el trabajo
+            await self._update(job_id, status="failed", error="Cola de trabajos llena")
+            raise QueueFullError(self.retry_after())
+        return job_id
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _update(self, job_id, **fields):
+        await asyncio.to_thread(self.store.update, job_id, **fields)
+
+    async def _update_after(self, previous, job_id, **fields):
+        # Las etapas se escriben en orden aunque cada escritura vaya en su propio hilo
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await self._update(job_id, **fields)
+
+    async def _worker(self):
+        while True:
+            job_id, video_path, options, request_id = await self.queue.get()
+            request_id_var.set(request_id)
+            started = time.monotonic()
+            stage_update = None
+
+            def on_stage(stage):
+                nonlocal stage_update
+                stage_update = asyncio.ensure_future(self._update_after(stage_update, job_id, stage=stage))
+
+            try:
+                await self._update(job_id, status="running")
+                with track_stage("job"):
+                    result = await self.handler(video_path, on_stage=on_stage, **options)
+                await self._update_after(stage_update, job_id, status="done", stage=None, result=result)
+            except asyncio.CancelledError:
+                await asyncio.shield(self._update(job_id, status="failed", error="Trabajo cancelado"))
+                raise
+            except Exception as e:
+                logger.error("Error en el trabajo %s: %s", job_id, e)
+                await self._update_after(stage_update, job_id, status="failed", error=str(e))
+            finally:
+                await asyncio.to_thread(remove_files, video_path)
+                # Media móvil exponencial de la duración para estimar Retry-After
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+                self.queue.task_done()
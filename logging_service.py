@@ -0,0 +1,33 @@
+import os
+import uuid
+import logging
+from contextvars import ContextVar
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Id de la petición en curso; las tareas y hilos lanzados desde la petición lo heredan
+request_id_var = ContextVar("request_id", default="-")
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+class RequestIdFilter(logging.Filter):
+    """Añade el id de la petición en curso a cada registro"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+def configure_logging(level=LOG_LEVEL):
+    """Configura el logger raíz una sola vez; los cuerpos de transcripciones y perfiles van en DEBUG"""
+    root = logging.getLogger()
+    if any(isinstance(f, RequestIdFilter) for handler in root.handlers for f in handler.filters):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    # httpx registra cada petición a los proveedores en INFO; ya quedan en las métricas
+    logging.getLogger("httpx").setLevel(logging.WARNING)
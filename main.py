@@ -1,13 +1,69 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import HTMLResponse
-import shutil
-import subprocess
-import tempfile
-import os
+import time
+
+# Inicio de la importación, para medir el arranque en frío
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from fastapi import FastAPI, UploadFile, File, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import asyncio
 import json
-from groq_service import transcribe_audio, extract_profile, generate_cv_profile
+import logging
+import os
+from logging_service import configure_logging
+
+# Antes de importar los servicios, que ya registran mensajes al configurarse
+configure_logging()
+
+from audio_service import AudioExtractionError, AudioExtractionLimitError, ffmpeg_version, save_upload, remove_files
+from batch_service import BatchError, save_batch, process_batch
+from cache_service import result_cache, llm_cache
+from ffmpeg_pool import ffmpeg_pool, stream_pool
+from groq_service import PROVIDERS_WARMUP, close_async_clients, ensure_providers, provider_status, router
+from job_service import JobManager, QueueFullError
+from metrics_service import STARTUP_SECONDS, RequestMetricsMiddleware, track_stage
+from pipeline import (
+    preflight_upload, process_video, process_upload, process_stream, stream_upload,
+    process_upload_session, start_session_extraction
+)
+from preflight_service import MediaRejectedError, RequestRejectedError, UploadLimitMiddleware
+from profile_store import profile_store
+from upload_service import UPLOAD_CHUNK_MAX_BYTES, UploadSessionError, upload_store
+
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+job_manager = JobManager(process_video)
+
+# Modo de las llamadas de perfil/CV seleccionable por petición (ver pipeline.LLM_MODES)
+LLMMode = Optional[Literal["sequential", "concurrent", "fused"]]
+
+# Duración de las fases del arranque, en segundos
+startup = {"import_seconds": None, "lifespan_seconds": None}
+
+@asynccontextmanager
+async def lifespan(app):
+    started = time.perf_counter()
+    await job_manager.start()
+    # Los proveedores se inicializan en segundo plano: el servicio acepta peticiones sin esperarlos
+    warmup = asyncio.create_task(ensure_providers()) if PROVIDERS_WARMUP else None
+    startup["lifespan_seconds"] = time.perf_counter() - started
+    STARTUP_SECONDS.labels("lifespan").set(startup["lifespan_seconds"])
+    logger.info(
+        "Servicio iniciado: importación %.3f s, lifespan %.3f s",
+        startup["import_seconds"], startup["lifespan_seconds"]
+    )
+    yield
+    if warmup is not None:
+        await asyncio.gather(warmup, return_exceptions=True)
+    await job_manager.stop()
+    await close_async_clients()
+
+app = FastAPI(lifespan=lifespan)
+# Las métricas van por fuera para contar también los 413 del límite de subida
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
 
 @app.get("/", response_class=HTMLResponse)
 async def get_upload_form():
@@ -54,50 +110,316 @@ async def get_upload_form():
     """
     return HTMLResponse(content=html_content)
 
+# Respuesta para cada límite que detiene FFmpeg: sobrecarga o cliente sin enviar datos, no un video inválido
+EXTRACTION_LIMIT_ERRORS = {
+    "timeout": ("extraction_timeout", "La extracción del audio superó el tiempo límite, intenta de nuevo más tarde", 503),
+    "idle": ("extraction_stalled", "La extracción del audio se detuvo sin recibir datos", 504),
+    "output_limit": ("audio_too_large", "El audio extraído supera el tamaño máximo permitido", 413)
+}
+
+def _rejected_response(e):
+    """Error estructurado para videos inválidos o fuera de los límites y para subidas por bloques"""
+    if isinstance(e, AudioExtractionLimitError):
+        logger.warning("FFmpeg detenido por un límite del servicio: %s", e)
+        e = MediaRejectedError(*EXTRACTION_LIMIT_ERRORS[e.reason])
+    elif isinstance(e, AudioExtractionError):
+        logger.warning("FFmpeg no pudo extraer el audio: %s", e)
+        e = MediaRejectedError("audio_extraction_failed", "No se pudo extraer el audio del video")
+    return JSONResponse(content=e.to_dict(), status_code=e.status_code)
+
+def _error_response():
+    import traceback
+    logger.exception("Error procesando el video")
+    return HTMLResponse(content=f"<h1>Error</h1><pre>{traceback.format_exc()}</pre><a href='/'>Volver</a>", status_code=500)
+
 @app.post("/upload-video")
-async def upload_video(file: UploadFile = File(...)):
+async def upload_video(file: UploadFile = File(...), llm_mode: LLMMode = None, bypass_cache: bool = False):
     try:
-        # 1. Guardar video temporal
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video_file:
-            temp_video = temp_video_file.name
-            shutil.copyfileobj(file.file, temp_video_file)
+        # El video se envía a FFmpeg por stdin y el audio se transcribe desde memoria
+        return await process_upload(file.file, llm_mode=llm_mode, bypass_cache=bypass_cache)
+    except (MediaRejectedError, AudioExtractionError) as e:
+        return _rejected_response(e)
+    except Exception:
+        return _error_response()
 
-        # 2. Extraer audio con FFmpeg
-        audio_file = temp_video.replace('.mp4', '.wav')
+@app.post("/upload-video/raw")
+async def upload_video_raw(request: Request, llm_mode: LLMMode = None, bypass_cache: bool = False):
+    """Recibe el video como cuerpo crudo y lo pasa a FFmpeg mientras se sube"""
+    try:
+        return await process_stream(request.stream(), llm_mode=llm_mode, bypass_cache=bypass_cache)
+    except (MediaRejectedError, AudioExtractionError) as e:
+        return _rejected_response(e)
+    except Exception:
+        return _error_response()
 
-        subprocess.run([
-            "ffmpeg", "-i", temp_video, "-vn", "-acodec", "pcm_s16le",
-            "-ar", "16000", "-ac", "1", audio_file
-        ], check=True)
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        # 3. Transcribir audio
-        transcription = transcribe_audio(audio_file)
+@app.post("/upload-video/stream")
+async def upload_video_stream(file: UploadFile = File(...), llm_mode: LLMMode = None, bypass_cache: bool = False):
+    """Procesa el video emitiendo eventos SSE por etapa y el perfil profesional token a token"""
+    # Validar antes de abrir el stream para poder responder con un estado HTTP de error
+    try:
+        await preflight_upload(file.file)
+    except MediaRejectedError as e:
+        return _rejected_response(e)
 
-        # 4. Extraer perfil
-        profile_json = extract_profile(transcription)
+    async def events():
         try:
-            profile = json.loads(profile_json)
-        except json.JSONDecodeError:
-            profile = {"error": "No se pudo parsear el perfil JSON", "raw": profile_json}
+            async for event, data in stream_upload(file.file, llm_mode=llm_mode, bypass_cache=bypass_cache):
+                yield _sse(event, data)
+        except Exception as e:
+            logger.exception("Error procesando el video en streaming")
+            yield _sse("error", {"error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/uploads", status_code=201)
+async def create_upload(size: int, filename: Optional[str] = None):
+    """Abre una subida reanudable de `size` bytes
+
+    Los bloques se envían con PUT /uploads/{id}?offset=N (en cualquier orden y con
+    reintentos), GET /uploads/{id} indica qué rangos faltan tras un corte y
+    POST /uploads/{id}/finalize procesa el video como /upload-video.
+    """
+    try:
+        session = await asyncio.to_thread(upload_store.create, size, filename)
+    except RequestRejectedError as e:
+        return _rejected_response(e)
+    return JSONResponse(
+        content={**session.to_dict(), "chunk_max_bytes": UPLOAD_CHUNK_MAX_BYTES},
+        status_code=201,
+        headers={"Location": f"/uploads/{session.id}"}
+    )
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Escribe el cuerpo crudo de la petición en `offset`; con los primeros bloques arranca FFmpeg en segundo plano"""
+    try:
+        session = await asyncio.to_thread(upload_store.get, upload_id)
+        with track_stage("upload"):
+            await session.write(offset, request.stream())
+    except UploadSessionError as e:
+        return _rejected_response(e)
+    start_session_extraction(session)
+    return session.to_dict()
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    try:
+        session = await asyncio.to_thread(upload_store.get, upload_id)
+    except UploadSessionError as e:
+        return _rejected_response(e)
+    return session.to_dict()
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    try:
+        await asyncio.to_thread(upload_store.get, upload_id)
+    except UploadSessionError as e:
+        return _rejected_response(e)
+    await asyncio.to_thread(upload_store.delete, upload_id)
+    return {"upload_id": upload_id, "deleted": True}
 
-        # 5. Generar perfil profesional para hoja de vida
-        cv_profile = generate_cv_profile(transcription, profile)
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, llm_mode: LLMMode = None, bypass_cache: bool = False):
+    """Procesa una subida completa; si falla por un error interno la sesión se conserva para reintentar"""
+    try:
+        session = await asyncio.to_thread(upload_store.get, upload_id)
+        await session.finalize()
+    except UploadSessionError as e:
+        return _rejected_response(e)
+    try:
+        result = await process_upload_session(session, llm_mode=llm_mode, bypass_cache=bypass_cache)
+    except (MediaRejectedError, AudioExtractionError) as e:
+        await asyncio.to_thread(upload_store.delete, upload_id)
+        return _rejected_response(e)
+    except Exception:
+        return _error_response()
+    await asyncio.to_thread(upload_store.delete, upload_id)
+    return result
+
+def _queue_full_response(retry_after):
+    return JSONResponse(
+        content={"error": "Cola de trabajos llena, intenta de nuevo más tarde", "retry_after": retry_after},
+        status_code=429,
+        headers={"Retry-After": str(retry_after)}
+    )
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...), llm_mode: LLMMode = None, bypass_cache: bool = False):
+    # Rechazar antes de copiar el video si ya no hay capacidad
+    if job_manager.is_full():
+        return _queue_full_response(job_manager.retry_after())
+    try:
+        await preflight_upload(file.file)
+    except MediaRejectedError as e:
+        return _rejected_response(e)
+
+    with track_stage("upload"):
+        temp_video, video_hash, video_size = await asyncio.to_thread(save_upload, file.file, ".mp4")
+    try:
+        job_id = await job_manager.submit(
+            temp_video, video_hash=video_hash, video_size=video_size, llm_mode=llm_mode,
+            bypass_cache=bypass_cache, probe=False
+        )
+    except QueueFullError as e:
+        await asyncio.to_thread(remove_files, temp_video)
+        return _queue_full_response(e.retry_after)
+
+    return JSONResponse(
+        content={"job_id": job_id, "status": "queued"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"}
+    )
+
+@app.post("/batch")
+async def upload_batch(files: List[UploadFile] = File(...), llm_mode: LLMMode = None,
+                       bypass_cache: bool = False, stream: bool = False):
+    """Procesa varios videos (archivos sueltos y/o zips) con concurrencia acotada
+
+    Con stream=true responde NDJSON, una línea por video a medida que termina; si no,
+    devuelve todos los resultados en el orden de entrada.
+    """
+    uploads = [(file.filename, file.content_type, file.file) for file in files]
+    try:
+        with track_stage("upload"):
+            items = await asyncio.to_thread(save_batch, uploads)
+    except BatchError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except MediaRejectedError as e:
+        return _rejected_response(e)
+
+    results = process_batch(items, process_video, llm_mode=llm_mode, bypass_cache=bypass_cache)
+    if stream:
+        async def ndjson():
+            async for result in results:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    collected = sorted([result async for result in results], key=lambda result: result["index"])
+    return {
+        "total": len(collected),
+        "failed": sum(1 for result in collected if result["status"] == "failed"),
+        "results": collected
+    }
 
-        # Limpiar archivos temporales
-        os.unlink(temp_video)
-        os.unlink(audio_file)
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Trabajo no encontrado"}, status_code=404)
+    return job
 
-        # Crear respuesta JSON
-        response_data = {
-            "transcripcion": cv_profile,
-            "perfil": profile
-        }
+@app.get("/cache/stats")
+async def get_cache_stats():
+    stats = {"enabled": False}
+    if result_cache is not None:
+        stats = {"enabled": True, **await asyncio.to_thread(result_cache.stats)}
+    # Caché de respuestas de chat (perfil, CV y modo fusionado)
+    stats["llm"] = {"enabled": False}
+    if llm_cache is not None:
+        stats["llm"] = {"enabled": True, **await asyncio.to_thread(llm_cache.stats)}
+    return stats
+
+def _profile_store_disabled():
+    return JSONResponse(content={"error": "Almacén de perfiles desactivado"}, status_code=503)
+
+@app.get("/profiles/search")
+async def search_profiles(q: Optional[str] = None, profesion: Optional[str] = None,
+                          idiomas: List[str] = Query([]), tecnologias: List[str] = Query([]),
+                          habilidades: List[str] = Query([]), limit: int = 20, offset: int = 0):
+    """Busca entre los perfiles ya procesados sin llamar a ningún LLM
+
+    `q` es texto libre sobre todos los campos y el CV (ordenado por relevancia); idiomas,
+    tecnologias y habilidades se repiten para exigir varios valores
+    (?idiomas=frances&tecnologias=python).
+    """
+    if profile_store is None:
+        return _profile_store_disabled()
+    started = time.perf_counter()
+    result = await asyncio.to_thread(
+        profile_store.search, q, profesion,
+        {"idiomas": idiomas, "tecnologias": tecnologias, "habilidades_blandas": habilidades},
+        limit, offset
+    )
+    return {**result, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+@app.get("/profiles/stats")
+async def get_profile_stats():
+    if profile_store is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(profile_store.stats)}
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: int):
+    if profile_store is None:
+        return _profile_store_disabled()
+    profile = await asyncio.to_thread(profile_store.get, profile_id)
+    if profile is None:
+        return JSONResponse(content={"error": "Perfil no encontrado"}, status_code=404)
+    return profile
+
+@app.delete("/profiles/{profile_id}")
+async def delete_profile(profile_id: int):
+    if profile_store is None:
+        return _profile_store_disabled()
+    if not await asyncio.to_thread(profile_store.delete, profile_id):
+        return JSONResponse(content={"error": "Perfil no encontrado"}, status_code=404)
+    return {"id": profile_id, "deleted": True}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def _ffmpeg_status(version):
+    return {
+        "available": version is not None, "version": version,
+        "pool": ffmpeg_pool.snapshot(), "stream_pool": stream_pool.snapshot()
+    }
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: el proceso responde; informa de proveedores y FFmpeg sin inicializar nada"""
+    return {
+        "status": "ok",
+        "uptime_seconds": round(time.perf_counter() - _import_started, 3),
+        "startup": {phase: round(seconds, 3) if seconds is not None else None for phase, seconds in startup.items()},
+        "providers": provider_status(),
+        "ffmpeg": _ffmpeg_status(await ffmpeg_version())
+    }
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: hay al menos un proveedor configurado y FFmpeg disponible (503 si no)
+
+    Si el calentamiento está desactivado, la primera consulta inicializa los proveedores.
+    """
+    providers = await ensure_providers()
+    version = await ffmpeg_version()
+    ready = bool(providers) and version is not None
+    return JSONResponse(
+        content={
+            "status": "ready" if ready else "not_ready",
+            "providers": provider_status(),
+            "circuits": router.snapshot(),
+            "ffmpeg": _ffmpeg_status(version)
+        },
+        status_code=200 if ready else 503
+    )
 
-        return response_data
+@app.get("/providers")
+async def get_providers():
+    """Estado del router: circuito, tasa de error y latencias por proveedor y operación"""
+    return router.snapshot()
 
-    except Exception as e:
-        import traceback
-        return HTMLResponse(content=f"<h1>Error</h1><pre>{traceback.format_exc()}</pre><a href='/'>Volver</a>", status_code=500)
+startup["import_seconds"] = time.perf_counter() - _import_started
+STARTUP_SECONDS.labels("import").set(startup["import_seconds"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,133 @@
+import re
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from logging_service import request_id_var, new_request_id
+
+# Buckets pensados para etapas que van de milisegundos (caché) a minutos (videos largos)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300, 600)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP",
+    ["method", "route", "status"], buckets=DURATION_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Peticiones HTTP en curso")
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds", "Duración de cada etapa del pipeline",
+    ["stage", "outcome"], buckets=DURATION_BUCKETS
+)
+STAGE_IN_FLIGHT = Gauge("pipeline_stage_in_flight", "Etapas del pipeline en curso", ["stage"])
+
+VIDEO_BYTES = Counter("pipeline_video_bytes_total", "Bytes de video recibidos para procesar")
+AUDIO_BYTES = Counter("pipeline_audio_bytes_total", "Bytes de audio extraídos por FFmpeg")
+AUDIO_SECONDS = Counter("pipeline_audio_seconds_total", "Segundos de audio extraídos por FFmpeg")
+# pool: "cpu" (ffmpeg_pool) o "stream" (extracciones al ritmo del cliente, stream_pool)
+FFMPEG_QUEUE_WAIT_SECONDS = Histogram(
+    "ffmpeg_queue_wait_seconds", "Espera por una plaza del pool de FFmpeg", ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+FFMPEG_WAITING = Gauge("ffmpeg_waiting", "Procesos FFmpeg esperando plaza en este worker", ["pool"])
+FFMPEG_RUNNING = Gauge("ffmpeg_running", "Procesos FFmpeg en ejecución en este worker", ["pool"])
+FFMPEG_TIMEOUTS = Counter("ffmpeg_timeouts_total", "Procesos FFmpeg terminados por tiempo límite", ["kind"])
+
+PREFLIGHT_REJECTIONS = Counter(
+    "preflight_rejections_total", "Subidas rechazadas antes de procesarlas, por motivo", ["code"]
+)
+VAD_REMOVED_SECONDS = Counter(
+    "pipeline_vad_removed_seconds_total", "Segundos de audio sin voz eliminados antes de transcribir"
+)
+
+PROVIDER_SECONDS = Histogram(
+    "provider_request_duration_seconds", "Duración de las llamadas a proveedores",
+    ["provider", "operation", "outcome"], buckets=DURATION_BUCKETS
+)
+PROVIDER_IN_FLIGHT = Gauge("provider_requests_in_flight", "Llamadas a proveedores en curso", ["provider"])
+PROVIDER_FALLBACKS = Counter(
+    "provider_fallbacks_total", "Operaciones resueltas por un proveedor distinto del preferido", ["operation"]
+)
+PROVIDER_HEDGES = Counter("provider_hedges_total", "Peticiones de cobertura lanzadas", ["operation"])
+PROVIDER_BYTES_SENT = Counter(
+    "provider_audio_bytes_sent_total", "Bytes de audio enviados a transcribir", ["provider"]
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens reportados por los proveedores", ["provider", "kind"]
+)
+LLM_TASK_SECONDS = Histogram(
+    "llm_task_duration_seconds", "Duración de las tareas de chat (perfil, CV, fusionada)",
+    ["task", "source"], buckets=DURATION_BUCKETS
+)
+PROMPT_TOKENS_SAVED = Counter(
+    "prompt_tokens_saved_total", "Tokens estimados que la compactación quitó de las transcripciones", ["task"]
+)
+JOBS_QUEUED = Gauge("jobs_queued", "Trabajos esperando en la cola")
+
+STARTUP_SECONDS = Gauge(
+    "startup_duration_seconds", "Duración de las fases del arranque (importación, lifespan, proveedores)", ["phase"]
+)
+
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Consultas a las cachés de resultados y de respuestas", ["cache", "result"]
+)
+
+@contextmanager
+def track_stage(stage):
+    """Mide la duración de una etapa y la cuenta como en curso mientras dura"""
+    in_flight = STAGE_IN_FLIGHT.labels(stage)
+    in_flight.inc()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        STAGE_SECONDS.labels(stage, outcome).observe(time.perf_counter() - started)
+        in_flight.dec()
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+class RequestMetricsMiddleware:
+    """Middleware ASGI: asigna el id de petición (X-Request-ID) y mide duración y peticiones en curso
+
+    Al ser ASGI puro, la duración de las respuestas en streaming (SSE, NDJSON) incluye
+    el envío completo del cuerpo.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        if not _REQUEST_ID_PATTERN.match(request_id):
+            request_id = new_request_id()
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Se etiqueta con la plantilla de la ruta (/jobs/{job_id}) para acotar la cardinalidad
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
+            request_id_var.reset(token)
+
+def record_tokens(provider, prompt_tokens, completion_tokens):
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider, "completion").inc(completion_tokens)
@@ -0,0 +1,526 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import tempfile
+from audio_service import (
+    AUDIO_FORMAT, AUDIO_FILENAMES, AUDIO_MIME_TYPES, COPY_CHUNK_SIZE, SNIFF_BYTES, AudioExtractionError,
+    AudioExtractionLimitError, remove_files, save_upload, hash_fileobj, peek, needs_seekable_input, open_file_path,
+    extract_audio_file, extract_audio_stream
+)
+from cache_service import result_cache
+from metrics_service import AUDIO_BYTES, VIDEO_BYTES, track_stage
+from preflight_service import PREFLIGHT_PROBE_BYTES, MediaRejectedError, preflight
+from profile_store import profile_store
+from groq_service import (
+    extract_profile_async, generate_cv_profile_async, generate_cv_profile_stream, extract_profile_and_cv_async
+)
+from transcription_service import ERROR_PREFIXES, TRANSCRIPTION_CACHE_VERSION, transcribe_segmented
+from upload_service import UPLOAD_PROGRESSIVE, UploadSessionError
+
+logger = logging.getLogger(__name__)
+
+# Etapas del pipeline en orden, reportadas a través de on_stage
+STAGES = ["extracting_audio", "transcribing", "extracting_profile", "generating_cv"]
+
+# "sequential": perfil y luego CV; "concurrent": ambas llamadas a la vez (el CV no recibe
+# el perfil); "fused": una sola llamada en modo JSON, con "concurrent" como respaldo
+LLM_MODES = ("sequential", "concurrent", "fused")
+LLM_MODE = os.getenv("LLM_MODE", "sequential")
+
+# Límites globales de concurrencia por etapa, compartidos por peticiones, trabajos y lotes
+# (los procesos FFmpeg los limitan ffmpeg_pool y stream_pool, también entre workers)
+PIPELINE_TRANSCRIBE_CONCURRENCY = int(os.getenv("PIPELINE_TRANSCRIBE_CONCURRENCY", 8))
+PIPELINE_LLM_CONCURRENCY = int(os.getenv("PIPELINE_LLM_CONCURRENCY", 8))
+
+_transcribe_slots = asyncio.Semaphore(PIPELINE_TRANSCRIBE_CONCURRENCY)
+_llm_slots = asyncio.Semaphore(PIPELINE_LLM_CONCURRENCY)
+
+def _notify(on_stage, stage):
+    if on_stage is not None:
+        on_stage(stage)
+
+def _build_response(cv_profile, profile_json):
+    try:
+        profile = json.loads(profile_json)
+    except json.JSONDecodeError:
+        profile = {"error": "No se pudo parsear el perfil JSON", "raw": profile_json}
+    return {
+        "transcripcion": cv_profile,
+        "perfil": profile
+    }
+
+def _is_cacheable(entry):
+    """Solo se cachean resultados completos, nunca mensajes de error de los proveedores"""
+    if entry["transcription"].startswith(ERROR_PREFIXES) or entry["cv_profile"].startswith(ERROR_PREFIXES):
+        return False
+    try:
+        return "error" not in json.loads(entry["profile_json"])
+    except json.JSONDecodeError:
+        return False
+
+async def _cached_entry_by_video(video_hash, video_size, bypass_cache=False):
+    if result_cache is None or not video_hash or bypass_cache:
+        return None
+    cached = await asyncio.to_thread(result_cache.get_by_video, video_hash, video_size, TRANSCRIPTION_CACHE_VERSION)
+    if cached is not None:
+        logger.info("Resultado obtenido de caché por hash de video: %s", video_hash[:12])
+    return cached
+
+async def _cached_by_video(video_hash, video_size, bypass_cache=False):
+    cached = await _cached_entry_by_video(video_hash, video_size, bypass_cache)
+    if cached is None:
+        return None
+    return _build_response(cached["cv_profile"], cached["profile_json"])
+
+async def _cached_by_audio(audio_bytes, video_hash, bypass_cache=False):
+    """Consulta la caché por el hash del audio; devuelve (hash_del_audio, entrada o None)"""
+    if result_cache is None:
+        return None, None
+    audio_hash = await asyncio.to_thread(lambda: hashlib.sha256(audio_bytes).hexdigest())
+    if bypass_cache:
+        return audio_hash, None
+    cached = await asyncio.to_thread(result_cache.get_by_audio, audio_hash, len(audio_bytes), TRANSCRIPTION_CACHE_VERSION)
+    if cached is not None:
+        logger.info("Resultado obtenido de caché por hash de audio: %s", audio_hash[:12])
+        if video_hash:
+            await asyncio.to_thread(result_cache.set, cached, video_hash, TRANSCRIPTION_CACHE_VERSION)
+    return audio_hash, cached
+
+async def _store_result(audio_hash, video_hash, transcription, profile_json, cv_profile):
+    """Guarda un resultado completo en la caché y en el almacén de perfiles consultable"""
+    entry = {
+        "audio_hash": audio_hash,
+        "transcription": transcription,
+        "profile_json": profile_json,
+        "cv_profile": cv_profile
+    }
+    if not _is_cacheable(entry):
+        return
+    if audio_hash is not None:
+        await asyncio.to_thread(result_cache.set, entry, video_hash, TRANSCRIPTION_CACHE_VERSION)
+    if profile_store is not None:
+        try:
+            await asyncio.to_thread(
+                profile_store.add, json.loads(profile_json), cv_profile, video_hash or audio_hash
+            )
+        except sqlite3.Error as e:
+            # El resultado se devuelve igualmente; solo deja de aparecer en las búsquedas
+            logger.warning("No se pudo guardar el perfil en el almacén: %s", e)
+
+async def _read_chunks(source):
+    """Recorre un archivo abierto por bloques leyendo en un hilo"""
+    while True:
+        chunk = await asyncio.to_thread(source.read, COPY_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+async def _save_stream(chunks, suffix=".mp4"):
+    """Vuelca un flujo asíncrono a un archivo temporal; devuelve su ruta"""
+    temp_file = await asyncio.to_thread(tempfile.NamedTemporaryFile, delete=False, suffix=suffix)
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(temp_file.write, chunk)
+    finally:
+        await asyncio.to_thread(temp_file.close)
+    return temp_file.name
+
+async def _extract_audio(extract, *args):
+    """Ejecuta una extracción con FFmpeg midiendo la etapa; devuelve (audio, segundos)"""
+    with track_stage("extracting_audio"):
+        audio_bytes, seconds = await extract(*args)
+    AUDIO_BYTES.inc(len(audio_bytes))
+    return audio_bytes, seconds
+
+async def _transcribe(audio_bytes, duration=None):
+    async with _transcribe_slots:
+        with track_stage("transcribing"):
+            return await transcribe_segmented(
+                audio_bytes, AUDIO_FILENAMES[AUDIO_FORMAT], AUDIO_MIME_TYPES[AUDIO_FORMAT], duration
+            )
+
+async def _iter_head(head):
+    yield head
+
+async def preflight_upload(source):
+    """Valida con ffprobe un archivo subido antes de hashearlo o copiarlo; lanza MediaRejectedError
+
+    ffprobe deja de leer en cuanto tiene el contenedor y las pistas, así que solo un MP4
+    con el índice al final se llega a leer entero.
+    """
+    await asyncio.to_thread(source.seek, 0)
+    try:
+        await preflight(chunks=_read_chunks(source))
+    finally:
+        await asyncio.to_thread(source.seek, 0)
+
+async def _hash_upload(source):
+    with track_stage("upload"):
+        video_hash, video_size = await asyncio.to_thread(hash_fileobj, source)
+    VIDEO_BYTES.inc(video_size)
+    return video_hash, video_size
+
+async def _run_llm_stages(transcription, llm_mode, on_stage, bypass_cache=False):
+    """Ejecuta las llamadas de perfil y CV según el modo; devuelve (perfil_json, perfil_cv)"""
+    use_cache = not bypass_cache
+    if llm_mode == "fused":
+        _notify(on_stage, "extracting_profile")
+        result = await extract_profile_and_cv_async(transcription, use_cache)
+        if result is not None:
+            return result
+        logger.warning("La respuesta fusionada no es válida, ejecutando perfil y CV en paralelo")
+        llm_mode = "concurrent"
+
+    if llm_mode == "concurrent":
+        _notify(on_stage, "generating_cv")
+        return await asyncio.gather(
+            extract_profile_async(transcription, use_cache),
+            generate_cv_profile_async(transcription, None, use_cache)
+        )
+
+    # 3. Extraer perfil
+    _notify(on_stage, "extracting_profile")
+    profile_json = await extract_profile_async(transcription, use_cache)
+
+    # 4. Generar perfil profesional para hoja de vida
+    _notify(on_stage, "generating_cv")
+    cv_profile = await generate_cv_profile_async(
+        transcription, _build_response(None, profile_json)["perfil"], use_cache
+    )
+    return profile_json, cv_profile
+
+async def process_audio(audio_bytes, on_stage=None, video_hash=None, llm_mode=None, bypass_cache=False,
+                        duration=None):
+    """Transcripción → perfil → CV sobre el audio ya extraído en memoria
+
+    Antes de llamar a los proveedores se consulta la caché por el hash del audio, que
+    detecta el mismo audio aunque haya llegado en otro contenedor. Con bypass_cache no
+    se leen las cachés (resultados y respuestas de chat), pero sí se actualizan.
+    `duration` (segundos, si se conoce) evita decodificar el audio solo para medirlo.
+    """
+    audio_hash, cached = await _cached_by_audio(audio_bytes, video_hash, bypass_cache)
+    if cached is not None:
+        return _build_response(cached["cv_profile"], cached["profile_json"])
+
+    # 2. Transcribir audio
+    _notify(on_stage, "transcribing")
+    transcription = await _transcribe(audio_bytes, duration)
+
+    # 3-4. Extraer perfil y generar perfil profesional para hoja de vida
+    async with _llm_slots:
+        with track_stage("llm"):
+            profile_json, cv_profile = await _run_llm_stages(
+                transcription, llm_mode or LLM_MODE, on_stage, bypass_cache
+            )
+    response_data = _build_response(cv_profile, profile_json)
+    await _store_result(audio_hash, video_hash, transcription, profile_json, cv_profile)
+    return response_data
+
+async def process_video(video_path, on_stage=None, video_hash=None, video_size=0, llm_mode=None,
+                        bypass_cache=False, probe=True):
+    """Ejecuta FFmpeg → transcripción → perfil → CV sobre un video ya guardado en disco
+
+    Con probe=False se omite la validación con ffprobe (ya hecha al recibir el video).
+    """
+    VIDEO_BYTES.inc(video_size)
+    cached = await _cached_by_video(video_hash, video_size, bypass_cache)
+    if cached is not None:
+        return cached
+    if probe:
+        await preflight(path=video_path)
+
+    # 1. Extraer audio con FFmpeg directamente a memoria
+    _notify(on_stage, "extracting_audio")
+    audio_bytes, seconds = await _extract_audio(extract_audio_file, video_path)
+    return await process_audio(audio_bytes, on_stage, video_hash, llm_mode, bypass_cache, seconds)
+
+async def process_upload(source, on_stage=None, llm_mode=None, bypass_cache=False):
+    """Procesa un archivo subido (UploadFile.file) enviándolo a FFmpeg por stdin
+
+    Si el contenedor necesita acceso aleatorio (MP4 con moov al final) FFmpeg lee el
+    archivo subido directamente. Antes se valida con ffprobe y un video inválido se
+    rechaza con MediaRejectedError sin llegar a FFmpeg.
+    """
+    await preflight_upload(source)
+    video_hash, video_size = await _hash_upload(source)
+    cached = await _cached_by_video(video_hash, video_size, bypass_cache)
+    if cached is not None:
+        return cached
+
+    # 1. Extraer audio con FFmpeg
+    _notify(on_stage, "extracting_audio")
+    audio_bytes, seconds = await _extract_upload_audio(source)
+    return await process_audio(audio_bytes, on_stage, video_hash, llm_mode, bypass_cache, seconds)
+
+async def _extract_upload_audio(source):
+    """Extrae el audio de un archivo subido; devuelve (audio, segundos)
+
+    Por stdin si el contenedor se puede leer desde un pipe; si no, o si desde el pipe
+    FFmpeg falla o no obtiene audio (un MP4/MOV con el índice al final que la cabecera
+    no delata termina bien pero sin muestras), desde el archivo.
+    """
+    head = await asyncio.to_thread(peek, source)
+    if needs_seekable_input(head):
+        logger.info("Contenedor sin índice al inicio, extrayendo desde el archivo subido")
+        return await _extract_upload_file(source)
+    try:
+        audio_bytes, seconds = await _extract_audio(extract_audio_stream, _read_chunks(source))
+    except AudioExtractionLimitError:
+        raise
+    except AudioExtractionError as e:
+        logger.warning("FFmpeg no pudo leer el video desde un pipe, extrayendo desde el archivo: %s", e)
+        return await _extract_upload_file(source)
+    if seconds is None:
+        logger.warning("FFmpeg no obtuvo audio leyendo el video desde un pipe, extrayendo desde el archivo")
+        return await _extract_upload_file(source)
+    return audio_bytes, seconds
+
+async def _extract_upload_file(source):
+    """Extrae el audio con acceso aleatorio al archivo subido
+
+    El temporal de Starlette ya está en disco: FFmpeg lo abre por /dev/fd sin copiarlo.
+    Solo si no hay descriptor se copia a un temporal propio.
+    """
+    opened = await asyncio.to_thread(open_file_path, source)
+    if opened is not None:
+        path, fd = opened
+        return await _extract_audio(extract_audio_file, path, (fd,))
+    await asyncio.to_thread(source.seek, 0)
+    temp_video, _, _ = await asyncio.to_thread(save_upload, source, ".mp4")
+    try:
+        return await _extract_audio(extract_audio_file, temp_video)
+    finally:
+        await asyncio.to_thread(remove_files, temp_video)
+
+async def stream_upload(source, llm_mode=None, bypass_cache=False):
+    """Variante de process_upload que genera eventos (nombre, datos) a medida que avanza
+
+    Eventos: "upload_received", "audio_extracted", "transcription", "profile", "cv_delta"
+    (fragmentos del perfil profesional tal como llegan del proveedor) y "done" con la
+    respuesta completa. El modo fusionado no admite streaming y se ejecuta como "sequential".
+    La validación con preflight_upload la hace el llamador, antes de empezar a responder.
+    """
+    video_hash, video_size = await _hash_upload(source)
+    yield "upload_received", {"bytes": video_size}
+
+    audio_hash = None
+    cached = await _cached_entry_by_video(video_hash, video_size, bypass_cache)
+    if cached is None:
+        audio_bytes, seconds = await _extract_upload_audio(source)
+        yield "audio_extracted", {"bytes": len(audio_bytes), "seconds": seconds and round(seconds, 1)}
+        audio_hash, cached = await _cached_by_audio(audio_bytes, video_hash, bypass_cache)
+    if cached is not None:
+        yield "transcription", {"text": cached["transcription"]}
+        yield "profile", _build_response(None, cached["profile_json"])["perfil"]
+        yield "cv_delta", {"text": cached["cv_profile"]}
+        yield "done", _build_response(cached["cv_profile"], cached["profile_json"])
+        return
+
+    transcription = await _transcribe(audio_bytes, seconds)
+    yield "transcription", {"text": transcription}
+
+    events = asyncio.Queue()
+    producer = asyncio.create_task(_produce_llm_events(transcription, llm_mode or LLM_MODE, not bypass_cache, events))
+    # Marca de fin, encolada detrás de los eventos de la tarea aunque esta falle
+    producer.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        profile_json, cv_profile = await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+
+    await _store_result(audio_hash, video_hash, transcription, profile_json, cv_profile)
+    yield "done", _build_response(cv_profile, profile_json)
+
+async def _produce_llm_events(transcription, llm_mode, use_cache, events):
+    """Perfil y CV en streaming para stream_upload; deja los eventos en la cola `events`
+
+    La plaza de _llm_slots solo se ocupa mientras duran las llamadas a los proveedores:
+    los eventos se encolan sin esperar a que el cliente SSE los lea, así que un navegador
+    lento no bloquea al resto de peticiones, trabajos y lotes. Devuelve (perfil_json, perfil_cv).
+    """
+    profile_json = None
+    profile_task = None
+    parts = []
+    async with _llm_slots:
+        with track_stage("llm"):
+            if llm_mode == "concurrent":
+                profile_task = asyncio.create_task(extract_profile_async(transcription, use_cache))
+                profile_dict = None
+            else:
+                profile_json = await extract_profile_async(transcription, use_cache)
+                profile_dict = _build_response(None, profile_json)["perfil"]
+                events.put_nowait(("profile", profile_dict))
+
+            try:
+                async for chunk in generate_cv_profile_stream(transcription, profile_dict, use_cache):
+                    parts.append(chunk)
+                    events.put_nowait(("cv_delta", {"text": chunk}))
+                    # En modo concurrente el perfil se emite en cuanto está listo, entre fragmentos
+                    if profile_json is None and profile_task is not None and profile_task.done():
+                        profile_json = profile_task.result()
+                        events.put_nowait(("profile", _build_response(None, profile_json)["perfil"]))
+                if profile_json is None and profile_task is not None:
+                    profile_json = await profile_task
+                    events.put_nowait(("profile", _build_response(None, profile_json)["perfil"]))
+            finally:
+                if profile_task is not None and not profile_task.done():
+                    profile_task.cancel()
+    return profile_json, "".join(parts).strip()
+
+async def process_stream(chunks, on_stage=None, llm_mode=None, bypass_cache=False):
+    """Procesa un video que llega como flujo asíncrono de bytes (cuerpo crudo de la petición)
+
+    FFmpeg empieza a decodificar mientras el video todavía se está recibiendo; el hash del
+    video se calcula al vuelo y solo se conoce al terminar la subida.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    complete = True
+    iterator = chunks.__aiter__()
+    async for chunk in iterator:
+        head += chunk
+        if len(head) >= max(SNIFF_BYTES, PREFLIGHT_PROBE_BYTES):
+            complete = False
+            break
+
+    async def hashed():
+        nonlocal size
+        digest.update(head)
+        size += len(head)
+        yield head
+        async for chunk in iterator:
+            digest.update(chunk)
+            size += len(chunk)
+            yield chunk
+
+    # 1. Extraer audio con FFmpeg
+    _notify(on_stage, "extracting_audio")
+    if needs_seekable_input(head):
+        logger.info("Contenedor sin índice al inicio, extrayendo desde archivo temporal")
+        temp_video = await _save_stream(hashed())
+        try:
+            await preflight(path=temp_video)
+            audio_bytes, seconds = await _extract_audio(extract_audio_file, temp_video)
+        finally:
+            await asyncio.to_thread(remove_files, temp_video)
+    else:
+        # Solo se dispone de la cabecera: se valida lo que ffprobe pueda leer de ella
+        await preflight(chunks=_iter_head(head), complete=complete)
+        # FFmpeg avanza al ritmo de la subida: ocupa una plaza de stream_pool, no una de CPU
+        audio_bytes, seconds = await _extract_audio(extract_audio_stream, hashed(), True)
+
+    video_hash = digest.hexdigest()
+    VIDEO_BYTES.inc(size)
+    cached = await _cached_by_video(video_hash, size, bypass_cache)
+    if cached is not None:
+        return cached
+    return await process_audio(audio_bytes, on_stage, video_hash, llm_mode, bypass_cache, seconds)
+
+def _log_extraction(task):
+    # Recoger el error aunque nadie espere la tarea (sesión abandonada o finalizada en otro worker)
+    if not task.cancelled() and task.exception() is not None:
+        logger.info("Extracción progresiva interrumpida: %s", task.exception())
+
+# Tareas de start_session_extraction en curso (el bucle solo guarda referencias débiles)
+_session_starts = set()
+
+def start_session_extraction(session):
+    """Arranca en segundo plano la extracción progresiva de una subida por bloques
+
+    Se llama tras cada bloque recibido sin esperar: leer la cabecera y validarla con
+    ffprobe no retrasa la respuesta del bloque. Un fallo (p. ej. la sesión se borró
+    entretanto) solo se registra; al finalizar, el audio se extrae desde el archivo.
+    """
+    task = asyncio.create_task(_start_session_extraction(session))
+    _session_starts.add(task)
+    task.add_done_callback(_session_starts.discard)
+    return task
+
+async def _start_session_extraction(session):
+    try:
+        await _begin_session_extraction(session)
+    except Exception as e:
+        logger.warning("Subida %s: no se pudo iniciar la extracción progresiva: %s", session.id[:12], e)
+
+async def _begin_session_extraction(session):
+    """Arranca la extracción progresiva si el contenedor lo permite
+
+    Actúa una sola vez, cuando ya han llegado los primeros bytes contiguos: FFmpeg lee el
+    video con session.follow() a medida que se completa, así que el audio está listo casi
+    al terminar la subida. Mientras tanto ocupa una plaza de stream_pool (no de
+    ffmpeg_pool); si la subida se detiene más de FFMPEG_IDLE_TIMEOUT, la extracción se
+    aborta y al finalizar se hace desde el archivo.
+    """
+    if not UPLOAD_PROGRESSIVE or session.streamable is not None or session.finalized:
+        return
+    head_size = min(max(SNIFF_BYTES, PREFLIGHT_PROBE_BYTES), session.size)
+    if session.offset < head_size:
+        return
+    # Marcar antes del primer await: los bloques que lleguen mientras tanto no la arrancan otra vez
+    session.streamable = False
+    head = await session.read_head(head_size)
+    if needs_seekable_input(head):
+        logger.info("Subida %s: contenedor sin índice al inicio, se extraerá al finalizar", session.id[:12])
+        return
+    try:
+        await preflight(chunks=_iter_head(head), complete=len(head) >= session.size)
+    except MediaRejectedError as e:
+        # El rechazo se comunica al finalizar, con el archivo completo
+        logger.info("Subida %s: no se extrae de forma progresiva (%s)", session.id[:12], e.code)
+        return
+    if session.finalized or session.deleted:
+        return
+    session.streamable = True
+    logger.info("Subida %s: extracción progresiva iniciada", session.id[:12])
+    session.extraction = asyncio.create_task(_extract_audio(extract_audio_stream, session.follow(), True))
+    session.extraction.add_done_callback(_log_extraction)
+
+def _cancel_extraction(session):
+    if session.extraction is not None:
+        session.extraction.cancel()
+
+async def _session_audio(session):
+    """(audio, segundos) de la extracción progresiva si terminó bien; si no, se extrae desde el archivo"""
+    task = session.extraction
+    if task is not None and not task.cancelled():
+        try:
+            return await task
+        except (AudioExtractionError, UploadSessionError, OSError) as e:
+            logger.warning("La extracción progresiva falló, extrayendo desde el archivo: %s", e)
+    return await _extract_audio(extract_audio_file, session.data_path)
+
+async def process_upload_session(session, on_stage=None, llm_mode=None, bypass_cache=False):
+    """Procesa una subida por bloques ya finalizada (todos los bytes en session.data_path)
+
+    Se valida con ffprobe el archivo completo y se reutiliza el audio de la extracción
+    progresiva cuando la arrancó este mismo proceso.
+    """
+    source = await asyncio.to_thread(open, session.data_path, "rb")
+    try:
+        video_hash, video_size = await _hash_upload(source)
+    finally:
+        await asyncio.to_thread(source.close)
+    cached = await _cached_by_video(video_hash, video_size, bypass_cache)
+    if cached is not None:
+        _cancel_extraction(session)
+        return cached
+    try:
+        await preflight(path=session.data_path)
+    except MediaRejectedError:
+        _cancel_extraction(session)
+        raise
+
+    # 1. Extraer audio con FFmpeg (o recoger el de la extracción progresiva)
+    _notify(on_stage, "extracting_audio")
+    audio_bytes, seconds = await _session_audio(session)
+    return await process_audio(audio_bytes, on_stage, video_hash, llm_mode, bypass_cache, seconds)
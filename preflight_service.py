@@ -0,0 +1,198 @@
+import os
+import json
+import asyncio
+import logging
+from audio_service import MAX_VIDEO_SECONDS, AudioExtractionError, AudioExtractionLimitError, probe_media
+from metrics_service import PREFLIGHT_REJECTIONS, track_stage
+
+logger = logging.getLogger(__name__)
+
+# Validación previa con ffprobe (contenedor, pista de audio, códec y duración)
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", 10))
+# Bytes iniciales que se analizan cuando el video llega como flujo y no se puede releer
+PREFLIGHT_PROBE_BYTES = int(os.getenv("PREFLIGHT_PROBE_BYTES", 2 * 1024 * 1024))
+# Códecs de audio aceptados, separados por comas (vacío: cualquiera que ffprobe reconozca)
+PREFLIGHT_AUDIO_CODECS = [
+    codec.strip() for codec in os.getenv("PREFLIGHT_AUDIO_CODECS", "").split(",") if codec.strip()
+]
+
+# Límites del cuerpo de las peticiones, comprobados antes de leerlo
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 500 * 1024 * 1024))
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", 2 * 1024 * 1024 * 1024))
+
+class RequestRejectedError(Exception):
+    """Petición rechazada con un código estable y el estado HTTP; `details` se añade a la respuesta"""
+
+    default_status_code = 400
+
+    def __init__(self, code, message, status_code=None, **details):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code or self.default_status_code
+        self.details = details
+
+    def to_dict(self):
+        return {"error": self.message, "code": self.code, **self.details}
+
+class MediaRejectedError(RequestRejectedError):
+    """El video se rechaza antes de procesarlo"""
+
+    default_status_code = 422
+
+class UploadTooLargeError(MediaRejectedError):
+    def __init__(self, limit):
+        super().__init__(
+            "upload_too_large", f"El archivo supera el máximo de {limit} bytes", 413, max_bytes=limit
+        )
+
+def _duration(info):
+    """Duración del contenedor o, si no la declara, la de la pista más larga; None si se desconoce"""
+    values = [info.get("format", {}).get("duration")]
+    values += [stream.get("duration") for stream in info.get("streams", [])]
+    durations = []
+    for value in values:
+        try:
+            durations.append(float(value))
+        except (TypeError, ValueError):
+            continue
+    return max(durations) if durations else None
+
+def validate_media(info):
+    """Comprueba el resultado de ffprobe contra los límites; lanza MediaRejectedError"""
+    streams = info.get("streams", [])
+    if not streams:
+        raise MediaRejectedError("invalid_container", "No se reconoce ninguna pista en el archivo")
+
+    audio = [stream for stream in streams if stream.get("codec_type") == "audio"]
+    if not audio:
+        raise MediaRejectedError("no_audio_stream", "El video no tiene pista de audio")
+
+    codecs = [stream.get("codec_name") for stream in audio]
+    if not any(codec and codec != "none" for codec in codecs):
+        raise MediaRejectedError("unsupported_audio_codec", "Códec de audio no reconocido", 415)
+    if PREFLIGHT_AUDIO_CODECS and not any(codec in PREFLIGHT_AUDIO_CODECS for codec in codecs):
+        raise MediaRejectedError(
+            "unsupported_audio_codec", f"Códec de audio no admitido: {', '.join(filter(None, codecs))}", 415,
+            allowed=PREFLIGHT_AUDIO_CODECS
+        )
+
+    duration = _duration(info)
+    if duration is not None and duration > MAX_VIDEO_SECONDS:
+        raise MediaRejectedError(
+            "duration_exceeded", f"El video dura {duration:.0f} s y el máximo es {MAX_VIDEO_SECONDS:.0f} s",
+            duration_seconds=round(duration, 1), max_seconds=MAX_VIDEO_SECONDS
+        )
+    return {"format": info.get("format", {}).get("format_name"), "audio_codec": codecs[0], "duration": duration}
+
+async def preflight(path=None, chunks=None, complete=True):
+    """Analiza el video con ffprobe (desde `path` o alimentando `chunks`) y lo valida
+
+    Con complete=False solo se dispone de los primeros bytes: si ffprobe no consigue leer
+    el contenedor no se rechaza, porque puede faltarle el resto del índice. Si ffprobe no
+    está instalado o no responde a tiempo, la validación se omite.
+    """
+    if not PREFLIGHT_ENABLED:
+        return None
+
+    with track_stage("preflight"):
+        try:
+            info = await asyncio.wait_for(
+                probe_media(path or "pipe:0", None if path else chunks), PREFLIGHT_TIMEOUT
+            )
+        except OSError as e:
+            logger.warning("ffprobe no disponible, se omite la validación previa: %s", e)
+            return None
+        except asyncio.TimeoutError:
+            logger.warning("ffprobe no respondió en %.0f s, se omite la validación previa", PREFLIGHT_TIMEOUT)
+            return None
+        except AudioExtractionLimitError as e:
+            # Un límite del servicio no dice nada del archivo: se valida al extraer
+            logger.warning("ffprobe se detuvo por un límite, se omite la validación previa: %s", e)
+            return None
+        except (AudioExtractionError, json.JSONDecodeError) as e:
+            if not complete:
+                logger.info("ffprobe no pudo leer la cabecera del flujo, se valida al extraer: %s", e)
+                return None
+            PREFLIGHT_REJECTIONS.labels("invalid_container").inc()
+            raise MediaRejectedError("invalid_container", "El archivo no es un video válido o está dañado") from e
+
+        try:
+            summary = validate_media(info)
+        except MediaRejectedError as e:
+            PREFLIGHT_REJECTIONS.labels(e.code).inc()
+            raise
+    logger.info(
+        "Validación previa: %s, audio %s, %s s",
+        summary["format"], summary["audio_codec"],
+        f"{summary['duration']:.1f}" if summary["duration"] is not None else "duración desconocida"
+    )
+    return summary
+
+async def _send_json(send, status_code, content):
+    body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class UploadLimitMiddleware:
+    """Rechaza con 413 los cuerpos que superan el límite sin llegar a almacenarlos
+
+    Con Content-Length se decide al recibir las cabeceras. Sin él (transferencia por
+    bloques) se cuentan los bytes a medida que llegan: al superar el límite se corta la
+    lectura y la respuesta que dé la aplicación se sustituye por el 413.
+    """
+
+    def __init__(self, app, limits=None, default_limit=MAX_UPLOAD_BYTES):
+        self.app = app
+        self.limits = {"/batch": MAX_BATCH_BYTES, **(limits or {})}
+        self.default_limit = default_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.get(scope["path"], self.default_limit)
+        error = UploadTooLargeError(limit)
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            PREFLIGHT_REJECTIONS.labels(error.code).inc()
+            await _send_json(send, error.status_code, error.to_dict())
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise error
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded and not response_started:
+                # La aplicación ya respondió al error a su manera: se descarta esa respuesta
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            if response_started:
+                raise
+        if exceeded and not response_started:
+            PREFLIGHT_REJECTIONS.labels(error.code).inc()
+            await _send_json(send, error.status_code, error.to_dict())
@@ -0,0 +1,204 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from groq_service import PROFILE_FIELDS
+
+# Almacén de los perfiles procesados, consultable sin volver a llamar a ningún LLM
+PROFILE_STORE_ENABLED = os.getenv("PROFILE_STORE_ENABLED", "true").lower() == "true"
+PROFILE_DB_PATH = os.getenv("PROFILE_DB_PATH", "profiles.db")
+PROFILE_SEARCH_MAX_LIMIT = int(os.getenv("PROFILE_SEARCH_MAX_LIMIT", 100))
+
+# Campos con listas ("Python, Go") que se indexan término a término para filtrar
+TERM_FIELDS = ("tecnologias", "idiomas", "habilidades_blandas")
+
+# Peso de cada columna en el ranking bm25 (en el orden de FTS_COLUMNS)
+FTS_COLUMNS = [*PROFILE_FIELDS, "cv_text"]
+FTS_WEIGHTS = {
+    "nombre": 3.0, "profesion": 5.0, "experiencia": 2.0, "educacion": 2.0, "tecnologias": 4.0,
+    "idiomas": 3.0, "logros": 1.0, "habilidades_blandas": 1.0, "cv_text": 0.5
+}
+
+_EMPTY_VALUES = {"", "no especificado", "no disponible", "ninguno", "n/a"}
+_TERM_SEPARATORS = re.compile(r"[,;/\n•]|\s+y\s+|\s+e\s+")
+
+def normalize_term(value):
+    """Minúsculas, sin tildes, sin aclaraciones entre paréntesis y con espacios simples"""
+    value = re.sub(r"\([^)]*\)", " ", value)
+    value = unicodedata.normalize("NFKD", value.lower())
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w+#.\s-]", " ", value).split()).strip(" .-")
+
+def split_terms(value):
+    """Términos normalizados de un campo de lista ("Español (nativo), inglés y francés")"""
+    terms = {normalize_term(part) for part in _TERM_SEPARATORS.split(value or "")}
+    return sorted(term for term in terms if term not in _EMPTY_VALUES)
+
+def _match_query(text, column=None):
+    """Convierte texto libre en una consulta FTS5 segura: todas las palabras, por prefijo"""
+    words = re.findall(r"\w+", text)
+    prefix = f"{column} : " if column else ""
+    return " ".join(f'{prefix}"{word}"*' for word in words)
+
+class ProfileStore:
+    """Perfiles extraídos en SQLite con índice FTS5 (bm25) e índices normalizados por campo
+
+    Cada video se guarda una sola vez (clave: hash del video o del audio); volver a
+    procesarlo actualiza la fila. Las búsquedas combinan texto libre sobre todos los
+    campos y el CV con filtros exactos por término (idiomas, tecnologías, habilidades).
+    """
+
+    def __init__(self, db_path=PROFILE_DB_PATH, max_limit=PROFILE_SEARCH_MAX_LIMIT):
+        self.max_limit = max_limit
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        columns = ", ".join(FTS_COLUMNS)
+        new_values = ", ".join(f"new.{column}" for column in FTS_COLUMNS)
+        old_values = ", ".join(f"old.{column}" for column in FTS_COLUMNS)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS profiles ("
+                "id INTEGER PRIMARY KEY, source_hash TEXT UNIQUE, "
+                f"{', '.join(f'{field} TEXT' for field in PROFILE_FIELDS)}, cv_text TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_profiles_updated ON profiles (updated_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS profile_terms ("
+                "field TEXT NOT NULL, term TEXT NOT NULL, profile_id INTEGER NOT NULL, "
+                "PRIMARY KEY (field, term, profile_id)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_profile_terms_profile ON profile_terms (profile_id)")
+            # Índice de contenido externo: el texto vive en profiles y los triggers lo mantienen sincronizado
+            self._conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS profiles_fts USING fts5({columns}, "
+                "content='profiles', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS profiles_ai AFTER INSERT ON profiles BEGIN "
+                f"INSERT INTO profiles_fts (rowid, {columns}) VALUES (new.id, {new_values}); END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS profiles_ad AFTER DELETE ON profiles BEGIN "
+                f"INSERT INTO profiles_fts (profiles_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS profiles_au AFTER UPDATE ON profiles BEGIN "
+                f"INSERT INTO profiles_fts (profiles_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                f"INSERT INTO profiles_fts (rowid, {columns}) VALUES (new.id, {new_values}); END"
+            )
+
+    def add(self, profile, cv_text, source_hash=None):
+        """Guarda o actualiza un perfil (dict con PROFILE_FIELDS) y sus términos; devuelve su id"""
+        now = time.time()
+        values = [str(profile.get(field) or "") for field in PROFILE_FIELDS]
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in FTS_COLUMNS)
+        with self._lock, self._conn:
+            profile_id = self._conn.execute(
+                f"INSERT INTO profiles (source_hash, {', '.join(FTS_COLUMNS)}, created_at, updated_at) "
+                f"VALUES (?, {', '.join('?' for _ in FTS_COLUMNS)}, ?, ?) "
+                f"ON CONFLICT (source_hash) DO UPDATE SET {assignments}, updated_at = excluded.updated_at "
+                "RETURNING id",
+                (source_hash, *values, cv_text or "", now, now)
+            ).fetchone()[0]
+            self._conn.execute("DELETE FROM profile_terms WHERE profile_id = ?", (profile_id,))
+            self._conn.executemany(
+                "INSERT INTO profile_terms (field, term, profile_id) VALUES (?, ?, ?)",
+                [(field, term, profile_id) for field in TERM_FIELDS for term in split_terms(profile.get(field))]
+            )
+        return profile_id
+
+    def delete(self, profile_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM profile_terms WHERE profile_id = ?", (profile_id,))
+            return self._conn.execute("DELETE FROM profiles WHERE id = ?", (profile_id,)).rowcount > 0
+
+    def get(self, profile_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id, {', '.join(FTS_COLUMNS)}, created_at, updated_at FROM profiles WHERE id = ?",
+                (profile_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+
+    @staticmethod
+    def _row_to_dict(row, extra=()):
+        profile_id, *values = row
+        fields = dict(zip([*FTS_COLUMNS, "created_at", "updated_at", *extra], values))
+        return {
+            "id": profile_id,
+            "perfil": {field: fields[field] for field in PROFILE_FIELDS},
+            "cv": fields["cv_text"],
+            "created_at": fields["created_at"],
+            "updated_at": fields["updated_at"],
+            **{name: fields[name] for name in extra}
+        }
+
+    def search(self, q=None, profesion=None, terms=None, limit=20, offset=0):
+        """Busca perfiles; devuelve {"total", "limit", "offset", "results"}
+
+        `q` busca por prefijo de palabra en todos los campos y el CV, ordenando por bm25
+        con más peso en profesión y tecnologías; `profesion` restringe a esa columna;
+        `terms` ({campo: [valores]}) exige cada valor en su campo, como término exacto o
+        como inicio de término ("ingles" encuentra "ingles avanzado"). Sin texto se
+        ordena por los más recientes.
+        """
+        limit = max(1, min(limit, self.max_limit))
+        offset = max(0, offset)
+        matches = [query for query in (_match_query(q or ""), _match_query(profesion or "", "profesion")) if query]
+
+        conditions, params = [], []
+        for field, values in (terms or {}).items():
+            for value in values:
+                term = normalize_term(value)
+                if not term:
+                    continue
+                # Igualdad o prefijo seguido de espacio: ambos son rangos sobre la clave primaria
+                conditions.append(
+                    "p.id IN (SELECT profile_id FROM profile_terms WHERE field = ? "
+                    "AND (term = ? OR (term > ? AND term < ?)))"
+                )
+                params += [field, term, f"{term} ", f"{term}!"]
+
+        columns = ", ".join(f"p.{column}" for column in FTS_COLUMNS)
+        if matches:
+            weights = ", ".join(str(FTS_WEIGHTS[column]) for column in FTS_COLUMNS)
+            source = "profiles_fts JOIN profiles p ON p.id = profiles_fts.rowid"
+            conditions.insert(0, "profiles_fts MATCH ?")
+            params.insert(0, " AND ".join(f"({query})" for query in matches))
+            extra = (f", bm25(profiles_fts, {weights}) AS score, "
+                     "snippet(profiles_fts, -1, '[', ']', '…', 12) AS snippet")
+            order = "score"
+        else:
+            source = "profiles p"
+            extra = ""
+            order = "p.updated_at DESC"
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM {source} {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT p.id, {columns}, p.created_at, p.updated_at{extra} FROM {source} {where} "
+                f"ORDER BY {order} LIMIT ? OFFSET ?",
+                (*params, limit, offset)
+            ).fetchall()
+        extra_names = ("score", "snippet") if matches else ()
+        results = [self._row_to_dict(row, extra_names) for row in rows]
+        for result in results:
+            if "score" in result:
+                # bm25 es menor cuanto más relevante: se invierte para que mayor sea mejor
+                result["score"] = round(-result["score"], 4)
+        return {"total": total, "limit": limit, "offset": offset, "results": results}
+
+    def stats(self):
+        with self._lock:
+            profiles = self._conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+            terms = self._conn.execute(
+                "SELECT field, COUNT(DISTINCT term) FROM profile_terms GROUP BY field"
+            ).fetchall()
+        return {"profiles": profiles, "distinct_terms": dict(terms)}
+
+profile_store = ProfileStore() if PROFILE_STORE_ENABLED else None
@@ -0,0 +1,226 @@
+import os
+import re
+import logging
+from metrics_service import PROMPT_TOKENS_SAVED
+
+logger = logging.getLogger(__name__)
+
+# Versión de los prompts, parte de la clave de la caché de respuestas: incrementarla al cambiar cualquier prompt
+PROMPT_VERSION = 2
+
+# Presupuesto (tokens estimados) de la transcripción en los prompts de perfil y fusionado
+PROMPT_TRANSCRIPT_TOKENS = int(os.getenv("PROMPT_TRANSCRIPT_TOKENS", 3000))
+# Presupuesto en el prompt del CV, que además recibe el perfil ya extraído
+PROMPT_CV_TRANSCRIPT_TOKENS = int(os.getenv("PROMPT_CV_TRANSCRIPT_TOKENS", 2000))
+
+# Los presupuestos cambian el texto enviado, así que también forman parte de la clave de caché
+PROMPT_CACHE_VERSION = f"{PROMPT_VERSION}-{PROMPT_TRANSCRIPT_TOKENS}-{PROMPT_CV_TRANSCRIPT_TOKENS}"
+
+TRANSCRIPTION_PROMPT = "Transcribe este audio al español. Es una presentación personal o profesional."
+
+PROFILE_SYSTEM_PROMPT = "Eres un asistente que extrae información de perfiles profesionales de textos transcritos. Siempre respondes solo con JSON válido."
+
+CV_SYSTEM_PROMPT = "Eres un asistente especializado en crear perfiles profesionales para hojas de vida. Genera textos persuasivos y profesionales en español."
+
+PROFILE_FIELDS_INSTRUCTIONS = (
+    "- nombre: El nombre de la persona\n"
+    "- profesion: La ocupación actual, cargo o especialidad mencionada\n"
+    "- experiencia: Áreas o temas en los que tiene práctica laboral o conocimiento aplicado\n"
+    "- educacion: Títulos, grados, estudios o formación académica. Si no se menciona explícitamente, infiérelo lógicamente de la profesión (ej. si es 'Contador Público', educación podría ser 'Contaduría Pública'; si es 'Ingeniero de Software', 'Ingeniería de Software')\n"
+    "- tecnologias: Herramientas, softwares, lenguajes o técnicas específicas mencionadas\n"
+    "- idiomas: Lista de idiomas hablados o entendidos\n"
+    "- logros: Reconocimientos, hitos o aportes relevantes\n"
+    "- habilidades_blandas: Habilidades sociales o personales\n"
+)
+
+CV_STYLE_INSTRUCTIONS = (
+    "redacta un perfil profesional optimizado para una hoja de vida en el estilo de resúmenes ejecutivos concisos y impactantes. El perfil debe ser en español, "
+    "profesional y formal, escrito en tercera persona impersonal (sin mencionar el nombre al inicio), estructurado en párrafos cortos y enfocados. "
+    "Sigue esta estructura aproximada: "
+    "- Primer párrafo: Profesión y experiencia clave, destacando especialidades y áreas de dominio. "
+    "- Segundo párrafo: Formación académica y conocimientos técnicos/tecnologías. "
+    "- Tercer párrafo: Capacidades, idiomas y habilidades blandas. "
+    "- Cuarto párrafo: Reconocimientos, logros y compromiso profesional. "
+    "Usa frases impactantes, lenguaje persuasivo y evita redundancias. Integra toda la información relevante de manera coherente."
+)
+
+CV_STYLE_EXAMPLE = (
+    "Ejemplo de estilo: 'Físico Nuclear con sólida experiencia en fisión nuclear, seguridad de plantas y análisis de riesgos operativos. Formación en Ingeniería Nuclear, con dominio de procesos de energía nuclear, control radiológico y sistemas de protección. Capacidad comprobada para trabajar en entornos multidisciplinarios y colaborar en proyectos internacionales gracias a la fluidez en francés y ruso. Reconocido por su escucha activa, comunicación efectiva y disposición al aprendizaje continuo. Comprometido con la excelencia técnica, la innovación científica y la seguridad operacional, orientado a contribuir al desarrollo y mejora de proyectos en el sector energético y nuclear.'"
+)
+
+CV_CLOSING_INSTRUCTIONS = (
+    "Si algún dato no está disponible o es 'No especificado', intégralo sutilmente o omítelo si no aporta valor. "
+    "No uses formato Markdown, placeholders ni texto adicional fuera del perfil. "
+    "El perfil debe ser conciso, persuasivo y adecuado para un CV profesional."
+)
+
+# Prefijos estáticos: las instrucciones van primero y el contenido variable al final, para que
+# el proveedor pueda reutilizar la parte común entre peticiones (caché de prompts). Perfil y
+# fusionado comparten además el inicio.
+_PROFILE_PREFIX = (
+    "Analiza el texto transcrito de un video de presentación personal que aparece al final.\n\n"
+    "Devuelve ÚNICAMENTE un objeto JSON válido con los siguientes campos:\n"
+    f"{PROFILE_FIELDS_INSTRUCTIONS}"
+)
+
+PROFILE_PROMPT_PREFIX = (
+    f"{_PROFILE_PREFIX}\n"
+    "Si algún campo no está presente en el texto y no puede inferirse, usa 'No especificado'.\n\n"
+    "Responde SOLO con el JSON, sin texto adicional.\n\n"
+)
+
+FUSED_PROMPT_PREFIX = (
+    f"{_PROFILE_PREFIX}"
+    "- perfil_cv: Texto del perfil profesional para la hoja de vida, redactado según las instrucciones siguientes\n\n"
+    "Si algún campo del perfil no está presente en el texto y no puede inferirse, usa 'No especificado'.\n\n"
+    f"Para perfil_cv, {CV_STYLE_INSTRUCTIONS}\n\n"
+    f"{CV_STYLE_EXAMPLE}\n\n"
+    f"{CV_CLOSING_INSTRUCTIONS}\n\n"
+    "Responde SOLO con el JSON, sin texto adicional.\n\n"
+)
+
+CV_PROMPT_PREFIX = (
+    "Con base en la transcripción de un video de presentación personal y, si se incluye, la información "
+    f"ya extraída del perfil, que aparecen al final, {CV_STYLE_INSTRUCTIONS}\n\n"
+    f"{CV_STYLE_EXAMPLE}\n\n"
+    f"{CV_CLOSING_INSTRUCTIONS}\n\n"
+)
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    """Estimación de tokens sin tokenizador: una pieza cada 4 letras de palabra y una por signo
+
+    Sobrestima algo los tokenizadores BPE de Llama y Gemini en español, lo que deja
+    margen al aplicar los presupuestos.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PIECES.findall(text))
+
+# Muletillas sin contenido (eh, em, mmm, ah, uh, um), con la coma que suele seguirlas
+_FILLERS = re.compile(r"\s*\b(?:e+h+|e+m+|m{2,}h*|a+h+|u+h+|u+m+)\b,?", re.IGNORECASE)
+# Palabras repetidas seguidas ("yo yo trabajé")
+_REPEATED_WORDS = re.compile(r"\b([^\W\d_]+)(?:[\s,]+\1\b)+", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+# Las frases más largas (transcripciones sin puntuación) se parten para poder recortarlas
+_MAX_UNIT_WORDS = 60
+
+def _normalize(sentence):
+    return " ".join(re.findall(r"\w+", sentence.lower()))
+
+def clean_transcript(text):
+    """Quita muletillas, palabras repetidas y frases duplicadas (bucles de Whisper, solapes entre tramos)"""
+    text = _FILLERS.sub("", text)
+    text = _REPEATED_WORDS.sub(r"\1", text)
+    sentences = []
+    seen = set()
+    for sentence in _SENTENCE_END.split(" ".join(text.split())):
+        key = _normalize(sentence)
+        if not key:
+            continue
+        # Frases cortas ("Gracias.") pueden repetirse con sentido; solo se descartan si van seguidas
+        if key in seen and (len(key.split()) >= 4 or _normalize(sentences[-1]) == key):
+            continue
+        seen.add(key)
+        sentences.append(sentence)
+    return " ".join(sentences)
+
+def _units(text):
+    units = []
+    for sentence in _SENTENCE_END.split(text):
+        words = sentence.split()
+        for start in range(0, len(words), _MAX_UNIT_WORDS):
+            units.append(" ".join(words[start:start + _MAX_UNIT_WORDS]))
+    return units
+
+def _content_words(text):
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 3}
+
+def truncate_transcript(text, budget):
+    """Reduce el texto a `budget` tokens estimados conservando inicio, final y las frases más informativas
+
+    La presentación suele empezar por el nombre y la profesión, así que se guarda la
+    primera mitad del presupuesto para el inicio y una quinta parte para el cierre; el
+    resto se llena con las frases intermedias que aportan más palabras nuevas por token.
+    Los huecos se marcan con "[...]".
+    """
+    units = _units(text)
+    costs = [count_tokens(unit) for unit in units]
+    if sum(costs) <= budget:
+        return text
+
+    kept = set()
+    used = 0
+    for index, cost in enumerate(costs):
+        if used + cost > budget // 2:
+            break
+        kept.add(index)
+        used += cost
+    tail = 0
+    for index in range(len(units) - 1, -1, -1):
+        if index in kept or tail + costs[index] > budget // 5:
+            break
+        kept.add(index)
+        tail += costs[index]
+    used += tail
+
+    vocabulary = set().union(*(_content_words(units[index]) for index in kept))
+    middle = [index for index in range(len(units)) if index not in kept]
+    ranked = sorted(
+        middle, key=lambda index: len(_content_words(units[index]) - vocabulary) / max(costs[index], 1), reverse=True
+    )
+    for index in ranked:
+        # Cada hueco añade un marcador de unos 2 tokens
+        if used + costs[index] + 2 <= budget:
+            kept.add(index)
+            used += costs[index] + 2
+
+    pieces = []
+    for index, unit in enumerate(units):
+        if index in kept:
+            pieces.append(unit)
+        elif not pieces or pieces[-1] != "[...]":
+            pieces.append("[...]")
+    return " ".join(pieces)
+
+def compact_transcript(text, budget, task="profile"):
+    """Limpia la transcripción y la recorta al presupuesto; registra los tokens ahorrados"""
+    before = count_tokens(text)
+    compacted = clean_transcript(text)
+    if count_tokens(compacted) > budget:
+        compacted = truncate_transcript(compacted, budget)
+    after = count_tokens(compacted)
+    if after < before:
+        PROMPT_TOKENS_SAVED.labels(task).inc(before - after)
+        if before > budget:
+            logger.info("Transcripción compactada para %s: %d → %d tokens estimados", task, before, after)
+    return compacted
+
+def _profile_lines(profile_dict):
+    """Perfil como líneas "campo: valor", sin los campos vacíos ni 'No especificado'"""
+    return "\n".join(
+        f"- {field}: {value}" for field, value in profile_dict.items()
+        if field != "error" and value and value != "No especificado"
+    )
+
+def profile_prompt(text):
+    """Prompt para extraer el perfil a partir de la transcripción"""
+    return f"{PROFILE_PROMPT_PREFIX}Texto a analizar:\n{compact_transcript(text, PROMPT_TRANSCRIPT_TOKENS, 'profile')}"
+
+def cv_prompt(transcription, profile_dict):
+    """Prompt para redactar el perfil profesional de la hoja de vida
+
+    Con profile_dict=None el perfil se redacta solo a partir de la transcripción; si
+    hay perfil, la transcripción se recorta con un presupuesto menor porque lo esencial
+    ya viene en él.
+    """
+    if profile_dict is None:
+        return f"{CV_PROMPT_PREFIX}Transcripción: {compact_transcript(transcription, PROMPT_TRANSCRIPT_TOKENS, 'cv')}"
+    return (
+        f"{CV_PROMPT_PREFIX}"
+        f"Información extraída:\n{_profile_lines(profile_dict) or 'Sin datos'}\n\n"
+        f"Transcripción: {compact_transcript(transcription, PROMPT_CV_TRANSCRIPT_TOKENS, 'cv')}"
+    )
+
+def fused_prompt(transcription):
+    """Prompt para obtener perfil y texto de CV en una sola respuesta JSON"""
+    return f"{FUSED_PROMPT_PREFIX}Texto a analizar:\n{compact_transcript(transcription, PROMPT_TRANSCRIPT_TOKENS, 'fused')}"
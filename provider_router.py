@@ -0,0 +1,390 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from metrics_service import PROVIDER_SECONDS, PROVIDER_IN_FLIGHT, PROVIDER_FALLBACKS, PROVIDER_HEDGES
+
+logger = logging.getLogger(__name__)
+
+ROUTER_RETRIES = int(os.getenv("ROUTER_RETRIES", 1))
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "false").lower() == "true"
+# Espera mínima antes de lanzar la petición de cobertura (hedge) al segundo proveedor
+ROUTER_HEDGE_MIN_DELAY = float(os.getenv("ROUTER_HEDGE_MIN_DELAY", 1.0))
+# Espera usada mientras no hay suficientes muestras para estimar el p95
+ROUTER_HEDGE_DEFAULT_DELAY = float(os.getenv("ROUTER_HEDGE_DEFAULT_DELAY", 5.0))
+ROUTER_TIMEOUTS = {
+    "transcribe": float(os.getenv("ROUTER_TIMEOUT_TRANSCRIBE", 120)),
+    "chat": float(os.getenv("ROUTER_TIMEOUT_CHAT", 60))
+}
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 3))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", 0.5))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+# Errores 4xx que sí dependen del estado del proveedor (timeout, conflicto, límite de tasa)
+RETRYABLE_CLIENT_STATUSES = {408, 409, 425, 429}
+
+class ProviderError(Exception):
+    """Fallo de un proveedor concreto (error, timeout o respuesta inválida)"""
+
+class ProviderRejectedError(ProviderError):
+    """El proveedor rechazó la petición con un error 4xx (p. ej. 400 o 413): no se reintenta en él"""
+
+    def __init__(self, message, provider, status_code):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+
+class HedgeFailedError(ProviderError):
+    """Fallaron el primario y el secundario de una cobertura; `errors` guarda el ProviderError de cada uno"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(str(error) for error in errors))
+        self.errors = errors
+
+class AllProvidersFailedError(Exception):
+    """Ningún proveedor disponible pudo completar la operación"""
+
+def client_error_status(error):
+    """Código 4xx no reintentable de una excepción de un SDK de proveedor, o None
+
+    Groq/OpenAI exponen `status_code`, httpx `response.status_code` y google-api-core `code`.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in RETRYABLE_CLIENT_STATUSES:
+        return int(status)
+    return None
+
+class ProviderHealth:
+    """Latencias y errores recientes de un proveedor en una operación, con circuit breaker
+
+    El circuito se abre tras CIRCUIT_FAILURE_THRESHOLD fallos seguidos o si la tasa de
+    error de la ventana supera CIRCUIT_ERROR_RATE; pasado CIRCUIT_OPEN_SECONDS deja
+    pasar una única petición de prueba (half-open) que decide si se vuelve a cerrar.
+    """
+
+    def __init__(self, name, window=50, min_calls=5):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def available(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= CIRCUIT_OPEN_SECONDS
+        return not self.probe_in_flight
+
+    def acquire(self):
+        """Reserva una petición; con el circuito semiabierto solo se permite una prueba a la vez"""
+        if self.state == "closed":
+            return True
+        if not self.available():
+            return False
+        self.state = "half_open"
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self, latency=None):
+        if self.state == "half_open":
+            # La prueba salió bien: el historial de errores previo ya no es representativo
+            self.outcomes.clear()
+        if latency is not None:
+            self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if (self.state == "half_open"
+                or self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD
+                or (len(self.outcomes) >= self.min_calls and self.error_rate() >= CIRCUIT_ERROR_RATE)):
+            if self.state != "open":
+                logger.warning(
+                    "Circuito abierto para %s: %d fallos seguidos, tasa de error %.0f%%",
+                    self.name, self.consecutive_failures, self.error_rate() * 100
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Libera la prueba half-open de una petición cancelada sin contarla"""
+        self.probe_in_flight = False
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, fraction):
+        if len(self.latencies) < self.min_calls:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def snapshot(self):
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate(), 3),
+            "consecutive_failures": self.consecutive_failures,
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "samples": len(self.outcomes)
+        }
+
+class ProviderRouter:
+    """Enruta operaciones entre proveedores según su salud, con reintentos, timeouts y hedging
+
+    Un proveedor es cualquier objeto con atributo `name` y métodos asíncronos por
+    operación (p. ej. `transcribe`, `chat`) que lanzan excepción al fallar, por lo que
+    se puede probar con proveedores falsos locales. La salud se lleva por
+    (proveedor, operación): las latencias de Whisper no afectan al hedging del chat y
+    sus fallos no abren el circuito del chat del mismo proveedor.
+    """
+
+    def __init__(self, providers, retries=ROUTER_RETRIES, hedge=ROUTER_HEDGE, timeouts=None):
+        self.providers = list(providers)
+        self.health = {}
+        self.retries = retries
+        self.hedge = hedge
+        self.timeouts = dict(ROUTER_TIMEOUTS, **(timeouts or {}))
+
+    def add_provider(self, provider):
+        """Añade un proveedor al final del orden de preferencia (p. ej. al inicializarse en diferido)"""
+        self.providers.append(provider)
+
+    def _health(self, provider, operation):
+        key = (provider.name, operation)
+        if key not in self.health:
+            self.health[key] = ProviderHealth(f"{provider.name}/{operation}")
+        return self.health[key]
+
+    def _candidates(self, operation, rejected=()):
+        """Proveedores que soportan la operación, tienen el circuito cerrado y no han rechazado la petición"""
+        return [
+            p for p in self.providers
+            if hasattr(p, operation) and p.name not in rejected and self._health(p, operation).available()
+        ]
+
+    def _hedge_delay(self, provider, operation):
+        p95 = self._health(provider, operation).percentile(0.95)
+        if p95 is None:
+            return ROUTER_HEDGE_DEFAULT_DELAY
+        return max(ROUTER_HEDGE_MIN_DELAY, p95)
+
+    async def _attempt(self, provider, operation, args, kwargs, validate):
+        """Ejecuta la operación en un proveedor; devuelve (proveedor, resultado)"""
+        health = self._health(provider, operation)
+        if not health.acquire():
+            raise ProviderError(f"{provider.name}: circuito abierto")
+        timeout = self.timeouts.get(operation)
+        in_flight = PROVIDER_IN_FLIGHT.labels(provider.name)
+        in_flight.inc()
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(getattr(provider, operation)(*args, **kwargs), timeout)
+        except asyncio.CancelledError:
+            health.release()
+            PROVIDER_SECONDS.labels(provider.name, operation, "cancelled").observe(time.monotonic() - started)
+            raise
+        except asyncio.TimeoutError:
+            health.record_failure()
+            PROVIDER_SECONDS.labels(provider.name, operation, "timeout").observe(time.monotonic() - started)
+            raise ProviderError(f"{provider.name}: timeout de {timeout} s en {operation}")
+        except Exception as e:
+            status = client_error_status(e)
+            if status is not None:
+                # La petición es inválida para este proveedor (audio dañado, demasiado grande...): no es un fallo suyo
+                health.release()
+                PROVIDER_SECONDS.labels(provider.name, operation, "rejected").observe(time.monotonic() - started)
+                raise ProviderRejectedError(f"{provider.name}: HTTP {status}: {str(e)}", provider.name, status) from e
+            health.record_failure()
+            PROVIDER_SECONDS.labels(provider.name, operation, "error").observe(time.monotonic() - started)
+            raise ProviderError(f"{provider.name}: {str(e)}") from e
+        finally:
+            in_flight.dec()
+        elapsed = time.monotonic() - started
+        health.record_success(elapsed)
+        PROVIDER_SECONDS.labels(provider.name, operation, "ok").observe(elapsed)
+
+        if validate is not None:
+            try:
+                result = validate(result)
+            except ValueError as e:
+                # El proveedor respondió, pero el contenido no sirve: probar con otro sin penalizarlo
+                raise ProviderError(f"{provider.name}: respuesta inválida: {str(e)}") from e
+        return provider, result
+
+    async def _attempt_hedged(self, primary, secondary, operation, args, kwargs, validate):
+        """Lanza el primario y, si tarda más que su p95, también el secundario; gana el primero válido
+
+        Si fallan ambos lanza HedgeFailedError con los dos errores, para que `call` sepa
+        qué proveedores rechazaron la petición.
+        """
+        first = asyncio.create_task(self._attempt(primary, operation, args, kwargs, validate))
+        pending = {first}
+        try:
+            delay = self._hedge_delay(primary, operation)
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                if first.exception() is None:
+                    return first.result()
+                # El primario falló rápido: el secundario se usa como reintento normal
+                logger.warning("Error en %s: %s", operation, first.exception())
+                try:
+                    return await self._attempt(secondary, operation, args, kwargs, validate)
+                except ProviderError as e:
+                    raise HedgeFailedError([first.exception(), e]) from e
+
+            logger.info(
+                "%s supera %.2f s en %s, lanzando petición de cobertura a %s",
+                primary.name, delay, operation, secondary.name
+            )
+            PROVIDER_HEDGES.labels(operation).inc()
+            pending.add(asyncio.create_task(self._attempt(secondary, operation, args, kwargs, validate)))
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+            raise HedgeFailedError(errors)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(self, operation, *args, validate=None, with_provider=False, **kwargs):
+        """Ejecuta `operation` en el mejor proveedor disponible
+
+        `validate` (opcional) transforma el resultado o lanza ValueError si no es válido.
+        Con with_provider=True devuelve (proveedor, resultado). Un proveedor que rechaza
+        la petición con un 4xx no se vuelve a intentar en esta llamada.
+        Lanza AllProvidersFailedError si se agotan proveedores y reintentos.
+        """
+        errors = []
+        rejected = set()
+        for attempt in range(self.retries + 1):
+            candidates = self._candidates(operation, rejected)
+            index = 0
+            while index < len(candidates):
+                provider = candidates[index]
+                try:
+                    if self.hedge and index + 1 < len(candidates):
+                        # El secundario corre dentro de la cobertura; si ambos fallan se sigue después de él
+                        index += 1
+                        winner, result = await self._attempt_hedged(
+                            provider, candidates[index], operation, args, kwargs, validate
+                        )
+                    else:
+                        winner, result = await self._attempt(provider, operation, args, kwargs, validate)
+                    if winner is not self.providers[0]:
+                        PROVIDER_FALLBACKS.labels(operation).inc()
+                    return (winner, result) if with_provider else result
+                except ProviderError as e:
+                    logger.warning("Error en %s: %s", operation, e)
+                    for error in e.errors if isinstance(e, HedgeFailedError) else [e]:
+                        errors.append(str(error))
+                        if isinstance(error, ProviderRejectedError):
+                            rejected.add(error.provider)
+                finally:
+                    index += 1
+
+            if rejected and not self._candidates(operation, rejected):
+                # Todos los que quedan rechazaron la petición: reintentarla daría el mismo error
+                break
+            if attempt < self.retries:
+                # Espera exponencial con jitter antes de la siguiente ronda
+                await asyncio.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.5))
+
+        if not errors:
+            errors.append("todos los proveedores tienen el circuito abierto")
+        raise AllProvidersFailedError(f"{operation} falló: {'; '.join(errors)}")
+
+    async def stream(self, operation, *args, **kwargs):
+        """Como call, para operaciones que devuelven un generador asíncrono; genera (proveedor, fragmento)
+
+        Solo se cambia de proveedor si el fallo ocurre antes del primer fragmento; después
+        se lanza AllProvidersFailedError. El timeout de la operación se aplica a la espera
+        de cada fragmento. Las latencias de streaming no alimentan el p95 del hedging.
+        """
+        errors = []
+        rejected = set()
+        timeout = self.timeouts.get(operation)
+        for attempt in range(self.retries + 1):
+            for provider in self._candidates(operation, rejected):
+                health = self._health(provider, operation)
+                if not health.acquire():
+                    continue
+                chunks = getattr(provider, operation)(*args, **kwargs)
+                emitted = False
+                in_flight = PROVIDER_IN_FLIGHT.labels(provider.name)
+                in_flight.inc()
+                started = time.monotonic()
+                outcome = "error"
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            break
+                        emitted = True
+                        yield provider, chunk
+                    outcome = "ok"
+                except (asyncio.CancelledError, GeneratorExit):
+                    health.release()
+                    outcome = "cancelled"
+                    raise
+                except Exception as e:
+                    status = client_error_status(e)
+                    if status is not None:
+                        health.release()
+                        rejected.add(provider.name)
+                        outcome = "rejected"
+                    else:
+                        health.record_failure()
+                    message = f"{provider.name}: {str(e) or f'timeout de {timeout} s'}"
+                    logger.warning("Error en %s: %s", operation, message)
+                    if emitted:
+                        raise AllProvidersFailedError(f"{operation} interrumpido: {message}") from e
+                    errors.append(message)
+                    continue
+                finally:
+                    in_flight.dec()
+                    PROVIDER_SECONDS.labels(provider.name, operation, outcome).observe(time.monotonic() - started)
+                    await chunks.aclose()
+                health.record_success()
+                if provider is not self.providers[0]:
+                    PROVIDER_FALLBACKS.labels(operation).inc()
+                return
+
+            if rejected and not self._candidates(operation, rejected):
+                break
+            if attempt < self.retries:
+                await asyncio.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.5))
+
+        if not errors:
+            errors.append("todos los proveedores tienen el circuito abierto")
+        raise AllProvidersFailedError(f"{operation} falló: {'; '.join(errors)}")
+
+    def snapshot(self):
+        """Estado por proveedor y operación: {"groq": {"chat": {...}, "transcribe": {...}}}"""
+        status = {provider.name: {} for provider in self.providers}
+        for (name, operation), health in self.health.items():
+            status.setdefault(name, {})[operation] = health.snapshot()
+        return status
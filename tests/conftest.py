@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Los módulos del servicio están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Algunos módulos abren sus bases de datos al importarse: que no toquen las del directorio de trabajo
+_data_dir = tempfile.mkdtemp(prefix="video-service-tests-")
+for name, filename in (("CACHE_DB_PATH", "cache.db"), ("PROFILE_DB_PATH", "profiles.db"), ("JOB_DB_PATH", "jobs.db")):
+    os.environ.setdefault(name, os.path.join(_data_dir, filename))
+os.environ.setdefault("UPLOAD_SESSION_DIR", os.path.join(_data_dir, "uploads"))
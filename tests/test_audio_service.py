@@ -0,0 +1,35 @@
+import io
+import os
+import tempfile
+import pytest
+from audio_service import needs_seekable_input, open_file_path
+
+def _box(box_type, payload=b""):
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+def test_needs_seekable_input_detects_moov_position():
+    faststart = _box(b"ftyp", b"isom" + bytes(4)) + _box(b"moov", bytes(16)) + _box(b"mdat", bytes(16))
+    moov_at_end = _box(b"ftyp", b"isom" + bytes(4)) + _box(b"mdat", bytes(16)) + _box(b"moov", bytes(16))
+    assert needs_seekable_input(faststart) is False
+    assert needs_seekable_input(moov_at_end) is True
+
+def test_needs_seekable_input_quicktime_without_ftyp():
+    assert needs_seekable_input(_box(b"wide") + _box(b"mdat", bytes(16)) + _box(b"moov", bytes(16))) is True
+    assert needs_seekable_input(_box(b"moov", bytes(16)) + _box(b"mdat", bytes(16))) is False
+
+def test_needs_seekable_input_other_containers_and_truncated_heads():
+    assert needs_seekable_input(b"\x1a\x45\xdf\xa3" + bytes(60)) is False
+    # Cabecera cortada antes de encontrar moov o con un tamaño de caja inválido
+    assert needs_seekable_input(_box(b"ftyp", b"isom" + bytes(4)) + _box(b"free", bytes(100))[:20]) is True
+    assert needs_seekable_input(_box(b"ftyp", b"isom" + bytes(4)) + bytes(4) + b"moof") is True
+
+@pytest.mark.skipif(not os.path.isdir("/dev/fd"), reason="el sistema no expone /dev/fd")
+def test_open_file_path_reads_spooled_upload_in_place():
+    spooled = tempfile.SpooledTemporaryFile(max_size=4)
+    spooled.write(b"video subido")
+    spooled.seek(0)
+    path, fd = open_file_path(spooled)
+    assert fd == spooled.fileno()
+    with open(path, "rb") as reopened:
+        assert reopened.read() == b"video subido"
+    assert open_file_path(io.BytesIO(b"video")) is None
@@ -0,0 +1,58 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import batch_service
+from batch_service import save_batch
+from preflight_service import UploadTooLargeError
+
+def _zip(**members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(batch_service, "MAX_UPLOAD_BYTES", 100)
+    monkeypatch.setattr(batch_service, "MAX_BATCH_BYTES", 250)
+
+def test_save_batch_keeps_plain_files_and_zip_members(limits):
+    items = save_batch([
+        ("a.mov", "video/quicktime", io.BytesIO(b"a" * 50)),
+        ("lote.zip", "application/zip", _zip(**{"b.mp4": b"b" * 60, "notas.txt": b"x"})),
+    ])
+    try:
+        assert [(item["filename"], item["video_size"]) for item in items] == [("a.mov", 50), ("b.mp4", 60)]
+        assert items[0]["path"].endswith(".mov")
+    finally:
+        batch_service.remove_files(*(item["path"] for item in items))
+
+def test_save_batch_rejects_oversized_plain_file(limits, monkeypatch):
+    saved = []
+    original = batch_service.save_upload
+
+    def save_upload(*args, **kwargs):
+        saved.append(original(*args, **kwargs))
+        return saved[-1]
+
+    monkeypatch.setattr(batch_service, "save_upload", save_upload)
+    with pytest.raises(UploadTooLargeError) as error:
+        save_batch([
+            ("a.mp4", "video/mp4", io.BytesIO(b"a" * 10)),
+            ("b.mp4", "video/mp4", io.BytesIO(b"b" * 101)),
+        ])
+    assert error.value.details["max_bytes"] == 100
+    assert saved and not any(os.path.exists(path) for path, _, _ in saved)
+
+def test_save_batch_counts_plain_files_and_zips_against_batch_total(limits):
+    with pytest.raises(UploadTooLargeError) as error:
+        save_batch([
+            ("lote.zip", "application/zip", _zip(**{"a.mp4": b"a" * 90, "b.mp4": b"b" * 90})),
+            ("c.mp4", "video/mp4", io.BytesIO(b"c" * 90)),
+        ])
+    assert error.value.details["max_bytes"] == 250
@@ -0,0 +1,34 @@
+import time
+from cache_service import ResultCache, TieredCache
+
+def test_result_cache_keys_include_the_transcription_version(tmp_path):
+    cache = ResultCache(TieredCache("results", db_path=str(tmp_path / "cache.db")))
+    entry = {"audio_hash": "a" * 64, "transcription": "Hola", "profile_json": "{}", "cv_profile": "CV"}
+    cache.set(entry, "v" * 64, version="vad=off")
+
+    assert cache.get_by_audio("a" * 64, version="vad=off") == entry
+    assert cache.get_by_video("v" * 64, version="vad=off") == entry
+    # Activar el VAD cambia la transcripción: los resultados anteriores no se reutilizan
+    assert cache.get_by_audio("a" * 64, version="vad=30,-45") is None
+    assert cache.get_by_video("v" * 64, version="vad=30,-45") is None
+
+def test_memory_hits_keep_hot_entries_from_size_eviction(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    cache = TieredCache("llm", db_path=str(tmp_path / "cache.db"), max_bytes=25, ttl=1000)
+    cache.set("hot", "x" * 10)
+    clock[0] += 1
+    cache.set("cold", "y" * 10)
+
+    # Los aciertos se sirven de memoria; el primero dentro del intervalo no escribe en SQLite
+    clock[0] += 5
+    assert cache.get("hot") == "x" * 10
+    clock[0] += 5
+    assert cache.get("hot") == "x" * 10
+    clock[0] += 1
+    cache.set("new", "z" * 10)
+
+    assert cache.stats()["memory_hits"] == 2
+    assert cache.get("cold") is None
+    assert cache.get("hot") == "x" * 10
+    assert TieredCache("llm", db_path=str(tmp_path / "cache.db"), ttl=1000).get("hot") == "x" * 10
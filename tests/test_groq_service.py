@@ -0,0 +1,39 @@
+import json
+import pytest
+from groq_service import ProfileValidationError, _parse_fused_response, validate_profile
+
+def test_validate_profile_joins_string_lists_and_fills_empty_fields():
+    profile = validate_profile({"nombre": " Ana ", "tecnologias": ["Python", " ", "SQL"], "idiomas": []})
+    assert profile["nombre"] == "Ana"
+    assert profile["tecnologias"] == "Python, SQL"
+    assert profile["idiomas"] == "No especificado"
+    assert profile["logros"] == "No especificado"
+
+def test_validate_profile_coerces_numbers_mixed_lists_and_objects():
+    profile = validate_profile({
+        "experiencia": 8,
+        "tecnologias": ["Python", 3],
+        "educacion": [
+            {"titulo": "Ingeniería de Sistemas", "institucion": "Universidad del Valle"},
+            {"titulo": "Maestría en Datos", "anio": 2021}
+        ],
+        "idiomas": {"español": "nativo", "inglés": "B2"}
+    })
+    assert profile["experiencia"] == "8"
+    assert profile["tecnologias"] == "Python, 3"
+    assert profile["educacion"] == (
+        "titulo: Ingeniería de Sistemas, institucion: Universidad del Valle; "
+        "titulo: Maestría en Datos, anio: 2021"
+    )
+    assert profile["idiomas"] == "español: nativo, inglés: B2"
+
+def test_validate_profile_rejects_non_objects():
+    with pytest.raises(ProfileValidationError):
+        validate_profile(["Ana", "Python"])
+
+def test_fused_response_requires_cv_profile():
+    with pytest.raises(ProfileValidationError, match="perfil_cv"):
+        _parse_fused_response(json.dumps({"nombre": "Ana", "perfil_cv": ""}))
+    profile_json, cv_profile = _parse_fused_response(json.dumps({"nombre": "Ana", "perfil_cv": "Ingeniera."}))
+    assert json.loads(profile_json)["nombre"] == "Ana"
+    assert cv_profile == "Ingeniera."
@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import asyncio
+import subprocess
+import pytest
+from fastapi.testclient import TestClient
+import main
+from job_service import JobManager, MemoryJobStore, QueueFullError, SQLiteJobStore, _is_stale_owner
+
+def _video(tmp_path, name="video.mp4"):
+    path = tmp_path / name
+    path.write_bytes(b"video")
+    return str(path)
+
+async def _wait_for(manager, job_id, statuses=("done", "failed")):
+    for _ in range(200):
+        job = await manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"El trabajo sigue en {job['status']}")
+
+class RecordingStore(MemoryJobStore):
+    """Registra el orden de las escrituras; las primeras tardan más, como un SQLite ocupado"""
+
+    def __init__(self):
+        super().__init__()
+        self.updates = []
+        self.delays = [0.05, 0.04, 0.03, 0.02, 0.01]
+
+    def update(self, job_id, **fields):
+        time.sleep(self.delays.pop(0) if self.delays else 0)
+        self.updates.append(fields.get("stage") or fields.get("status"))
+        super().update(job_id, **fields)
+
+def test_job_runs_handler_and_records_stages_in_order(tmp_path):
+    calls = []
+
+    async def handler(video_path, on_stage=None, **options):
+        calls.append((video_path, options))
+        on_stage("transcribing")
+        on_stage("extracting_profile")
+        await asyncio.sleep(0)
+        on_stage("generating_cv")
+        return {"perfil": {"nombre": "Ana"}}
+
+    async def scenario():
+        store = RecordingStore()
+        manager = JobManager(handler, store=store, workers=1, queue_size=2)
+        await manager.start()
+        video = _video(tmp_path)
+        job_id = await manager.submit(video, llm_mode="fused")
+        job = await _wait_for(manager, job_id)
+        await manager.stop()
+        return store, video, job
+
+    store, video, job = asyncio.run(scenario())
+    assert calls == [(video, {"llm_mode": "fused"})]
+    assert job["status"] == "done"
+    assert job["stage"] is None
+    assert job["result"] == {"perfil": {"nombre": "Ana"}}
+    # Cada etapa espera a la anterior aunque su escritura en hilo termine antes
+    assert store.updates == ["running", "transcribing", "extracting_profile", "generating_cv", "done"]
+    assert not os.path.exists(video)
+
+def test_failed_handler_marks_the_job_failed(tmp_path):
+    async def handler(video_path, on_stage=None):
+        raise RuntimeError("FFmpeg no disponible")
+
+    async def scenario():
+        manager = JobManager(handler, store=MemoryJobStore(), workers=1)
+        await manager.start()
+        job_id = await manager.submit(_video(tmp_path))
+        job = await _wait_for(manager, job_id)
+        await manager.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "failed"
+    assert job["error"] == "FFmpeg no disponible"
+
+def test_submit_raises_queue_full_with_retry_after(tmp_path):
+    async def scenario():
+        # Sin workers arrancados nada sale de la cola
+        manager = JobManager(None, store=MemoryJobStore(), workers=2, queue_size=1)
+        await manager.submit(_video(tmp_path))
+        assert manager.is_full()
+        with pytest.raises(QueueFullError) as error:
+            await manager.submit(_video(tmp_path, "otro.mp4"))
+        return error.value.retry_after
+
+    # Dos trabajos pendientes de ~30 s repartidos entre dos workers
+    assert asyncio.run(scenario()) == 30
+
+def test_jobs_endpoint_returns_429_with_retry_after(monkeypatch, tmp_path):
+    manager = JobManager(None, store=MemoryJobStore(), workers=1, queue_size=1)
+    asyncio.run(manager.submit(_video(tmp_path)))
+    monkeypatch.setattr(main, "job_manager", manager)
+
+    response = TestClient(main.app).post("/jobs", files={"file": ("video.mp4", b"video", "video/mp4")})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(manager.retry_after())
+    assert response.json()["retry_after"] == manager.retry_after()
+
+def test_stop_fails_queued_and_running_jobs_and_removes_videos(tmp_path):
+    started = None
+
+    async def handler(video_path, on_stage=None):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def scenario():
+        nonlocal started
+        started = asyncio.Event()
+        manager = JobManager(handler, store=MemoryJobStore(), workers=1, queue_size=4)
+        await manager.start()
+        running, queued = _video(tmp_path, "a.mp4"), _video(tmp_path, "b.mp4")
+        running_id = await manager.submit(running)
+        queued_id = await manager.submit(queued)
+        await started.wait()
+        await manager.stop()
+        return [await manager.get(job_id) for job_id in (running_id, queued_id)], running, queued
+
+    (running_job, queued_job), running, queued = asyncio.run(scenario())
+    assert running_job["status"] == "failed"
+    assert running_job["error"] == "Trabajo cancelado"
+    assert queued_job["status"] == "failed"
+    assert queued_job["error"] == "Servicio detenido antes de procesar el trabajo"
+    assert not os.path.exists(running) and not os.path.exists(queued)
+
+def test_memory_store_discards_oldest_jobs():
+    store = MemoryJobStore(max_jobs=2)
+    for job_id in ("a", "b", "c"):
+        store.create(job_id)
+    assert store.get("a") is None
+    assert store.get("c")["status"] == "queued"
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def test_is_stale_owner():
+    host = socket.gethostname()
+    assert _is_stale_owner(f"{host}:{os.getpid()}") is True
+    assert _is_stale_owner(f"{host}:{_dead_pid()}") is True
+    assert _is_stale_owner(f"{host}:{os.getppid()}") is False
+    # De otros hosts no se puede saber: se respetan
+    assert _is_stale_owner(f"otro-{host}:{_dead_pid()}") is False
+    assert _is_stale_owner("sin-pid") is False
+
+def test_sqlite_store_migrates_owner_and_fails_only_stale_jobs(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    with sqlite3.connect(db_path) as conn:
+        # Esquema anterior a la columna owner, con un trabajo huérfano a medias
+        conn.execute(
+            "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, result TEXT, "
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO jobs VALUES ('legacy', 'running', NULL, NULL, NULL, 0, 0)")
+
+    store = SQLiteJobStore(db_path)
+    host = socket.gethostname()
+    store.create("dead", owner=f"{host}:{_dead_pid()}")
+    store.create("alive", owner=f"{host}:{os.getppid()}")
+    store.create("remote", owner=f"otro-{host}:1")
+    store.create("finished", owner=f"{host}:{_dead_pid()}")
+    store.update("finished", status="done", result={"perfil": {}})
+
+    store.fail_incomplete("Trabajo interrumpido", _is_stale_owner)
+
+    assert store.get("legacy")["status"] == "failed"
+    assert store.get("dead")["status"] == "failed"
+    assert store.get("dead")["error"] == "Trabajo interrumpido"
+    assert store.get("alive")["status"] == "queued"
+    assert store.get("remote")["status"] == "queued"
+    assert store.get("finished")["status"] == "done"
+    assert store.get("finished")["result"] == {"perfil": {}}
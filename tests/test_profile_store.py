@@ -0,0 +1,72 @@
+import pytest
+from profile_store import ProfileStore, normalize_term, split_terms
+
+ANA = {
+    "nombre": "Ana Pérez", "profesion": "Ingeniera de datos", "experiencia": "5 años en análisis",
+    "educacion": "Ingeniería Informática", "tecnologias": "Python, PostgreSQL y Spark",
+    "idiomas": "Español (nativo), inglés avanzado", "logros": "No especificado",
+    "habilidades_blandas": "Comunicación; liderazgo"
+}
+LUIS = {
+    "nombre": "Luis Gómez", "profesion": "Desarrollador frontend", "experiencia": "3 años",
+    "educacion": "Diseño", "tecnologias": "JavaScript, React", "idiomas": "Español, francés",
+    "logros": "", "habilidades_blandas": "Trabajo en equipo"
+}
+
+@pytest.fixture
+def store(tmp_path):
+    return ProfileStore(str(tmp_path / "profiles.db"))
+
+def _ids(result):
+    return [item["id"] for item in result["results"]]
+
+def test_split_terms_normalizes_accents_and_asides():
+    assert normalize_term("Inglés (C1)") == "ingles"
+    assert split_terms("Español (nativo), inglés y francés") == ["espanol", "frances", "ingles"]
+    assert split_terms("No especificado") == []
+
+def test_search_folds_accents(store):
+    ana = store.add(ANA, "Me llamo Ana y analizo datos.", source_hash="ana")
+    store.add(LUIS, "Hago interfaces.", source_hash="luis")
+
+    result = store.search(q="analisis")
+    assert _ids(result) == [ana]
+    assert result["total"] == 1
+    assert "score" in result["results"][0]
+    assert _ids(store.search(q="ingenieria")) == [ana]
+    assert _ids(store.search(profesion="ingeniera")) == [ana]
+    # Sin texto se listan todos, los más recientes primero
+    assert store.search()["total"] == 2
+
+def test_search_filters_by_terms(store):
+    ana = store.add(ANA, "", source_hash="ana")
+    luis = store.add(LUIS, "", source_hash="luis")
+
+    assert _ids(store.search(terms={"idiomas": ["Español"]})) in ([ana, luis], [luis, ana])
+    # Un valor encuentra también los términos que empiezan por él ("ingles avanzado")
+    assert _ids(store.search(terms={"idiomas": ["inglés"]})) == [ana]
+    assert _ids(store.search(terms={"idiomas": ["español"], "tecnologias": ["react"]})) == [luis]
+    assert _ids(store.search(terms={"tecnologias": ["java"]})) == []
+    assert _ids(store.search(q="datos", terms={"tecnologias": ["spark"]})) == [ana]
+
+def test_update_reindexes_and_delete_removes(store):
+    profile_id = store.add(ANA, "", source_hash="ana")
+    updated = dict(ANA, tecnologias="Rust, Kafka")
+    assert store.add(updated, "", source_hash="ana") == profile_id
+
+    assert _ids(store.search(q="kafka")) == [profile_id]
+    assert _ids(store.search(q="postgresql")) == []
+    assert _ids(store.search(terms={"tecnologias": ["rust"]})) == [profile_id]
+    assert _ids(store.search(terms={"tecnologias": ["python"]})) == []
+
+    assert store.delete(profile_id) is True
+    assert store.get(profile_id) is None
+    assert store.search(q="kafka")["total"] == 0
+    assert store.search(terms={"tecnologias": ["rust"]})["total"] == 0
+    assert store.delete(profile_id) is False
+
+@pytest.mark.parametrize("query", ['"', "python AND", "NOT (", "nombre:", "*", 'spark" OR "x', "NEAR(a b"])
+def test_malformed_fts_queries_do_not_raise(store, query):
+    store.add(ANA, "", source_hash="ana")
+    result = store.search(q=query, profesion=query)
+    assert result["total"] == len(result["results"])
@@ -0,0 +1,14 @@
+from prompts import count_tokens, truncate_transcript
+
+def test_truncate_transcript_within_budget_is_unchanged():
+    text = "Me llamo Ana. Soy ingeniera de software."
+    assert truncate_transcript(text, 100) == text
+
+def test_truncate_transcript_keeps_start_and_end_within_budget():
+    sentences = [f"Frase número {index} sobre el proyecto {index * 7} con Python y datos." for index in range(60)]
+    text = " ".join(["Me llamo Ana y soy ingeniera de software.", *sentences, "Gracias por su atención."])
+    truncated = truncate_transcript(text, 200)
+    assert count_tokens(truncated) <= 200
+    assert truncated.startswith("Me llamo Ana y soy ingeniera de software.")
+    assert truncated.endswith("Gracias por su atención.")
+    assert "[...]" in truncated
@@ -0,0 +1,214 @@
+import time
+import asyncio
+import pytest
+import provider_router
+from provider_router import AllProvidersFailedError, ProviderRouter, client_error_status
+
+class StatusError(Exception):
+    """Error con código HTTP, como los APIStatusError de los SDK de Groq/OpenAI"""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+class FakeProvider:
+    """Proveedor local: responde tras `delay` segundos, o falla si tiene `error`"""
+
+    def __init__(self, name, result=None, error=None, delay=0.0):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def chat(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result if self.result is not None else f"{self.name}: {prompt}"
+
+    async def transcribe(self, audio):
+        return await self.chat(audio)
+
+def _call(router, **kwargs):
+    return asyncio.run(router.call("chat", "hola", with_provider=True, **kwargs))
+
+def _expire_circuit(router, name):
+    router.health[(name, "chat")].opened_at -= provider_router.CIRCUIT_OPEN_SECONDS + 1
+
+@pytest.fixture(autouse=True)
+def fast_router(monkeypatch):
+    monkeypatch.setattr(provider_router, "CIRCUIT_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(provider_router, "CIRCUIT_OPEN_SECONDS", 30)
+    monkeypatch.setattr(provider_router, "ROUTER_HEDGE_DEFAULT_DELAY", 0.05)
+
+def test_primary_answers_when_healthy():
+    primary, secondary = FakeProvider("a"), FakeProvider("b")
+    provider, result = _call(ProviderRouter([primary, secondary], retries=0))
+    assert provider is primary
+    assert result == "a: hola"
+    assert secondary.calls == 0
+
+def test_falls_back_when_primary_fails():
+    primary, secondary = FakeProvider("a", error=RuntimeError("500")), FakeProvider("b")
+    router = ProviderRouter([primary, secondary], retries=0)
+    provider, result = _call(router)
+    assert provider is secondary
+    assert result == "b: hola"
+    assert router.health[("a", "chat")].consecutive_failures == 1
+
+def test_timeout_counts_as_failure():
+    primary, secondary = FakeProvider("a", delay=1), FakeProvider("b")
+    router = ProviderRouter([primary, secondary], retries=0, timeouts={"chat": 0.05})
+    provider, _ = _call(router)
+    assert provider is secondary
+    assert router.health[("a", "chat")].consecutive_failures == 1
+
+def test_circuit_opens_half_opens_and_closes():
+    primary, secondary = FakeProvider("a", error=RuntimeError("500")), FakeProvider("b")
+    router = ProviderRouter([primary, secondary], retries=0)
+
+    # Dos fallos seguidos abren el circuito y el primario deja de recibir peticiones
+    _call(router)
+    assert router.health[("a", "chat")].state == "closed"
+    _call(router)
+    assert router.health[("a", "chat")].state == "open"
+    provider, _ = _call(router)
+    assert provider is secondary
+    assert primary.calls == 2
+
+    # Pasado CIRCUIT_OPEN_SECONDS se deja pasar una prueba; si falla, vuelve a abrirse
+    _expire_circuit(router, "a")
+    provider, _ = _call(router)
+    assert provider is secondary
+    assert primary.calls == 3
+    assert router.health[("a", "chat")].state == "open"
+
+    # Mientras la prueba está en curso el circuito está semiabierto y no admite otra
+    _expire_circuit(router, "a")
+    primary.error, primary.delay = None, 0.1
+
+    async def concurrent_calls():
+        probe = asyncio.create_task(router.call("chat", "hola", with_provider=True))
+        await asyncio.sleep(0.02)
+        assert router.health[("a", "chat")].state == "half_open"
+        other = await router.call("chat", "hola", with_provider=True)
+        return await probe, other
+
+    (probe_provider, _), (other_provider, _) = asyncio.run(concurrent_calls())
+    assert probe_provider is primary
+    assert other_provider is secondary
+    assert router.health[("a", "chat")].state == "closed"
+    assert router.health[("a", "chat")].consecutive_failures == 0
+
+def test_validation_failure_falls_through_without_opening_circuit():
+    primary, secondary = FakeProvider("a", result="no es json"), FakeProvider("b", result='{"ok": true}')
+
+    def validate(result):
+        if not result.startswith("{"):
+            raise ValueError("respuesta sin JSON")
+        return result
+
+    router = ProviderRouter([primary, secondary], retries=0)
+    for _ in range(3):
+        provider, result = _call(router, validate=validate)
+        assert provider is secondary
+        assert result == '{"ok": true}'
+    # Responder con contenido inválido no penaliza la salud del proveedor
+    assert router.health[("a", "chat")].state == "closed"
+    assert primary.calls == 3
+
+def test_hedge_uses_secondary_when_primary_is_slow():
+    primary, secondary = FakeProvider("a", delay=2), FakeProvider("b", delay=0.01)
+    router = ProviderRouter([primary, secondary], retries=0, hedge=True)
+    started = time.monotonic()
+    provider, result = _call(router)
+    assert provider is secondary
+    assert result == "b: hola"
+    assert time.monotonic() - started < 1
+    # La petición lenta se cancela sin contarse como fallo
+    assert router.health[("a", "chat")].state == "closed"
+    assert router.health[("a", "chat")].consecutive_failures == 0
+
+def test_hedge_not_launched_when_primary_is_fast():
+    primary, secondary = FakeProvider("a"), FakeProvider("b")
+    provider, _ = _call(ProviderRouter([primary, secondary], retries=0, hedge=True))
+    assert provider is primary
+    assert secondary.calls == 0
+
+def test_hedge_falls_back_when_primary_fails_fast():
+    primary, secondary = FakeProvider("a", error=RuntimeError("500")), FakeProvider("b")
+    provider, _ = _call(ProviderRouter([primary, secondary], retries=0, hedge=True))
+    assert provider is secondary
+    assert secondary.calls == 1
+
+@pytest.mark.parametrize("primary_delay", [0.0, 0.1])
+def test_hedge_keeps_the_primary_rejection_when_both_fail(primary_delay):
+    # Sin demora el primario falla antes de la cobertura; con 0.1 s ambos corren a la vez
+    primary = FakeProvider("a", error=StatusError(400), delay=primary_delay)
+    secondary = FakeProvider("b", error=RuntimeError("500"), delay=0.2)
+    router = ProviderRouter([primary, secondary], retries=1, hedge=True)
+    with pytest.raises(AllProvidersFailedError, match="a: HTTP 400.*b: 500"):
+        _call(router)
+    # La siguiente ronda ya no vuelve al primario que rechazó la petición
+    assert primary.calls == 1
+    assert secondary.calls == 2
+
+def test_all_providers_failed():
+    providers = [FakeProvider("a", error=RuntimeError("500")), FakeProvider("b", error=RuntimeError("503"))]
+    with pytest.raises(AllProvidersFailedError, match="a: 500.*b: 503"):
+        _call(ProviderRouter(providers, retries=0))
+
+def test_providers_without_the_operation_are_skipped():
+    class TranscribeOnly:
+        name = "whisper"
+
+        async def transcribe(self, audio):
+            return "texto"
+
+    provider, _ = _call(ProviderRouter([TranscribeOnly(), FakeProvider("b")], retries=0))
+    assert provider.name == "b"
+
+def test_health_is_tracked_per_operation():
+    primary, secondary = FakeProvider("a", error=RuntimeError("500")), FakeProvider("b")
+    router = ProviderRouter([primary, secondary], retries=0)
+    for _ in range(2):
+        asyncio.run(router.call("transcribe", b"audio"))
+    assert router.health[("a", "transcribe")].state == "open"
+
+    # Los fallos de transcripción no abren el circuito del chat del mismo proveedor
+    primary.error = None
+    provider, _ = _call(router)
+    assert provider is primary
+    assert router.health[("a", "chat")].state == "closed"
+    assert set(router.snapshot()["a"]) == {"transcribe", "chat"}
+
+def test_client_errors_fall_through_without_retry_or_circuit_failure():
+    primary, secondary = FakeProvider("a", error=StatusError(413)), FakeProvider("b")
+    router = ProviderRouter([primary, secondary], retries=2)
+    provider, _ = _call(router)
+    assert provider is secondary
+    assert primary.calls == 1
+    assert router.health[("a", "chat")].consecutive_failures == 0
+
+def test_client_errors_everywhere_stop_without_retry_rounds():
+    providers = [FakeProvider("a", error=StatusError(400)), FakeProvider("b", error=StatusError(400))]
+    router = ProviderRouter(providers, retries=2)
+    started = time.monotonic()
+    with pytest.raises(AllProvidersFailedError, match="HTTP 400"):
+        _call(router)
+    assert time.monotonic() - started < 0.5
+    assert [provider.calls for provider in providers] == [1, 1]
+    assert all(health.state == "closed" and health.consecutive_failures == 0 for health in router.health.values())
+
+def test_client_error_status_classification():
+    class GoogleStyleError(Exception):
+        code = 400
+
+    assert client_error_status(StatusError(413)) == 413
+    assert client_error_status(GoogleStyleError()) == 400
+    # Límite de tasa y errores del servidor sí cuentan como fallos del proveedor
+    assert client_error_status(StatusError(429)) is None
+    assert client_error_status(StatusError(503)) is None
+    assert client_error_status(RuntimeError("sin código")) is None
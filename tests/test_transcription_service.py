@@ -0,0 +1,27 @@
+from transcription_service import merge_overlap, plan_segments, stitch_transcripts
+
+def test_plan_segments_short_audio_is_one_segment():
+    assert plan_segments(60, [], max_seconds=120) == [(0.0, 60, False)]
+
+def test_plan_segments_cuts_in_the_middle_of_silences():
+    segments = plan_segments(250, [(99, 101), (199, 201)], max_seconds=120, overlap=1.5)
+    assert segments == [(0.0, 100.0, False), (100.0, 200.0, False), (200.0, 250, False)]
+
+def test_plan_segments_overlaps_without_silences():
+    segments = plan_segments(250, [], max_seconds=120, overlap=2)
+    assert segments == [(0.0, 120.0, False), (118.0, 238.0, True), (236.0, 250, True)]
+
+def test_plan_segments_ignores_silences_too_early_in_the_window():
+    # Un corte a los 10 s dejaría un tramo diminuto: se usa el solape
+    segments = plan_segments(200, [(9, 11)], max_seconds=120, overlap=1)
+    assert segments[0] == (0.0, 120.0, False)
+    assert segments[1][2] is True
+
+def test_merge_overlap_removes_repeated_words():
+    assert merge_overlap("Hola, soy Ana y trabajo", "y trabajo en Python.") == "en Python."
+    assert merge_overlap("Hola, soy Ana", "Trabajo en Python.") == "Trabajo en Python."
+
+def test_stitch_transcripts_only_merges_overlapped_segments():
+    segments = [(0, 120, False), (118, 200, True), (200, 250, False)]
+    texts = ["Soy Ana y trabajo", "y trabajo en Python", "en Python también"]
+    assert stitch_transcripts(texts, segments) == "Soy Ana y trabajo en Python en Python también"
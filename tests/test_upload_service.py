@@ -0,0 +1,10 @@
+from upload_service import merge_ranges, missing_ranges
+
+def test_merge_ranges_joins_overlapping_and_contiguous():
+    assert merge_ranges([[10, 20], [0, 5], [5, 8], [15, 30], [40, 50]]) == [[0, 8], [10, 30], [40, 50]]
+    assert merge_ranges([]) == []
+
+def test_missing_ranges():
+    assert missing_ranges([[0, 8], [10, 30]], 40) == [[8, 10], [30, 40]]
+    assert missing_ranges([], 40) == [[0, 40]]
+    assert missing_ranges([[0, 40]], 40) == []
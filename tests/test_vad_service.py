@@ -0,0 +1,22 @@
+import numpy as np
+from audio_service import SAMPLE_RATE, PCM_BYTES_PER_SECOND
+from vad_service import trim_silence
+
+def _tone(seconds, amplitude=8000, frequency=440):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype("<i2")
+
+def _silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype="<i2")
+
+def test_trim_silence_removes_edges_and_long_pauses():
+    pcm = np.concatenate((_silence(2), _tone(1), _silence(3), _tone(1), _silence(2))).tobytes()
+    trimmed, removed = trim_silence(pcm, keep_silence=0.3)
+    assert removed > 5
+    assert len(trimmed) == len(pcm) - int(round(removed * SAMPLE_RATE)) * 2
+    # Toda la voz se conserva
+    assert len(trimmed) / PCM_BYTES_PER_SECOND >= 2
+
+def test_trim_silence_keeps_audio_without_speech():
+    pcm = _silence(3).tobytes()
+    assert trim_silence(pcm) == (pcm, 0.0)
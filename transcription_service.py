@@ -0,0 +1,157 @@
+import os
+import re
+import asyncio
+import logging
+from audio_service import (
+    MAX_AUDIO_BYTES, SAMPLE_RATE, PCM_BYTES_PER_SECOND, decode_pcm, encode_pcm, detect_silences
+)
+from groq_service import transcribe_bytes, transcribe_audio_bytes_async
+from metrics_service import VAD_REMOVED_SECONDS, track_stage
+from provider_router import AllProvidersFailedError
+from vad_service import VAD_CONFIG, VAD_ENABLED, trim_silence
+
+logger = logging.getLogger(__name__)
+
+# Prefijos con los que groq_service reporta errores en lugar de lanzar excepciones
+ERROR_PREFIXES = ("Error", "ADVERTENCIA")
+
+# "auto": segmentar solo audios largos; "always": segmentar siempre; "never": una sola petición
+SEGMENT_MODE = os.getenv("SEGMENT_MODE", "auto")
+# Duración a partir de la cual "auto" segmenta el audio
+SEGMENT_THRESHOLD_SECONDS = float(os.getenv("SEGMENT_THRESHOLD_SECONDS", 180))
+# Duración máxima de cada tramo enviado a Whisper
+SEGMENT_MAX_SECONDS = float(os.getenv("SEGMENT_MAX_SECONDS", 120))
+# Solape entre tramos cuando no hay un silencio donde cortar
+SEGMENT_OVERLAP_SECONDS = float(os.getenv("SEGMENT_OVERLAP_SECONDS", 1.5))
+SEGMENT_CONCURRENCY = int(os.getenv("SEGMENT_CONCURRENCY", 4))
+SILENCE_NOISE_DB = float(os.getenv("SILENCE_NOISE_DB", -35))
+SILENCE_MIN_SECONDS = float(os.getenv("SILENCE_MIN_SECONDS", 0.4))
+
+# El VAD y la segmentación cambian el texto transcrito, así que forman parte de la clave
+# de la caché de resultados (como PROMPT_CACHE_VERSION en la de chat)
+TRANSCRIPTION_CACHE_VERSION = f"vad={VAD_CONFIG};segment={SEGMENT_MODE}," + ",".join(f"{value:g}" for value in (
+    SEGMENT_THRESHOLD_SECONDS, SEGMENT_MAX_SECONDS, SEGMENT_OVERLAP_SECONDS, SILENCE_NOISE_DB, SILENCE_MIN_SECONDS
+))
+
+# Límite global de peticiones de tramos en vuelo, compartido entre todas las peticiones
+_segment_semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+
+def plan_segments(duration, silences, max_seconds=SEGMENT_MAX_SECONDS, overlap=SEGMENT_OVERLAP_SECONDS):
+    """Divide [0, duration] en tramos de como máximo max_seconds cortando en mitad de los silencios
+
+    Devuelve una lista de (inicio, fin, solapado); solapado indica que el tramo empieza
+    antes del final del anterior porque no había silencio donde cortar.
+    """
+    midpoints = [(start + end) / 2 for start, end in silences]
+    segments = []
+    start = 0.0
+    overlapped = False
+    while duration - start > max_seconds:
+        limit = start + max_seconds
+        # Evitar tramos diminutos: el corte debe caer en la segunda mitad de la ventana
+        candidates = [point for point in midpoints if start + max_seconds / 2 < point <= limit]
+        if candidates:
+            cut = max(candidates)
+            segments.append((start, cut, overlapped))
+            start, overlapped = cut, False
+        else:
+            segments.append((start, limit, overlapped))
+            start, overlapped = limit - overlap, True
+    segments.append((start, duration, overlapped))
+    return segments
+
+def _normalize_word(word):
+    return re.sub(r"[^\w]", "", word.lower())
+
+def merge_overlap(previous, current, max_words=25):
+    """Elimina del inicio de `current` las palabras que repiten el final de `previous`"""
+    previous_words = [_normalize_word(word) for word in previous.split()]
+    current_words = current.split()
+    normalized = [_normalize_word(word) for word in current_words]
+    for size in range(min(max_words, len(previous_words), len(current_words)), 0, -1):
+        if previous_words[-size:] == normalized[:size]:
+            return " ".join(current_words[size:])
+    return current
+
+def stitch_transcripts(texts, segments):
+    """Une las transcripciones de los tramos en orden, quitando el texto duplicado por el solape"""
+    result = ""
+    for text, (_, _, overlapped) in zip(texts, segments):
+        if overlapped and result:
+            text = merge_overlap(result, text)
+        result = f"{result} {text}".strip() if text else result
+    return result
+
+async def _transcribe_segment(index, pcm, filename, mime_type):
+    """Codifica y transcribe un tramo; los reintentos del router repiten solo este tramo"""
+    audio_bytes = await encode_pcm(pcm)
+    try:
+        async with _segment_semaphore:
+            return await transcribe_bytes(audio_bytes, filename, mime_type)
+    except AllProvidersFailedError as e:
+        logger.error("Error transcribiendo el tramo %d: %s", index, e)
+        return f"Error al transcribir: {str(e)}"
+
+async def _trim_silence(pcm, audio_bytes):
+    """Recorta el silencio del PCM; devuelve (pcm, audio codificado), recodificando solo si cambió"""
+    with track_stage("vad"):
+        trimmed, removed = await asyncio.to_thread(trim_silence, pcm)
+        if removed <= 0:
+            return pcm, audio_bytes
+        VAD_REMOVED_SECONDS.inc(removed)
+        logger.info(
+            "VAD: eliminados %.1f s sin voz de %.1f s de audio", removed, len(pcm) / PCM_BYTES_PER_SECOND
+        )
+        return trimmed, await encode_pcm(trimmed)
+
+def _should_segment(audio_bytes, duration):
+    """Decide si se transcribe por tramos; None si hace falta conocer la duración
+
+    Un audio mayor que MAX_AUDIO_BYTES se segmenta siempre: el proveedor lo rechazaría.
+    """
+    if len(audio_bytes) > MAX_AUDIO_BYTES or SEGMENT_MODE == "always":
+        return True
+    if SEGMENT_MODE == "never":
+        return False
+    if duration is None:
+        return None
+    return duration > SEGMENT_THRESHOLD_SECONDS
+
+async def transcribe_segmented(audio_bytes, filename="audio.flac", mime_type="audio/flac", duration=None):
+    """Transcribe audios largos en tramos concurrentes cortados en los silencios
+
+    Para audios cortos (según SEGMENT_MODE) se hace una sola petición como antes. Con
+    VAD_ENABLED se quitan antes los tramos sin voz y solo se envía lo que queda. Si se
+    conoce `duration` (segundos, del progreso de la extracción), el audio solo se
+    decodifica a PCM cuando hay que segmentarlo o pasar el VAD.
+    """
+    if not VAD_ENABLED and _should_segment(audio_bytes, duration) is False:
+        return await transcribe_audio_bytes_async(audio_bytes, filename, mime_type)
+
+    pcm = await decode_pcm(audio_bytes)
+    if VAD_ENABLED:
+        pcm, audio_bytes = await _trim_silence(pcm, audio_bytes)
+    duration = len(pcm) / PCM_BYTES_PER_SECOND
+    if not _should_segment(audio_bytes, duration):
+        return await transcribe_audio_bytes_async(audio_bytes, filename, mime_type)
+
+    silences = await detect_silences(pcm, SILENCE_NOISE_DB, SILENCE_MIN_SECONDS)
+    segments = plan_segments(duration, silences)
+    logger.info(
+        "Audio de %.1f s dividido en %d tramos (%d silencios detectados)",
+        duration, len(segments), len(silences)
+    )
+
+    def pcm_slice(start, end):
+        # Offsets alineados a muestras de 16 bits
+        return pcm[int(start * SAMPLE_RATE) * 2:int(end * SAMPLE_RATE) * 2]
+
+    texts = await asyncio.gather(*(
+        _transcribe_segment(index, pcm_slice(start, end), filename, mime_type)
+        for index, (start, end, _) in enumerate(segments)
+    ))
+
+    failed = [text for text in texts if text.startswith(ERROR_PREFIXES)]
+    if failed:
+        return failed[0]
+    return stitch_transcripts(texts, segments)
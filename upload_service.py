@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+import threading
+from audio_service import COPY_CHUNK_SIZE, remove_files
+from preflight_service import MAX_UPLOAD_BYTES, RequestRejectedError, UploadTooLargeError
+
+try:
+    import fcntl
+except ImportError:
+    # Sin flock (Windows) los metadatos solo se protegen dentro de cada proceso
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Directorio de las subidas reanudables: <id>.part con los bytes y <id>.json con los rangos recibidos
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join(tempfile.gettempdir(), "upload-sessions"))
+# Las sesiones sin actividad durante este tiempo se eliminan
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", 32 * 1024 * 1024))
+# Cada cuánto se releen los rangos del disco al seguir una subida (los bloques pueden llegar a otro worker)
+UPLOAD_POLL_INTERVAL = float(os.getenv("UPLOAD_POLL_INTERVAL", 0.5))
+# Empezar a extraer el audio mientras se reciben los bloques (contenedores legibles desde un pipe)
+UPLOAD_PROGRESSIVE = os.getenv("UPLOAD_PROGRESSIVE", "true").lower() == "true"
+
+_UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+class UploadSessionError(RequestRejectedError):
+    """Petición inválida sobre una sesión de subida"""
+
+def merge_ranges(ranges):
+    """Ordena y une rangos [inicio, fin) solapados o contiguos"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def missing_ranges(ranges, size):
+    """Huecos de [0, size) que no cubren los rangos (ya fusionados)"""
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+def _read_meta(path):
+    try:
+        with open(path) as meta_file:
+            return json.load(meta_file)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+class UploadSession:
+    """Subida por bloques de un video: archivo disperso del tamaño final más los rangos recibidos
+
+    Los bloques se escriben en su offset, así que admiten reintentos y llegar desordenados.
+    Los metadatos se fusionan con los del disco al guardarse, de modo que varios workers
+    pueden recibir bloques de la misma sesión. `extraction` guarda la extracción progresiva
+    que haya arrancado este proceso (ver pipeline.start_session_extraction).
+    """
+
+    def __init__(self, upload_id, size, directory=UPLOAD_SESSION_DIR, filename=None, ranges=None,
+                 finalized=False, created_at=None, updated_at=None):
+        self.id = upload_id
+        self.size = size
+        self.filename = filename
+        self.ranges = merge_ranges(ranges or [])
+        self.finalized = finalized
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+        self.data_path = os.path.join(directory, f"{upload_id}.part")
+        self.meta_path = os.path.join(directory, f"{upload_id}.json")
+        self.extraction = None
+        self.streamable = None
+        self.deleted = False
+        self._fd = None
+        self._lock = threading.Lock()
+        self._changed = asyncio.Event()
+
+    @property
+    def offset(self):
+        """Bytes contiguos recibidos desde el inicio: hasta aquí se puede leer el video"""
+        return self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+
+    @property
+    def received(self):
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def complete(self):
+        return self.offset >= self.size
+
+    def _open(self):
+        if self._fd is None:
+            self._fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o600)
+        return self._fd
+
+    def close(self):
+        with self._lock:
+            self.deleted = True
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def _pwrite(self, data, position):
+        with self._lock:
+            if self.deleted:
+                raise UploadSessionError("upload_not_found", "La subida se eliminó", 404)
+            os.pwrite(self._open(), data, position)
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.offset,
+            "received": self.received,
+            "ranges": self.ranges,
+            "missing": missing_ranges(self.ranges, self.size),
+            "finalized": self.finalized,
+            "expires_at": self.updated_at + UPLOAD_SESSION_TTL
+        }
+
+    def _merge(self, meta):
+        if meta is not None:
+            self.ranges = merge_ranges(self.ranges + meta["ranges"])
+            self.finalized = self.finalized or meta["finalized"]
+            self.updated_at = max(self.updated_at, meta["updated_at"])
+
+    def save(self):
+        """Fusiona con los metadatos del disco y los reescribe de forma atómica (bloqueante)"""
+        with self._lock:
+            if self.deleted:
+                return
+            fd = self._open()
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                self._merge(_read_meta(self.meta_path))
+                self.updated_at = time.time()
+                meta = {
+                    "size": self.size, "filename": self.filename, "ranges": self.ranges,
+                    "finalized": self.finalized, "created_at": self.created_at, "updated_at": self.updated_at
+                }
+                temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+                with open(temp_path, "w") as meta_file:
+                    json.dump(meta, meta_file)
+                os.replace(temp_path, self.meta_path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def reload(self):
+        """Incorpora los rangos que hayan guardado otros workers (bloqueante)"""
+        meta = _read_meta(self.meta_path)
+        if meta is None and not os.path.exists(self.data_path):
+            self.deleted = True
+        with self._lock:
+            self._merge(meta)
+
+    def _add_range(self, start, end):
+        with self._lock:
+            self.ranges = merge_ranges(self.ranges + [[start, end]])
+        self._changed.set()
+
+    async def write(self, offset, chunks, limit=UPLOAD_CHUNK_MAX_BYTES):
+        """Escribe en `offset` el bloque que llega como flujo; devuelve los bytes escritos
+
+        Si la conexión se corta a mitad, lo recibido hasta ese momento queda registrado
+        y el cliente puede continuar desde el offset que indique la sesión.
+        """
+        if self.finalized:
+            raise UploadSessionError("upload_finalized", "La subida ya se finalizó", 409)
+        if offset < 0 or offset > self.size:
+            raise UploadSessionError(
+                "invalid_offset", f"Offset fuera del archivo (0-{self.size})", 416, size=self.size
+            )
+        position = offset
+        try:
+            async for data in chunks:
+                if position + len(data) > self.size:
+                    raise UploadSessionError(
+                        "range_exceeded", "El bloque supera el tamaño declarado", 416, size=self.size
+                    )
+                if position + len(data) - offset > limit:
+                    raise UploadSessionError(
+                        "chunk_too_large", f"El bloque supera el máximo de {limit} bytes", 413, max_bytes=limit
+                    )
+                await asyncio.to_thread(self._pwrite, data, position)
+                position += len(data)
+                self._add_range(offset, position)
+        finally:
+            if position > offset and not self.deleted:
+                await asyncio.to_thread(self.save)
+        return position - offset
+
+    async def finalize(self):
+        """Cierra la sesión a nuevos bloques; falla con 409 si aún faltan rangos"""
+        await asyncio.to_thread(self.reload)
+        if not self.complete:
+            raise UploadSessionError(
+                "upload_incomplete", "Faltan bloques por subir", 409,
+                missing=missing_ranges(self.ranges, self.size)
+            )
+        self.finalized = True
+        await asyncio.to_thread(self.save)
+
+    async def read_head(self, size):
+        """Primeros bytes contiguos del video (menos si todavía no han llegado)"""
+        def read():
+            with open(self.data_path, "rb") as data_file:
+                return data_file.read(min(size, self.offset))
+        return await asyncio.to_thread(read)
+
+    async def follow(self):
+        """Recorre el video desde el inicio a medida que llegan los bytes contiguos
+
+        Termina al llegar al tamaño declarado; si la sesión se elimina antes, lanza
+        UploadSessionError.
+        """
+        # Descriptor propio: sigue siendo legible aunque la sesión se borre entretanto
+        data_file = await asyncio.to_thread(open, self.data_path, "rb")
+        try:
+            async for data in self._follow(data_file):
+                yield data
+        finally:
+            await asyncio.to_thread(data_file.close)
+
+    async def _follow(self, data_file):
+        position = 0
+        while position < self.size:
+            self._changed.clear()
+            available = self.offset
+            if available <= position:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), UPLOAD_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self.reload)
+                if self.deleted:
+                    raise UploadSessionError("upload_not_found", "La subida se eliminó", 404)
+                continue
+            data = await asyncio.to_thread(os.pread, data_file.fileno(), min(available - position, COPY_CHUNK_SIZE), position)
+            position += len(data)
+            yield data
+
+class UploadStore:
+    """Sesiones de subida reanudables guardadas en disco y compartidas por los workers"""
+
+    def __init__(self, directory=UPLOAD_SESSION_DIR, ttl=UPLOAD_SESSION_TTL, max_bytes=MAX_UPLOAD_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions = {}
+
+    def create(self, size, filename=None):
+        """Reserva el archivo disperso del tamaño final y guarda la sesión (bloqueante)"""
+        if size <= 0:
+            raise UploadSessionError("invalid_size", "El tamaño del video debe ser mayor que cero")
+        if size > self.max_bytes:
+            raise UploadTooLargeError(self.max_bytes)
+        self.cleanup()
+        os.makedirs(self.directory, exist_ok=True)
+        session = UploadSession(uuid.uuid4().hex, size, self.directory, filename)
+        # ftruncate reserva el tamaño sin ocupar disco hasta que se escriben los bloques
+        os.ftruncate(session._open(), size)
+        session.save()
+        self._sessions[session.id] = session
+        logger.info("Subida %s creada: %d bytes", session.id[:12], size)
+        return session
+
+    def get(self, upload_id):
+        """Sesión por id, cargándola del disco si la creó otro worker (bloqueante)"""
+        if not _UPLOAD_ID.fullmatch(upload_id):
+            raise UploadSessionError("upload_not_found", "Subida no encontrada", 404)
+        session = self._sessions.get(upload_id)
+        if session is not None:
+            session.reload()
+            if not session.deleted:
+                return session
+            self._forget(upload_id)
+        meta = _read_meta(os.path.join(self.directory, f"{upload_id}.json"))
+        if meta is None:
+            raise UploadSessionError("upload_not_found", "Subida no encontrada", 404)
+        session = UploadSession(upload_id, directory=self.directory, **meta)
+        self._sessions[upload_id] = session
+        return session
+
+    def _forget(self, upload_id):
+        session = self._sessions.pop(upload_id, None)
+        if session is not None:
+            # Una extracción progresiva en curso lo detecta en follow() y termina sola
+            session.close()
+
+    def delete(self, upload_id):
+        """Elimina la sesión y sus archivos (bloqueante)"""
+        self._forget(upload_id)
+        base = os.path.join(self.directory, upload_id)
+        remove_files(f"{base}.part", f"{base}.json")
+
+    def cleanup(self):
+        """Elimina las sesiones sin actividad durante más de `ttl` segundos (bloqueante)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        expired = 0
+        now = time.time()
+        for name in names:
+            upload_id, extension = os.path.splitext(name)
+            if extension != ".part" or not _UPLOAD_ID.fullmatch(upload_id):
+                continue
+            meta = _read_meta(os.path.join(self.directory, f"{upload_id}.json"))
+            try:
+                updated_at = meta["updated_at"] if meta else os.path.getmtime(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            if now - updated_at > self.ttl:
+                self.delete(upload_id)
+                expired += 1
+        if expired:
+            logger.info("Eliminadas %d subidas caducadas", expired)
+        return expired
+
+upload_store = UploadStore()
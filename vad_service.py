@@ -0,0 +1,99 @@
+import os
+from audio_service import SAMPLE_RATE
+
+# Recorte de los tramos sin voz antes de transcribir (desactivado por defecto). numpy se
+# importa dentro de las funciones, así que desactivado no retrasa el arranque en frío
+VAD_ENABLED = os.getenv("VAD_ENABLED", "false").lower() == "true"
+# Duración de cada trama sobre la que se mide la energía
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", 30))
+# Energía mínima (dBFS) para considerar voz; se sube con el ruido de fondo
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", -45))
+# Margen sobre el ruido de fondo (percentil 10 de la energía) y bajo el nivel de voz (percentil 90)
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", 10))
+# Solo se tocan los tramos sin voz más largos que esto
+VAD_MIN_SILENCE_SECONDS = float(os.getenv("VAD_MIN_SILENCE_SECONDS", 0.6))
+# Ráfagas de energía más cortas que esto (clics, golpes) no cuentan como voz
+VAD_MIN_SPEECH_SECONDS = float(os.getenv("VAD_MIN_SPEECH_SECONDS", 0.1))
+# Margen que se conserva antes y después de cada tramo de voz
+VAD_PADDING_SECONDS = float(os.getenv("VAD_PADDING_SECONDS", 0.2))
+# Duración a la que se comprimen las pausas internas (0 las elimina)
+VAD_KEEP_SILENCE_SECONDS = float(os.getenv("VAD_KEEP_SILENCE_SECONDS", 0.3))
+
+# Configuración efectiva del recorte, para las claves de caché de lo que se transcribe con él
+VAD_CONFIG = ",".join(f"{value:g}" for value in (
+    VAD_FRAME_MS, VAD_THRESHOLD_DB, VAD_MARGIN_DB, VAD_MIN_SILENCE_SECONDS,
+    VAD_MIN_SPEECH_SECONDS, VAD_PADDING_SECONDS, VAD_KEEP_SILENCE_SECONDS
+)) if VAD_ENABLED else "off"
+
+def _runs(mask):
+    """Tramos consecutivos en True de una máscara; devuelve (inicios, fines) en índices"""
+    import numpy as np
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def frame_energy_db(samples, frame_size):
+    """Energía media de cada trama completa en dBFS"""
+    import numpy as np
+    count = len(samples) // frame_size
+    frames = samples[:count * frame_size].reshape(count, frame_size).astype(np.float32) / 32768.0
+    return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+def speech_mask(energy_db, frame_seconds, threshold_db=VAD_THRESHOLD_DB, margin_db=VAD_MARGIN_DB,
+                min_silence=VAD_MIN_SILENCE_SECONDS, min_speech=VAD_MIN_SPEECH_SECONDS,
+                padding=VAD_PADDING_SECONDS):
+    """Marca las tramas con voz según la energía, con margen alrededor y sin pausas cortas"""
+    import numpy as np
+    noise_floor, speech_level = np.percentile(energy_db, [10, 90])
+    # El umbral se adapta al ruido de fondo sin pasar del nivel de voz
+    threshold = max(threshold_db, min(noise_floor + margin_db, speech_level - margin_db))
+    mask = energy_db > threshold
+
+    starts, ends = _runs(mask)
+    for start, end in zip(starts, ends):
+        if (end - start) * frame_seconds < min_speech:
+            mask[start:end] = False
+
+    # Las pausas internas cortas se conservan como voz
+    starts, ends = _runs(~mask)
+    for start, end in zip(starts, ends):
+        if 0 < start and end < len(mask) and (end - start) * frame_seconds < min_silence:
+            mask[start:end] = True
+
+    # Dilatar la voz con el margen: una trama es voz si hay voz a menos de `padding`
+    pad = int(round(padding / frame_seconds))
+    if pad > 0 and mask.any():
+        window = np.ones(2 * pad + 1, dtype=np.int32)
+        mask = np.convolve(mask.astype(np.int32), window, mode="same") > 0
+    return mask
+
+def trim_silence(pcm, frame_ms=VAD_FRAME_MS, keep_silence=VAD_KEEP_SILENCE_SECONDS, **thresholds):
+    """Elimina el silencio inicial y final y comprime las pausas largas de un PCM s16le mono
+
+    Devuelve (pcm_recortado, segundos_eliminados). Si no se detecta voz se devuelve el
+    audio original, para que el proveedor decida.
+    """
+    import numpy as np
+    samples = np.frombuffer(pcm, dtype="<i2")
+    frame_size = SAMPLE_RATE * frame_ms // 1000
+    if len(samples) < frame_size:
+        return pcm, 0.0
+
+    frame_seconds = frame_size / SAMPLE_RATE
+    mask = speech_mask(frame_energy_db(samples, frame_size), frame_seconds, **thresholds)
+    if not mask.any():
+        return pcm, 0.0
+    # Las muestras sobrantes tras la última trama completa siguen a esa trama
+    mask = np.repeat(mask, frame_size)
+    mask = np.concatenate((mask, np.full(len(samples) - len(mask), mask[-1])))
+
+    starts, ends = _runs(mask)
+    keep = int(keep_silence * SAMPLE_RATE)
+    pieces = []
+    for index, (start, end) in enumerate(zip(starts, ends)):
+        if index > 0:
+            # Inicio de la pausa original, para que el proveedor siga viendo un corte natural
+            pieces.append(samples[ends[index - 1]:min(ends[index - 1] + keep, start)])
+        pieces.append(samples[start:end])
+    trimmed = np.concatenate(pieces)
+    removed = (len(samples) - len(trimmed)) / SAMPLE_RATE
+    return trimmed.tobytes(), removed